@@ -1,3 +1,5 @@
+import copy
+
 from pash_annotations.datatypes.BasicDatatypes import Flag, ArgStringType, Operand
 from pash_annotations.datatypes.BasicDatatypesWithIO import OptionWithIO
 from pash_annotations.datatypes.CommandInvocationInitial import CommandInvocationInitial
@@ -93,6 +95,33 @@ def get_parallelizability_info_from_cmd_invocation_util(cmd_invocationInitial :
 def construct_property_container_from_list_of_properties(list_properties):
     return CommandProperties(dict(list_properties))
 
+# returns a copy of cmd_inv where the io vars are renamed according to var_renaming;
+# in contrast to deepcopy (which CommandInvocationWithIOVars does on construction),
+# flags, options, and operands are shared since they are never modified in place
+# (the lists that hold them and the access map are always replaced or copied)
+def copy_cmd_inv_with_io_vars_renamed(cmd_inv, var_renaming):
+    new_cmd_inv = copy.copy(cmd_inv)
+    new_cmd_inv.map_var(lambda var: var_renaming.get(var, var))
+    new_cmd_inv.access_map = {var_renaming.get(var, var): access
+                              for var, access in cmd_inv.access_map.items()}
+    return new_cmd_inv
+
+# constructs a command invocation that takes ownership of the given (freshly built) lists
+# instead of deep-copying them like the CommandInvocationWithIOVars constructor does
+def make_cmd_inv_with_io_vars_without_copying(cmd_name, flag_option_list, operand_list,
+                                              implicit_use_of_streaming_input, implicit_use_of_streaming_output,
+                                              access_map):
+    cmd_inv = CommandInvocationWithIOVars(cmd_name=cmd_name,
+                                          flag_option_list=[],
+                                          operand_list=[],
+                                          implicit_use_of_streaming_input=implicit_use_of_streaming_input,
+                                          implicit_use_of_streaming_output=implicit_use_of_streaming_output,
+                                          access_map={})
+    cmd_inv.flag_option_list = flag_option_list
+    cmd_inv.operand_list = operand_list
+    cmd_inv.access_map = access_map
+    return cmd_inv
+
 # this function is needed to wrap a node in `r_wrap`
 def to_arg_from_cmd_inv_with_io_vars_without_streaming_inputs_or_outputs_for_wrapping(cmd_inv, edges):
     # we already expand here
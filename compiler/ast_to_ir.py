@@ -1,12 +1,9 @@
-import subprocess
-
 from shasta.ast_node import *
 from sh_expand.expand import expand_command, ExpansionState
 
 from shell_ast.ast_util import *
 from ir import *
 from util import *
-from parse import from_ast_objects_to_shell
 
 ## TODO: Separate the ir stuff to the bare minimum and 
 ##       try to move this to the shell_ast folder.
@@ -229,82 +226,6 @@ def compile_node_for(ast_node, fileIdGen, config):
     return compiled_ast
 
 
-## This function checks if we should expand an arg_char
-##
-## It has a dual purpose:
-## 1. First, it checks whether we need
-##    to pay the overhead of expanding (by checking that there is something to expand)
-##    like a variable
-## 2. Second it raises an error if we cannot expand an argument.
-def should_expand_arg_char(arg_char):
-    key, val = get_kv(arg_char)
-    if (key in ['V']): # Variable
-        return True
-    elif (key == 'Q'):
-        return should_expand_argument(val)
-    elif (key == 'B'):
-        log("Cannot expand:", arg_char)
-        raise NotImplementedError()
-    return False
-
-def should_expand_argument(argument):
-    return any([should_expand_arg_char(arg_char) for arg_char in argument])
-
-
-## TODO: Move this function somewhere more general
-def execute_shell_asts(asts):
-    output_script = from_ast_objects_to_shell(asts)
-    # log(output_script)
-    exec_obj = subprocess.run(["/usr/bin/env", "bash"], input=output_script,
-                              stdout=subprocess.PIPE, stderr=subprocess.PIPE,
-                              universal_newlines=True)
-    exec_obj.check_returncode()
-    # log(exec_obj.stdout)
-    return exec_obj.stdout
-
-## TODO: Properly parse the output of the shell script
-def parse_string_to_arguments(arg_char_string):
-    # log(arg_char_string)
-    return string_to_arguments(arg_char_string)
-
-## TODO: Use "pash_input_args" when expanding in place of normal arguments.
-def naive_expand(argument, config):
-
-    ## config contains a dictionary with:
-    ##  - all variables, their types, and values in 'shell_variables'
-    ##  - the name of a file that contains them in 'shell_variables_file_path'
-    # log(config['shell_variables'])
-    # log(config['shell_variables_file_path'])
-
-    ## Create an AST node that "echo"s the argument
-    echo_asts = make_echo_ast(argument, config['shell_variables_file_path'])
-
-    ## Execute the echo AST by unparsing it to shell
-    ## and calling bash
-    expanded_string = execute_shell_asts(echo_asts)
-
-    log("Argument:", argument, "was expanded to:", expanded_string)
-
-    ## Parse the expanded string back to an arg_char
-    expanded_arguments = parse_string_to_arguments(expanded_string)
-
-    ## TODO: Handle any errors
-    # log(expanded_arg_char)
-    return expanded_arguments
-
-
-
-## This function expands an arg_char.
-## At the moment it is pretty inefficient as it serves as a prototype.
-##
-## TODO: At the moment this has the issue that a command that has the words which we want to expand
-##       might have assignments of its own, therefore requiring that we use them to properly expand.
-def expand_command_argument(argument, config):
-    new_arguments = [argument]
-    if(should_expand_argument(argument)):
-        new_arguments = naive_expand(argument, config)
-    return new_arguments
-
 ## This function compiles an arg char by recursing if it contains quotes or command substitution.
 ##
 ## It is currently being extended to also expand any arguments that are safe to expand.
@@ -116,6 +116,18 @@ def add_common_arguments(parser):
                         type=int,
                         default=getWidth(),
                         help="set data-parallelism factor")
+    parser.add_argument("--core_budget",
+                        type=int,
+                        default=0,
+                        help="the total width that the nodes of a region can be parallelized with (each node gets at most --width); defaults to 0, i.e., no budget")
+    parser.add_argument("--sequential_input_size",
+                        type=int,
+                        default=1048576,
+                        help="run regions whose input is smaller than this many bytes sequentially; defaults to 1MiB (0 disables it)")
+    parser.add_argument("--input_size_per_width",
+                        type=int,
+                        default=1048576,
+                        help="reduce the width of regions so that each parallel instance gets at least this many bytes of input; defaults to 1MiB (0 disables it)")
     parser.add_argument("--no_optimize",
                         help="not apply transformations over the DFG",
                         action="store_true")
@@ -148,6 +160,12 @@ def add_common_arguments(parser):
     parser.add_argument("--no_eager",
                         help="(experimental) disable eager nodes before merging nodes",
                         action="store_true")
+    parser.add_argument("--eager_memory_budget",
+                        type=int,
+                        default=0,
+                        help="the total memory (in bytes) that the eager nodes of a region can buffer, split across them by their position, "
+                             "or by how much they buffered in the previous run of the region; "
+                             "defaults to 0, i.e., every eager node is a dgsh-tee that buffers the configured dgsh_buffer_size")
     parser.add_argument("--no_daemon",
                         help="(obsolete) does nothing -- Run the compiler everytime we need a compilation instead of using the daemon",
                         action="store_true",
@@ -158,8 +176,14 @@ def add_common_arguments(parser):
                         default=False)
     parser.add_argument("--r_split_batch_size",
                         type=int,
-                        help="configure the batch size of r_split (default: 1MB)",
+                        help="configure the batch size of r_split (default: 1MB), which is the largest batch size when r_split tunes it",
                         default=1000000)
+    parser.add_argument("--r_split_min_batch_size",
+                        type=int,
+                        help="the smallest batch size that r_split can tune its batch size down to (default: 64KB); "
+                             "r_split tunes its batch size by default, and only uses the static --r_split_batch_size "
+                             "(as it did before batch tuning) if this is set to the same size",
+                        default=65536)
     parser.add_argument("--r_split",
                         help="(obsolete) does nothing -- only here for old interfaces (not used anywhere in the code)",
                         action="store_true")
@@ -179,6 +203,15 @@ def add_common_arguments(parser):
                         help="(experimental) determine the termination behavior of the DFG. Defaults to cleanup after the last process dies, but can drain all streams until depletion",
                         choices=['clean_up_graph', 'drain_stream'],
                         default="clean_up_graph")
+    parser.add_argument("--executor",
+                        help="(experimental) determine how the compiled DFG is executed. Defaults to a bash script that connects the nodes with named fifos, "
+                             "but can be the native executor that spawns the nodes and connects them with anonymous pipes (falls back to bash for the graphs it cannot run)",
+                        choices=['bash', 'native'],
+                        default="bash")
+    parser.add_argument("--check_shell_emitter",
+                        help="(debugging) compile every graph with both the direct shell emitter and the AST backend, and run the latter; "
+                             "if their scripts differ, both are logged and the compilation of the region fails",
+                        action="store_true")
     parser.add_argument("--daemon_communicates_through_unix_pipes",
                         help="(experimental) the daemon communicates through unix pipes instead of sockets",
                         action="store_true")
@@ -186,6 +219,25 @@ def add_common_arguments(parser):
                         help="(experimental) execute the script in a distributed environment. Remote machines should be configured and ready",
                         action="store_true",
                         default=False)
+    parser.add_argument("--compilation_workers",
+                        type=int,
+                        help="(experimental) the number of worker processes that the daemon uses to compile regions concurrently (0 compiles them in the daemon itself)",
+                        default=0)
+    parser.add_argument("--plan_cache_entries",
+                        type=int,
+                        help="the maximum number of compiled plans that the daemon caches (0 disables the cache)",
+                        default=128)
+    parser.add_argument("--plan_cache_size",
+                        type=int,
+                        help="the maximum total size (in bytes) of the compiled plans that the daemon caches (default: 16MB)",
+                        default=16000000)
+    parser.add_argument("--preprocessing_cache_dir",
+                        help="the directory where preprocessed scripts are cached across runs (the cache is disabled if not given)",
+                        default="")
+    parser.add_argument("--preprocessing_cache_size",
+                        type=int,
+                        help="the maximum total size (in bytes) of the preprocessing cache (default: 100MB)",
+                        default=100000000)
     parser.add_argument("--config_path",
                         help="determines the config file path. By default it is 'PASH_TOP/compiler/config.yaml'.",
                         default="")
@@ -219,6 +271,8 @@ def pass_common_arguments(pash_arguments):
         arguments.append(pash_arguments.log_file)
     if (pash_arguments.no_eager):
         arguments.append("--no_eager")
+    arguments.append("--eager_memory_budget")
+    arguments.append(str(pash_arguments.eager_memory_budget))
     if (pash_arguments.distributed_exec):
         arguments.append("--distributed_exec")
     if (pash_arguments.speculative):
@@ -229,12 +283,35 @@ def pass_common_arguments(pash_arguments):
         arguments.append("--daemon_communicates_through_unix_pipes")
     arguments.append("--r_split_batch_size")
     arguments.append(str(pash_arguments.r_split_batch_size))
+    arguments.append("--r_split_min_batch_size")
+    arguments.append(str(pash_arguments.r_split_min_batch_size))
+    arguments.append("--compilation_workers")
+    arguments.append(str(pash_arguments.compilation_workers))
+    arguments.append("--plan_cache_entries")
+    arguments.append(str(pash_arguments.plan_cache_entries))
+    arguments.append("--plan_cache_size")
+    arguments.append(str(pash_arguments.plan_cache_size))
+    if(not pash_arguments.preprocessing_cache_dir == ""):
+        arguments.append("--preprocessing_cache_dir")
+        arguments.append(pash_arguments.preprocessing_cache_dir)
+    arguments.append("--preprocessing_cache_size")
+    arguments.append(str(pash_arguments.preprocessing_cache_size))
     arguments.append("--debug")
     arguments.append(str(pash_arguments.debug))
     arguments.append("--termination")
     arguments.append(pash_arguments.termination)
+    arguments.append("--executor")
+    arguments.append(pash_arguments.executor)
+    if (pash_arguments.check_shell_emitter):
+        arguments.append("--check_shell_emitter")
     arguments.append("--width")
     arguments.append(str(pash_arguments.width))
+    arguments.append("--core_budget")
+    arguments.append(str(pash_arguments.core_budget))
+    arguments.append("--sequential_input_size")
+    arguments.append(str(pash_arguments.sequential_input_size))
+    arguments.append("--input_size_per_width")
+    arguments.append(str(pash_arguments.input_size_per_width))
     if(not pash_arguments.config_path == ""):
         arguments.append("--config_path")
         arguments.append(pash_arguments.config_path)
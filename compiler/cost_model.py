@@ -0,0 +1,134 @@
+import math
+import os
+
+##
+## A simple cost model that is used to choose how to parallelize each node of a dataflow graph
+##   (see pash_compiler.choose_parallelizing_transformations).
+##
+## All costs are relative to the cost of running a simple streaming node sequentially, which is 1.
+## Each node has a width (its fan out), which is at most the --width of the compilation.
+## A parallelized node costs the work of one of its mappers, plus the overheads of
+##   the processes and the fifo hops that its parallelization introduces, plus the cost
+##   of its aggregator.
+##
+## If a node is parallelized in a way that fuses with the parallelization of the previous node
+##   (see the IR.apply_*_parallelization_to_node methods), then it doesn't need a splitter, and
+##   the aggregator of the previous node is removed. If the two nodes have different widths,
+##   the outputs of the previous node are repartitioned to the width of the next one.
+##
+
+SEQUENTIAL_COST = 1.0
+## Starting (and scheduling) one more process
+PROCESS_COST = 0.001
+## Passing the whole stream through one more fifo
+FIFO_HOP_COST = 0.05
+## r_wrap forks the wrapped command for every block of its input,
+##   unless the command is line oriented and is kept running (see line_framing.py)
+R_WRAP_COST = 0.05
+PERSISTENT_R_WRAP_COST = 0.005
+## The consecutive chunks splitter (runtime/seek_split) first copies an input that is not a file
+##   to a temporary file, so nothing downstream can start before its input is done.
+CONSECUTIVE_SPLIT_COST = 0.5
+## If the input is a file, the splitter (runtime/seek_split) only scans for a newline at each boundary,
+##   and the mappers start reading their own ranges right away.
+FILE_CONSECUTIVE_SPLIT_COST = 0.0
+## Merging the outputs of the mappers with a custom aggregator (e.g., sort -m)
+AGGREGATOR_WORK_COST = 0.1
+
+## The work of a node relative to the work of a simple streaming command (e.g., tr or grep),
+##   which determines how much it gains from being parallelized more widely.
+DEFAULT_COMMAND_WORK = 1.0
+COMMAND_WORK = {
+    ## Sorting is superlinear and does all of its work before it outputs anything
+    "sort": 4.0,
+}
+
+def node_work(node):
+    name = os.path.basename(str(node.cmd_invocation_with_io_vars.cmd_name))
+    return COMMAND_WORK.get(name, DEFAULT_COMMAND_WORK)
+
+## Returns the cost of a node with the given work if it is parallelized with the given parallelizer
+##   (or not if it is None) and fan_out, and the previous node is parallelized with
+##   prev_parallelizer and prev_fan_out. file_input is whether the node reads its input from a file,
+##   and persistent_wrap is whether its command can be wrapped without a fork for every block.
+def parallelization_cost(work, parallelizer, fan_out, prev_parallelizer, prev_fan_out,
+                         file_input=False, persistent_wrap=False):
+    if parallelizer is None:
+        return work * SEQUENTIAL_COST
+
+    splitter = parallelizer.get_splitter()
+    cost = mappers_cost(work, fan_out)
+    if can_fuse_with_previous(parallelizer, fan_out, prev_parallelizer, prev_fan_out):
+        ## The aggregator of the previous node is removed
+        cost -= aggregator_cost(prev_parallelizer, prev_fan_out)
+        if fan_out != prev_fan_out:
+            cost += repartition_cost(parallelizer, fan_out)
+        if splitter.is_splitter_round_robin_with_unwrap_flag():
+            ## Each output of the previous node is unwrapped
+            cost += fan_out * PROCESS_COST + FIFO_HOP_COST
+    else:
+        cost += splitter_cost(parallelizer, file_input)
+
+    if splitter.is_splitter_round_robin():
+        ## The mappers are wrapped with r_wrap
+        cost += fan_out * PROCESS_COST + FIFO_HOP_COST
+        cost += PERSISTENT_R_WRAP_COST if persistent_wrap else R_WRAP_COST
+
+    cost += aggregator_cost(parallelizer, fan_out)
+    return cost
+
+def mappers_cost(work, fan_out):
+    return work * SEQUENTIAL_COST / fan_out + fan_out * PROCESS_COST
+
+def splitter_cost(parallelizer, file_input=False):
+    cost = PROCESS_COST + FIFO_HOP_COST
+    if parallelizer.get_splitter().is_splitter_consec_chunks():
+        cost += FILE_CONSECUTIVE_SPLIT_COST if file_input else CONSECUTIVE_SPLIT_COST
+    return cost
+
+## Round robin outputs are moved to the new width with a single r_repartition,
+##   while consecutive chunks outputs are grouped with a cat for each new mapper
+##   (see IR.repartition_round_robin_outputs and IR.repartition_consecutive_chunks_outputs).
+def repartition_cost(parallelizer, fan_out):
+    if parallelizer.get_splitter().is_splitter_consec_chunks():
+        return fan_out * PROCESS_COST + FIFO_HOP_COST
+    return PROCESS_COST + FIFO_HOP_COST
+
+def aggregator_cost(parallelizer, fan_out):
+    if parallelizer.get_splitter().is_splitter_round_robin():
+        ## Round robin is always merged with r_merge (see IR.introduce_aggregator_for_round_robin)
+        return PROCESS_COST + FIFO_HOP_COST
+
+    aggregator_spec = parallelizer.get_aggregator_spec()
+    if aggregator_spec.is_aggregator_spec_concatenate():
+        return PROCESS_COST + FIFO_HOP_COST
+    elif aggregator_spec.is_aggregator_spec_custom_2_ary():
+        ## A tree of binary aggregators, whose levels run concurrently
+        tree_depth = math.ceil(math.log2(fan_out)) if fan_out > 1 else 1
+        return (max(fan_out - 1, 1) * PROCESS_COST
+                + tree_depth * FIFO_HOP_COST
+                + AGGREGATOR_WORK_COST)
+    else:
+        return PROCESS_COST + FIFO_HOP_COST + AGGREGATOR_WORK_COST
+
+## A node can reuse the parallel outputs of the previous node if:
+## - both are parallelized with round robin (the first might also be unwrapped),
+##   so the previous node ends with an r_merge, or
+## - the previous node ends with a concatenation and this one is parallelized with consecutive chunks,
+##   and the outputs of the previous node can be grouped in order into one input for each mapper.
+def can_fuse_with_previous(parallelizer, fan_out, prev_parallelizer, prev_fan_out):
+    if prev_parallelizer is None:
+        return False
+
+    splitter = parallelizer.get_splitter()
+    prev_splitter = prev_parallelizer.get_splitter()
+    if (splitter.is_splitter_round_robin()
+        or splitter.is_splitter_round_robin_with_unwrap_flag()):
+        return (prev_splitter.is_splitter_round_robin()
+                and prev_parallelizer.get_aggregator_spec().is_aggregator_spec_concatenate())
+    elif splitter.is_splitter_consec_chunks():
+        return (not prev_splitter.is_splitter_round_robin()
+                and prev_parallelizer.get_aggregator_spec().is_aggregator_spec_concatenate()
+                and prev_parallelizer.info_mapper_aggregator == 0
+                and prev_fan_out % fan_out == 0)
+    return False
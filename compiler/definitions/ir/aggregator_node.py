@@ -7,6 +7,8 @@ from annotations_utils.util_cmd_invocations import get_command_invocation_prefix
 ##
 ## TODO: Do we need to do anything special for binary aggregators?
 class MapperAggregatorNode(DFGNode):
+    __slots__ = ()
+
     def __init__(self, old_node, input_ids, output_ids, name_string, new_options, flag_option_list):
 
         ## The name of the aggregator command
@@ -28,6 +30,8 @@ class MapperAggregatorNode(DFGNode):
 
 
 class AggregatorNode(MapperAggregatorNode):
+    __slots__ = ()
+
     def __init__(self, old_node, input_ids, output_ids):
 
         used_parallelizer = old_node.get_used_parallelizer()
@@ -6,12 +6,20 @@ from annotations_utils.util_cmd_invocations import to_node_cmd_inv_with_io_vars,
 
 from util import return_empty_list_if_none_else_itself, return_default_if_none_else_itself
 
+## Nodes without properties (e.g., mappers, splitters) all share the same (empty) properties
+DEFAULT_CMD_PROPERTIES = construct_property_container_from_list_of_properties([])
+
 ## Assumption: Everything related to a DFGNode must be already expanded.
 ## TODO: Ensure that this is true with assertions
 class DFGNode:
     ## Unique identifier for nodes
     next_id = 0
 
+    ## Subclasses declare their own (possibly empty) __slots__ too,
+    ##   otherwise their instances would get a __dict__ anyway.
+    __slots__ = ("id", "com_redirs", "com_assignments", "parallelizer_list",
+                 "cmd_related_properties", "cmd_invocation_with_io_vars")
+
     ## cmd_invocation_with_io_vars : command invocation data structure with edge ids as symbolic variables for filenames etc.
     ## com_redirs : list of redirections
     ## com_assignments : list of assignments
@@ -35,8 +43,7 @@ class DFGNode:
         self.com_redirs = [Redirection(redirection) for redirection in com_redirs]
         self.com_assignments = com_assignments
         self.parallelizer_list = return_empty_list_if_none_else_itself(parallelizer_list)
-        default_cmd_properties = construct_property_container_from_list_of_properties([])
-        self.cmd_related_properties = return_default_if_none_else_itself(cmd_related_properties, default_cmd_properties)
+        self.cmd_related_properties = return_default_if_none_else_itself(cmd_related_properties, DEFAULT_CMD_PROPERTIES)
         self.cmd_invocation_with_io_vars = cmd_invocation_with_io_vars
         # log("Node created:", self.id, self)
 
@@ -61,9 +68,13 @@ class DFGNode:
     def get_id(self):
         return self.id
 
-    ## Copying requires setting the id to a new one too
+    ## Copying requires setting the id to a new one too.
+    ##
+    ## Only the command invocation is changed in place when edges are replaced,
+    ##   so the rest (parallelizers, properties, redirections) is shared with the copy.
     def copy(self):
-        node_copy = copy.deepcopy(self)
+        node_copy = copy.copy(self)
+        node_copy.cmd_invocation_with_io_vars = copy.deepcopy(self.cmd_invocation_with_io_vars)
         node_copy.id = DFGNode.next_id
         DFGNode.next_id += 1
         return node_copy
@@ -163,11 +174,11 @@ class DFGNode:
                 success = False
                 for i in range(len(self.get_output_list())):
                     output_edge_id = self.get_output_list()[i]
-                    output_fid = edges[output_edge_id][0]
+                    output_fid = edges[output_edge_id].fid
                     if(output_fid.has_file_descriptor_resource()
                        and output_fid.resource.is_stdout()):
                         success = True
-                        edges[output_edge_id][0].set_resource(file_resource)
+                        edges[output_edge_id].fid.set_resource(file_resource)
                         # self.outputs[i].set_resource(file_resource)
                 assert(success)
             elif (redirection.is_from_file() and redirection.is_for_stdin()):
@@ -175,11 +186,11 @@ class DFGNode:
                 file_resource = FileResource(redirection.file_arg)
                 success = False
                 for input_edge_id in self.get_input_list():
-                    input_fid = edges[input_edge_id][0]
+                    input_fid = edges[input_edge_id].fid
                     if(input_fid.has_file_descriptor_resource()
                        and input_fid.resource.is_stdin()):
                         success = True
-                        edges[input_edge_id][0].set_resource(file_resource)
+                        edges[input_edge_id].fid.set_resource(file_resource)
                 assert(success)
             else:
                 log("Warning -- Unhandled redirection:", redirection)
@@ -21,6 +21,8 @@ from definitions.ir.resource import *
 ## TODO: When doing union, I have to really make both file ids point
 ## to the same file.
 class FileId:
+    __slots__ = ("ident", "prefix", "resource")
+
     def __init__(self, ident, prefix="", resource=None):
         self.ident = ident
         ## TODO: Add this as part of the resource. Ephemeral resources should
@@ -55,6 +57,16 @@ class FileId:
         fifo_name = "{}#fifo{}".format(self.prefix, self.ident)
         return fifo_name
 
+    ## Returns the directory (of its generator) where the fifo of this file id is created
+    def get_directory(self):
+        directory = os.path.dirname(self.prefix)
+        assert(directory != "")
+        return os.path.join(config.PASH_TMP_PREFIX, directory)
+
+    ## Returns a (quoted) shell AST of the directory of this file id
+    def directory_to_ast(self):
+        return [make_kv('Q', string_to_argument(self.get_directory()))]
+
     ## Serialize as an option for the JSON serialization when sent to
     ## the backend. This is needed as options can either be files or
     ## arguments, and in each case there needs to be a different
@@ -2,6 +2,8 @@ import os
 from definitions.ir.dfg_node import *
 
 class DFSSplitReader(DFGNode):
+    __slots__ = ()
+
     def __init__(self, inputs, outputs, com_name, com_category, 
                  com_options = [], com_redirs = [], com_assignments=[]):
         
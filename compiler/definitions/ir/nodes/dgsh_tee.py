@@ -7,6 +7,8 @@ from annotations_utils.util_cmd_invocations import to_ast_flagoption, to_ast_ope
 from definitions.ir.dfg_node import *
 
 class DGSHTee(DFGNode):
+    __slots__ = ()
+
     def __init__(self,
                  cmd_invocation_with_io_vars,
                  com_redirs=[], com_assignments=[]
@@ -1,9 +1,12 @@
 from pash_annotations.datatypes.AccessKind import AccessKind, make_stream_output, make_stream_input, make_other_output
+from pash_annotations.datatypes.BasicDatatypes import Operand
 from pash_annotations.datatypes.CommandInvocationWithIOVars import CommandInvocationWithIOVars
 
 from definitions.ir.dfg_node import *
 
 class Eager(DFGNode):
+    __slots__ = ()
+
     def __init__(self,
                  cmd_invocation_with_io_vars,
                  com_redirs=[], com_assignments=[]
@@ -14,13 +17,18 @@ class Eager(DFGNode):
                          com_assignments=com_assignments)
 
 
-def make_eager_node(input_id, output_id, intermediate_file_id, eager_exec_path):
+## The eager only uses the directory of the intermediate file, for its spill file (see runtime/eager.c).
+##   The buffer size is in bytes, and the label (which needs a buffer size) is the one
+##   with which the eager reports the most data that it buffered (see region_stats.py).
+def make_eager_node(input_id, output_id, intermediate_file, eager_exec_path, buffer_size=None, label=None):
     eager_name = eager_exec_path
-    intermediate_file_id_id = intermediate_file_id.get_ident()
-    operand_list = [input_id, output_id, intermediate_file_id_id]
+    operand_list = [input_id, output_id, Operand(Arg.string_to_arg(intermediate_file))]
+    if not buffer_size is None:
+        operand_list.append(Operand(Arg.string_to_arg(f"{buffer_size // 1024}K")))
+        if not label is None:
+            operand_list.append(Operand(Arg.string_to_arg(str(label))))
     access_map = {output_id: make_stream_output(),
-                  input_id: make_stream_input(),
-                  intermediate_file_id_id: make_other_output()}
+                  input_id: make_stream_input()}
     cmd_inv_with_io_vars = CommandInvocationWithIOVars(
         cmd_name=eager_name,
         flag_option_list=[],
@@ -1,4 +1,5 @@
 from pash_annotations.datatypes.AccessKind import make_stream_input, make_stream_output
+from pash_annotations.datatypes.BasicDatatypes import Flag
 from pash_annotations.datatypes.CommandInvocationWithIOVars import CommandInvocationWithIOVars
 
 from definitions.ir.file_id import *
@@ -8,6 +9,8 @@ import config
 import os
 
 class Split(DFGNode):
+    __slots__ = ()
+
     def __init__(self,
                  cmd_invocation_with_io_vars,
                  com_redirs=[],
@@ -21,14 +24,21 @@ class Split(DFGNode):
                          parallelizer_list=parallelizer_list,
                          cmd_related_properties=cmd_related_properties)
 
+    ## seek_split -s reports the size of its input, which is the stdin of the region
+    def add_s_flag(self):
+        self.cmd_invocation_with_io_vars.flag_option_list.append(Flag("-s"))
+
+## Each output is read directly from its own byte range of the input file
+##   (or of a temporary copy of the input if it is not a file), and the outputs
+##   are written concurrently, so they don't need eager nodes (see runtime/seek_split.c).
 def make_split_file(input_id, out_ids):
-    auto_split_bin = os.path.join(config.PASH_TOP, config.config['runtime']['auto_split_binary'])
+    split_bin = os.path.join(config.PASH_TOP, config.config['runtime']['seek_split_binary'])
     operand_list = [input_id]
     operand_list.extend(out_ids)
     access_map = {output_id: make_stream_output() for output_id in out_ids}
     access_map[input_id] = make_stream_input()
     cmd_inv_with_io_vars = CommandInvocationWithIOVars(
-        cmd_name=auto_split_bin,
+        cmd_name=split_bin,
         flag_option_list=[],
         operand_list=operand_list,
         implicit_use_of_streaming_input=None,
@@ -0,0 +1,43 @@
+import os
+
+from pash_annotations.datatypes.AccessKind import make_stream_input, make_stream_output
+from pash_annotations.datatypes.BasicDatatypes import Operand
+from pash_annotations.datatypes.CommandInvocationWithIOVars import CommandInvocationWithIOVars
+
+import config
+
+from definitions.ir.dfg_node import *
+
+## Connects two round robin parallelized nodes with different widths
+##   by moving the (wrapped) blocks from the outputs of the first to the inputs of the second.
+class RRepartition(DFGNode):
+    __slots__ = ()
+
+    def __init__(self,
+                 cmd_invocation_with_io_vars,
+                 com_redirs=[],
+                 com_assignments=[],
+                 parallelizer_list=None,
+                 cmd_related_properties=None):
+        super().__init__(cmd_invocation_with_io_vars=cmd_invocation_with_io_vars,
+                         com_redirs=com_redirs,
+                         com_assignments=com_assignments,
+                         parallelizer_list=parallelizer_list,
+                         cmd_related_properties=cmd_related_properties)
+
+def make_r_repartition_node(inputs, outputs):
+    r_repartition_bin = os.path.join(config.PASH_TOP, config.config['runtime']['r_repartition_binary'])
+    operand_list = [Operand(Arg.string_to_arg(str(len(inputs))))]
+    operand_list.extend(inputs)
+    operand_list.extend(outputs)
+    access_map = {input_id: make_stream_input() for input_id in inputs}
+    for output_id in outputs:
+        access_map[output_id] = make_stream_output()
+    cmd_inv_with_io_vars = CommandInvocationWithIOVars(
+        cmd_name=r_repartition_bin,
+        flag_option_list=[],
+        operand_list=operand_list,
+        implicit_use_of_streaming_input=None,
+        implicit_use_of_streaming_output=None,
+        access_map=access_map)
+    return RRepartition(cmd_inv_with_io_vars)
@@ -1,7 +1,8 @@
 import os
 
 from pash_annotations.datatypes.AccessKind import AccessKind, make_stream_input, make_stream_output
-from pash_annotations.datatypes.BasicDatatypes import Operand, Flag
+from pash_annotations.datatypes.BasicDatatypes import Operand, Flag, ArgStringType
+from pash_annotations.datatypes.BasicDatatypesWithIO import OptionWithIO
 from pash_annotations.datatypes.CommandInvocationWithIOVars import CommandInvocationWithIOVars
 
 import config
@@ -11,6 +12,8 @@ from definitions.ir.file_id import *
 from shell_ast.ast_util import string_to_argument
 
 class RSplit(DFGNode):
+    __slots__ = ()
+
     def __init__(self,
                  cmd_invocation_with_io_vars,
                  com_redirs=[],
@@ -27,9 +30,30 @@ class RSplit(DFGNode):
     def add_r_flag(self):
         self.cmd_invocation_with_io_vars.flag_option_list.append(Flag("-r"))
 
+    ## r_split -e buffers its outputs itself, instead of eager nodes after it
+    def add_e_flag(self):
+        self.cmd_invocation_with_io_vars.flag_option_list.append(Flag("-e"))
+
+    ## r_split -s reports the number of bytes it read, when its input is the stdin of the region
+    def add_s_flag(self):
+        self.cmd_invocation_with_io_vars.flag_option_list.append(Flag("-s"))
+
+
+## r_split tunes its batch size (between r_split_min_batch_size and r_split_batch_size) so that
+##   each mapper gets a block about every target block time (see runtime/r_split.c).
+##   Mappers that fork a command for every block need longer blocks to amortize the fork,
+##   while the other mappers get shorter blocks, which balance better.
+##   The batch size is only static (as it was before the tuning) if r_split_min_batch_size is r_split_batch_size.
+FORK_PER_BLOCK_TARGET_BLOCK_MS = 50
+STREAMING_TARGET_BLOCK_MS = 10
 
-def make_r_split(input_id, out_ids, r_split_batch_size):
+def make_r_split(input_id, out_ids, r_split_batch_size, r_split_min_batch_size=None, mappers_fork_per_block=True):
     r_split_bin = os.path.join(config.PASH_TOP, config.config['runtime']['r_split_binary'])
+    flag_option_list = []
+    if r_split_min_batch_size is not None and r_split_min_batch_size < r_split_batch_size:
+        target_block_ms = FORK_PER_BLOCK_TARGET_BLOCK_MS if mappers_fork_per_block else STREAMING_TARGET_BLOCK_MS
+        flag_option_list = [OptionWithIO("-a", ArgStringType(Arg.string_to_arg(str(target_block_ms)))),
+                            OptionWithIO("-m", ArgStringType(Arg.string_to_arg(str(r_split_min_batch_size))))]
     operand_list = [input_id,
                     Operand(Arg.string_to_arg(str(r_split_batch_size)))]
     operand_list.extend(out_ids)
@@ -37,14 +61,16 @@ def make_r_split(input_id, out_ids, r_split_batch_size):
     access_map[input_id] = make_stream_input()
     cmd_inv_with_io_vars = CommandInvocationWithIOVars(
                     cmd_name=r_split_bin,
-                    flag_option_list=[],
+                    flag_option_list=flag_option_list,
                     operand_list=operand_list,
                     implicit_use_of_streaming_input=None,
                     implicit_use_of_streaming_output=None,
                     access_map=access_map)
     return RSplit(cmd_inv_with_io_vars)
 
-def make_r_split_with_unwrap_flag(input_id, out_ids, r_split_batch_size):
-    standard_r_split = make_r_split(input_id, out_ids, r_split_batch_size)
+## The mappers after r_split -r read its output as a stream, so they don't have a per block overhead
+def make_r_split_with_unwrap_flag(input_id, out_ids, r_split_batch_size, r_split_min_batch_size=None):
+    standard_r_split = make_r_split(input_id, out_ids, r_split_batch_size, r_split_min_batch_size,
+                                    mappers_fork_per_block=False)
     standard_r_split.add_r_flag()
     return standard_r_split
@@ -4,6 +4,8 @@ from pash_annotations.datatypes.CommandInvocationWithIOVars import CommandInvoca
 from definitions.ir.dfg_node import *
 
 class RUnwrap(DFGNode):
+    __slots__ = ()
+
     def __init__(self,
                  cmd_invocation_with_io_vars,
                  com_redirs=[],
@@ -1,12 +1,16 @@
 from pash_annotations.datatypes.AccessKind import make_stream_output, make_stream_input
-from pash_annotations.datatypes.BasicDatatypes import ArgStringType
+from pash_annotations.datatypes.BasicDatatypes import ArgStringType, Flag
 from pash_annotations.datatypes.CommandInvocationWithIOVars import CommandInvocationWithIOVars
 
-from annotations_utils.util_cmd_invocations import to_arg_from_cmd_inv_with_io_vars_without_streaming_inputs_or_outputs_for_wrapping
+from annotations_utils.util_cmd_invocations import to_arg_from_cmd_inv_with_io_vars_without_streaming_inputs_or_outputs_for_wrapping, make_cmd_inv_with_io_vars_without_copying
 from definitions.ir.dfg_node import *
 from shell_ast.ast_util import *
 
+import line_framing
+
 class RWrap(DFGNode):
+    __slots__ = ("wrapped_node_name",)
+
     def __init__(self,
                  cmd_invocation_with_io_vars,
                  com_redirs=[],
@@ -55,12 +59,16 @@ def wrap_node(node: DFGNode, edges):
     # any non-streaming inputs or outputs are converted here already!
     cmd = to_arg_from_cmd_inv_with_io_vars_without_streaming_inputs_or_outputs_for_wrapping(cmd_inv_with_io_vars, edges)
 
+    ## Line oriented commands are kept running for all blocks (see line_framing.py)
+    line_framing_flag = line_framing.get_line_framing_flag(cmd_inv_with_io_vars)
+    flag_option_list = [] if line_framing_flag is None else [Flag(line_framing_flag)]
+
     bash_command_arg = [Arg.string_to_arg("bash -c")]
     operand_list = bash_command_arg + [cmd]
 
-    cmd_inv_with_io_vars = CommandInvocationWithIOVars(
+    cmd_inv_with_io_vars = make_cmd_inv_with_io_vars_without_copying(
         cmd_name=r_wrap_bin,
-        flag_option_list=[],
+        flag_option_list=flag_option_list,
         operand_list=operand_list,
         implicit_use_of_streaming_input=input_id,
         implicit_use_of_streaming_output=output_id,
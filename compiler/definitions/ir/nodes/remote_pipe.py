@@ -1,6 +1,8 @@
 from definitions.ir.dfg_node import *
 
 class RemotePipe(DFGNode):
+    __slots__ = ()
+
     def __init__(self, inputs, outputs, com_name, com_category,
                  com_options = [], com_redirs = [], com_assignments=[]):
         super().__init__(inputs, outputs, com_name, com_category,
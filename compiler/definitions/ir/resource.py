@@ -9,6 +9,9 @@ from shell_ast.ast_util import *
 
 ## TODO: Think if we can have any optimizations if we know the size of a resource.
 class Resource:
+    ## Graphs at high widths have many resources, so we avoid a __dict__ per object.
+    __slots__ = ("uri",)
+
     def __init__(self, uri):
         self.uri = uri
 
@@ -29,6 +32,8 @@ class Resource:
         return False
     
 class FileDescriptorResource(Resource):
+    __slots__ = ()
+
     def __init__(self, fd):
         assert(isinstance(fd, tuple)
                and len(fd) == 2
@@ -43,6 +48,8 @@ class FileDescriptorResource(Resource):
 
 
 class FileResource(Resource):
+    __slots__ = ()
+
     ## The uri is the path of the file.
     def __init__(self, path):
         log("class of path", type(path))
@@ -56,15 +63,21 @@ class FileResource(Resource):
         return False
 
 class TemporaryFileResource(Resource):
+    __slots__ = ()
+
     def __init__(self):
         self.uri = None
 
 # A FIFO.
 class EphemeralResource(Resource):
+    __slots__ = ()
+
     def __init__(self):
         self.uri = None
 
 class RemoteFileResource(Resource):
+    __slots__ = ()
+
     def __init__(self):
         raise NotImplementedError("RemoteFileResource is an interface")
 
@@ -85,6 +98,8 @@ class RemoteFileResource(Resource):
         return normalized_host
 
 class HDFSFileResource(RemoteFileResource):
+    __slots__ = ("hosts",)
+
     ## The uri is the path of the file.
     def __init__(self, uri, resource_hosts):
         """
@@ -114,6 +129,8 @@ class HDFSFileResource(RemoteFileResource):
 
 # DFS logical split resource
 class DFSSplitResource(RemoteFileResource):
+    __slots__ = ("config", "config_path", "split_num", "hosts")
+
     def __init__(self, config, config_path, split_num, hosts):
         self.config = config
         self.config_path = config_path
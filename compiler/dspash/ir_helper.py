@@ -57,19 +57,12 @@ def save_configs(graph:IR, dfs_configs_paths: Dict[HDFSFileConfig, str]):
 
 def to_shell_file(graph: IR, args) -> str:
     filename = ptempfile()
-    
-    dirs = set()
-    for edge in graph.all_fids():
-        directory = os.path.join(config.PASH_TMP_PREFIX, edge.prefix)
-        dirs.add(directory)
-        
-    for directory in dirs:
-        os.makedirs(directory, exist_ok=True)
 
     if not args.no_eager:
-        graph = pash_compiler.add_eager_nodes(graph)
+        graph = pash_compiler.add_eager_nodes(graph, args.eager_memory_budget)
 
-    script = to_shell(graph, args)
+    ## The fifo directories are shared with the scripts of the other subgraphs
+    script = to_shell(graph, args, remove_fifo_directories=False)
     with open(filename, "w") as f:
         f.write(script)
     return filename
@@ -1,4 +1,4 @@
-import shlex
+import re
 from datetime import datetime
 
 from util import log, print_time_delta
@@ -7,81 +7,156 @@ def read_vars_file(var_file_path):
     log("Reading variables from:", var_file_path)
 
     if(not var_file_path is None):
-        vars_dict = {}
-        # with open(var_file_path) as f:
-        #     lines = [line.rstrip() for line in f.readlines()]
-
         with open(var_file_path) as f:
             variable_reading_start_time = datetime.now()
             data = f.read()
             variable_reading_end_time = datetime.now()
             print_time_delta("Variable Reading", variable_reading_start_time, variable_reading_end_time)
 
-            variable_tokenizing_start_time = datetime.now()
-            ## TODO: Can we replace this tokenizing process with our own code? This is very slow :'(
-            ##       It takes about 15ms on deathstar.
-            tokens = shlex.split(data)
-            variable_tokenizing_end_time = datetime.now()
-            print_time_delta("Variable Tokenizing", variable_tokenizing_start_time, variable_tokenizing_end_time)
-            # log("Tokens:", tokens)
-
-        # MMG 2021-03-09 definitively breaking on newlines (e.g., IFS) and function outputs (i.e., `declare -f`)
-        # KK  2021-10-26 no longer breaking on newlines (probably)
-
-        ## At the start of each iteration token_i should point to a 'declare'
-        token_i = 0
-        while token_i < len(tokens):
-            # FIXME is this assignment needed?
-            export_or_typeset = tokens[token_i]
-
-            ## Array variables require special parsing treatment
-            if (export_or_typeset == "declare" and is_array_variable(tokens[token_i+1])):
-                var_name, var_type, var_value, new_token_i = parse_array_variable(tokens, token_i)
-                vars_dict[var_name] = (var_type, var_value)
-                token_i = new_token_i
-                continue
-
-            new_token_i = find_next_delimiter(tokens, token_i)
-            rest = " ".join(tokens[(token_i+1):new_token_i])
-            token_i = new_token_i
-
-            space_index = rest.find(' ')
-            eq_index = rest.find('=')
-            var_type = None
-
-            ## Declared but unset?
-            if eq_index == -1:
-                if space_index != -1:
-                    var_name = rest[(space_index+1):]
-                    var_type = rest[:space_index]
-                else:
-                    var_name = rest
-                var_value = ""
-            ## Set, with type
-            elif(space_index < eq_index and not space_index == -1):
-                var_type = rest[:space_index]
-
-                if var_type == "--":
-                    var_type = None
-                
-                var_name = rest[(space_index+1):eq_index]
-                var_value = rest[(eq_index+1):]
-            ## Set, without type
-            else:
-                var_name = rest[:eq_index]
-                var_value = rest[(eq_index+1):]
-
-            ## Strip quotes
-            if var_value is not None and len(var_value) >= 2 and \
-               var_value[0] == "\"" and var_value[-1] == "\"":
-                var_value = var_value[1:-1]                
-                
-            vars_dict[var_name] = (var_type, var_value)
+        variable_parsing_start_time = datetime.now()
+        vars_dict = parse_declare_output(data)
+        variable_parsing_end_time = datetime.now()
+        print_time_delta("Variable Parsing", variable_parsing_start_time, variable_parsing_end_time)
 
         final_vars_dict = set_special_parameters(vars_dict)
         return final_vars_dict
 
 
+##
+## A single-pass parser for the output of `declare -p`.
+##
+## Each variable is printed in one of the following forms:
+##
+##   declare -- name="value"
+##   declare -x name=$'ansi-c\tvalue'
+##   declare -- name                           (declared but unset)
+##   declare -a name=([0]="a" [3]=$'b\nc')
+##   declare -A name=([key]="a" ["other key"]="b" )
+##
+## Bash versions before 5.2 print newlines literally in double quoted values,
+##   so a value might span many lines.
+##
+## Instead of tokenizing the whole file (e.g., with shlex) we match each
+##   declaration and each quoted word with regular expressions.
+##
+
+DECLARE_RE = re.compile(r'declare (-\S*) ([^\s=]+)(=?)')
+DOUBLE_QUOTED_RE = re.compile(r'"((?:[^"\\]|\\.)*)"', re.DOTALL)
+ANSI_C_QUOTED_RE = re.compile(r"\$'((?:[^'\\]|\\.)*)'", re.DOTALL)
+SINGLE_QUOTED_RE = re.compile(r"'([^']*)'")
+UNQUOTED_RE = re.compile(r"(?:[^\s\"'$()\[\]\\]|\\.|\$(?!'))+", re.DOTALL)
+ARRAY_KEY_RE = re.compile(r'\s*\[((?:"(?:[^"\\]|\\.)*"|\$\'(?:[^\'\\]|\\.)*\'|[^\]"$])*)\]=')
+ARRAY_END_RE = re.compile(r'\s*\)')
+DOUBLE_QUOTED_ESCAPE_RE = re.compile(r'\\([$`"\\\n])')
+UNQUOTED_ESCAPE_RE = re.compile(r'\\(.)', re.DOTALL)
+
+def parse_declare_output(data: str) -> dict:
+    vars_dict = {}
+    pos = 0
+    data_len = len(data)
+    while pos < data_len:
+        declare_match = DECLARE_RE.match(data, pos)
+        if declare_match is None:
+            ## This is not a variable declaration, skip the line
+            pos = next_line_start(data, pos)
+            continue
+
+        flags, var_name, equals = declare_match.groups()
+        pos = declare_match.end()
+        var_type = None if flags == "--" else flags
+
+        if equals == "":
+            ## Declared but unset
+            var_value = ""
+        elif data.startswith("(", pos):
+            ## TODO: Set the type of arrays
+            var_type = None
+            var_value, pos = parse_array_value(data, pos + 1, 'A' in flags)
+        else:
+            var_value, pos = parse_word(data, pos)
+
+        vars_dict[var_name] = (var_type, var_value)
+        pos = next_line_start(data, pos)
+
+    return vars_dict
+
+def next_line_start(data, pos):
+    newline_index = data.find("\n", pos)
+    if newline_index == -1:
+        return len(data)
+    return newline_index + 1
+
+## Parses a (potentially quoted) word starting at pos
+##   and returns its value and the position after it.
+def parse_word(data, pos):
+    parts = []
+    while True:
+        if data.startswith('"', pos):
+            word_match = DOUBLE_QUOTED_RE.match(data, pos)
+            unescape = double_quoted_unescape
+        elif data.startswith("$'", pos):
+            word_match = ANSI_C_QUOTED_RE.match(data, pos)
+            unescape = ansi_c_expand
+        elif data.startswith("'", pos):
+            word_match = SINGLE_QUOTED_RE.match(data, pos)
+            unescape = None
+        else:
+            word_match = UNQUOTED_RE.match(data, pos)
+            if word_match is None:
+                break
+            parts.append(UNQUOTED_ESCAPE_RE.sub(r'\1', word_match.group(0)))
+            pos = word_match.end()
+            continue
+
+        if word_match is None:
+            raise ValueError(f'Unterminated quoted value at position {pos} in variables file')
+        if unescape is None:
+            parts.append(word_match.group(1))
+        else:
+            parts.append(unescape(word_match.group(1)))
+        pos = word_match.end()
+    return "".join(parts), pos
+
+## Parses the items of an array (pos points after the opening parenthesis)
+##   and returns them and the position after the closing parenthesis.
+def parse_array_value(data, pos, is_associative):
+    if is_associative:
+        var_values = {}
+    else:
+        var_values = []
+
+    while True:
+        end_match = ARRAY_END_RE.match(data, pos)
+        if not end_match is None:
+            return var_values, end_match.end()
+
+        key_match = ARRAY_KEY_RE.match(data, pos)
+        if key_match is None:
+            raise ValueError(f'Invalid array item at position {pos} in variables file')
+        item_key, _ = parse_word(key_match.group(1), 0)
+        item_value, pos = parse_word(data, key_match.end())
+
+        if is_associative:
+            var_values[item_key] = item_value
+        else:
+            item_index = int(item_key)
+            ## Add None values if the index is larger than the next item (see Bash sparse arrays)
+            ## TODO: Keep bash array values as maps to avoid sparse costs
+            var_values += [None] * (item_index - len(var_values))
+            var_values.append(item_value)
+
+def double_quoted_unescape(string):
+    if not "\\" in string:
+        return string
+    return DOUBLE_QUOTED_ESCAPE_RE.sub(double_quoted_escape, string)
+
+def double_quoted_escape(escape_match):
+    char = escape_match.group(1)
+    ## An escaped newline is a line continuation
+    if char == "\n":
+        return ""
+    return char
+
 ## This sets the values of the special shell parameters correctly
 ##
 ## TODO KK PR#246 Do we need to split using IFS or is it always spaces?
@@ -140,93 +215,30 @@ def get_var(variables: dict, varname: str):
     type, value = variables.get(varname, [None, None])
     return type, value
 
-def is_array_variable(token):
-    return ('a' in token)
-
 ## Based on the following:
 ## https://www.gnu.org/software/bash/manual/html_node/ANSI_002dC-Quoting.html#ANSI_002dC-Quoting
-def ansi_c_expand(string):
-    return bytes(string, "utf-8").decode("unicode_escape")
+ANSI_C_ESCAPE_RE = re.compile(r"\\(?:([abeEfnrtv\\'\"?])|([0-7]{1,3})|x([0-9A-Fa-f]{1,2})|u([0-9A-Fa-f]{1,4})|U([0-9A-Fa-f]{1,8})|c(.))", re.DOTALL)
+ANSI_C_SIMPLE_ESCAPES = {
+    'a': '\a', 'b': '\b', 'e': '\x1b', 'E': '\x1b', 'f': '\f', 'n': '\n',
+    'r': '\r', 't': '\t', 'v': '\v', '\\': '\\', "'": "'", '"': '"', '?': '?'
+}
 
-## This finds the end of this variable/function
-def find_next_delimiter(tokens, i):
-    if (tokens[i] == "declare"):
-        return i + 3
-    else:
-        ## TODO: When is this case actually useful?
-        j = i + 1
-        while j < len(tokens) and (tokens[j] != "declare"):
-            j += 1
-        return j
-
-def parse_array_variable(tokens, i):
-    ## The `declare` keyword
-    _declare = tokens[i]
-    ## The type
-    declare_type = tokens[i+1]
-    assert(is_array_variable(declare_type))
-
-    ## The variable name and first argument
-    ## TODO: Test with empty array and single value array
-    name_and_start=tokens[i+2]
-    first_equal_index = name_and_start.find('=')
-
-    ## If it doesn't contain any = then it is empty
-    if first_equal_index == -1:
-        ## Then the name is the whole token,
-        ##  the type is None (TODO)
-        ##  and the value is empty
-        return name_and_start, None, "", i+3
-
-    var_name = name_and_start[:first_equal_index]
-    array_start = name_and_start[first_equal_index+1:]
-
-    var_values = []
-    if array_start == "()":
-        next_i = i+3
+def ansi_c_expand(string):
+    if not "\\" in string:
+        return string
+    expanded = ANSI_C_ESCAPE_RE.sub(ansi_c_escape, string)
+    ## Octal and hex escapes are bytes, which might be parts of multibyte characters
+    return expanded.encode("utf-8", "surrogateescape").decode("utf-8", "surrogateescape")
+
+def ansi_c_escape(escape_match):
+    simple, octal, hexadecimal, unicode_short, unicode_long, control = escape_match.groups()
+    if not simple is None:
+        return ANSI_C_SIMPLE_ESCAPES[simple]
+    elif not control is None:
+        return chr(ord(control) & 0x1f)
+    elif not unicode_short is None or not unicode_long is None:
+        return chr(int(unicode_short or unicode_long, 16))
     else:
-        ## Remove the opening parenthesis
-        array_item = array_start[1:]
-
-        ## Set the index that points to array items
-        curr_i = i+2
-
-        done = False
-        while not done:
-            ## TODO: Is this check adequate? Or could it miss the end 
-            ##       (or be misleaded into an earlier end by the item value?)
-            if array_item.endswith(")"):
-                done = True
-                array_item = array_item[:-1]
-
-            first_equal_index = array_item.find('=')
-            ## Find the index and value of the array item
-            item_index_raw = array_item[:first_equal_index]
-            item_value = array_item[first_equal_index+1:]
-
-            ## Sometimes the value starts with a dollar mark, see Bash ANSI-C quoting:
-            ## https://www.gnu.org/software/bash/manual/html_node/ANSI_002dC-Quoting.html#ANSI_002dC-Quoting
-            if item_value.startswith("$"):
-                ## TODO: Figure out if this is adequate
-                item_value = ansi_c_expand(item_value[1:])
-
-            item_index = int(item_index_raw[1:-1])
-            
-            ## Add None values if the index is larger than the next item (see Bash sparse arrays)
-            ## TODO: Keep bash array values as maps to avoid sparse costs 
-            var_values += [None] * (item_index - len(var_values))
-            ## Set the next item
-            var_values.append(item_value)
-
-            
-
-            ## Get next array_item
-            curr_i += 1
-            array_item = tokens[curr_i]
-        
-        next_i = curr_i
-
-    ## TODO: Michael?
-    var_type = None
-
-    return var_name, var_type, var_values, next_i
+        ## A single byte, represented as in the surrogateescape error handler
+        byte = int(octal, 8) & 0xff if not octal is None else int(hexadecimal, 16)
+        return chr(byte) if byte < 0x80 else chr(0xdc00 + byte)
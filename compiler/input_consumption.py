@@ -0,0 +1,70 @@
+import os
+
+from pash_annotations.annotation_generation.datatypes.parallelizability.Aggregator import Aggregator
+from pash_annotations.annotation_generation.datatypes.parallelizability.AggregatorKind import AggregatorKindEnum
+from pash_annotations.datatypes.BasicDatatypes import Flag
+
+from definitions.ir.nodes.r_merge import RMerge
+
+##
+## Describes the order in which a node with many inputs consumes them,
+##   which decides which of its inputs need an eager node (see add_eager_nodes).
+##
+## - Sequential: reads its inputs to the end one after the other (e.g., cat).
+##     The input that is read first never waits for the others, so it needs no eager,
+##     but all the others do, otherwise their producers stop until their turn comes.
+## - Interleaved: reads whichever input has data (e.g., r_merge, which polls its inputs
+##     and buffers the blocks that are ahead). None of its inputs need an eager.
+## - All at once: reads its inputs in an order that depends on the data (e.g., sort -m, comm, paste),
+##     so any of them might stall the others. All of its inputs need an eager.
+##
+## Aggregators keep the kind that their annotation gives them, so the pattern is derived from it:
+##   concatenation is sequential, and custom aggregators are all at once.
+## Nodes that are not aggregators are all at once, unless they are known below.
+##
+
+SEQUENTIAL = "sequential"
+INTERLEAVED = "interleaved"
+ALL_AT_ONCE = "all_at_once"
+
+AGGREGATOR_KIND_CONSUMPTION = {
+    AggregatorKindEnum.CONCATENATE: SEQUENTIAL,
+}
+
+def get_input_consumption(node):
+    if isinstance(node, RMerge):
+        return INTERLEAVED
+    cmd_inv = node.cmd_invocation_with_io_vars
+    if isinstance(cmd_inv, Aggregator):
+        return AGGREGATOR_KIND_CONSUMPTION.get(cmd_inv.kind, ALL_AT_ONCE)
+    if is_plain_cat(cmd_inv):
+        return SEQUENTIAL
+    return ALL_AT_ONCE
+
+## cat reads its operands in order, whatever its flags (which only change its output)
+def is_plain_cat(cmd_inv):
+    name = os.path.basename(str(cmd_inv.cmd_name))
+    return (name == "cat"
+            and all(isinstance(flag_option, Flag) for flag_option in cmd_inv.flag_option_list))
+
+## The eager nodes in front of a node that reads all of its inputs at once might have to hold
+##   the whole output of their producer (e.g., of a sort in front of sort -m), so they get
+##   a larger share of the memory budget for eager nodes (see get_eager_buffer_sizes)
+EAGER_BUFFER_WEIGHTS = {
+    SEQUENTIAL: 1,
+    INTERLEAVED: 1,
+    ALL_AT_ONCE: 2,
+}
+
+def get_eager_buffer_weight(node):
+    return EAGER_BUFFER_WEIGHTS[get_input_consumption(node)]
+
+## Returns the inputs of a node (in the order that they are given) that need an eager node
+def get_inputs_needing_eager(node, input_ids):
+    consumption = get_input_consumption(node)
+    if consumption == SEQUENTIAL:
+        return input_ids[1:]
+    elif consumption == INTERLEAVED:
+        return []
+    else:
+        return input_ids
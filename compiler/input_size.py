@@ -0,0 +1,87 @@
+import os
+import stat
+
+from util import *
+
+##
+## Decides whether a region is worth parallelizing (and how widely) based on the size of its input.
+##
+## For small inputs, the fixed cost of spawning the splitters, mappers, and aggregators
+##   (and creating their fifos) is larger than the sequential runtime of the region.
+##
+## The size of a region's input is the sum of the sizes of its input files (which are known
+##   after expansion) and of its stdin. The size of stdin is sent by the runtime if it is a regular file.
+##   Otherwise (e.g., stdin is a pipe), the daemon uses the number of bytes that the splitter read from stdin
+##   in the latest run of the region that reported it (see region_stats.py). A region that runs sequentially
+##   has no splitter, so it keeps the size of its latest parallel run.
+##   If the size of any input is unknown, the width of the region is not changed.
+##
+
+class RegionInputs:
+    def __init__(self, input_files, reads_stdin):
+        ## The paths of the input files of the region (relative ones are resolved against its working directory)
+        self.input_files = input_files
+        self.reads_stdin = reads_stdin
+
+    def __repr__(self):
+        return f'RegionInputs(Files:{self.input_files}, Stdin:{self.reads_stdin})'
+
+## Returns the inputs of an IR, or None if some input is neither a file nor stdin,
+##   or if some node generates data without reading any input (e.g., seq).
+def get_region_inputs(graph):
+    if any(len(node.get_input_list()) == 0 for node in graph.nodes.values()):
+        return None
+    input_files = []
+    reads_stdin = False
+    for fid in graph.all_input_fids():
+        resource = fid.get_resource()
+        if fid.has_file_resource():
+            input_files.append(str(resource.uri))
+        elif fid.has_file_descriptor_resource() and resource.is_stdin():
+            reads_stdin = True
+        else:
+            return None
+    if len(input_files) == 0 and not reads_stdin:
+        return None
+    return RegionInputs(input_files, reads_stdin)
+
+## Returns the total size of the inputs of a region (or None if it is unknown)
+def get_input_size(region_inputs, stdin_size, cwd):
+    if region_inputs is None:
+        return None
+    if region_inputs.reads_stdin and stdin_size is None:
+        return None
+
+    input_size = stdin_size if region_inputs.reads_stdin else 0
+    for input_file in region_inputs.input_files:
+        try:
+            file_stat = os.stat(os.path.join(cwd, input_file))
+        except OSError:
+            return None
+        ## Fifos and devices have no size
+        if not stat.S_ISREG(file_stat.st_mode):
+            return None
+        input_size += file_stat.st_size
+    return input_size
+
+## Returns the width to compile a region with (at most the given one) and the reason for it
+def choose_width(input_size, width, args):
+    if input_size is None:
+        return width, "input size is unknown"
+    if input_size < args.sequential_input_size:
+        return 1, f'input size {input_size} is below the sequential threshold {args.sequential_input_size}'
+    if args.input_size_per_width > 0:
+        size_width = max(input_size // args.input_size_per_width, 1)
+        if size_width < width:
+            return size_width, f'input size {input_size} is enough for {size_width} parallel instances of at least {args.input_size_per_width}'
+    return width, f'input size {input_size} is large enough'
+
+## The working directory of the region, which relative input files are resolved against
+def get_region_cwd(vars_dict):
+    _type, pwd = vars_dict.get('PWD', (None, None))
+    return pwd if pwd else os.getcwd()
+
+## Returns the width to compile a region with (and the reason for it), given its inputs
+def choose_region_width(region_inputs, compiler_config, vars_dict, args):
+    input_size = get_input_size(region_inputs, compiler_config.stdin_size, get_region_cwd(vars_dict))
+    return choose_width(input_size, compiler_config.width, args)
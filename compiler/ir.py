@@ -1,3 +1,4 @@
+from collections import deque, namedtuple
 import pash_annotations.datatypes
 
 from pash_annotations.datatypes.CommandInvocationInitial import CommandInvocationInitial
@@ -9,7 +10,7 @@ from pash_annotations.annotation_generation.datatypes.CommandProperties import C
 from pash_annotations.datatypes.CommandInvocationWithIOVars import CommandInvocationWithIOVars
 
 from annotations_utils.util_parsing import parse_arg_list_to_command_invocation
-from annotations_utils.util_cmd_invocations import get_input_output_info_from_cmd_invocation_util, get_parallelizability_info_from_cmd_invocation_util
+from annotations_utils.util_cmd_invocations import get_input_output_info_from_cmd_invocation_util, get_parallelizability_info_from_cmd_invocation_util, copy_cmd_inv_with_io_vars_renamed
 from annotations_utils.util_file_descriptors import resource_from_file_descriptor
 
 from definitions.ir.file_id import *
@@ -17,15 +18,23 @@ from definitions.ir.nodes.cat import *
 
 import definitions.ir.nodes.pash_split as pash_split
 import definitions.ir.nodes.r_merge as r_merge
+import definitions.ir.nodes.r_repartition as r_repartition
 import definitions.ir.nodes.r_split as r_split
 import definitions.ir.nodes.r_wrap as r_wrap
 import definitions.ir.nodes.r_unwrap as r_unwrap
+import line_framing
 
 from shell_ast.ast_util import *
 from util import *
 
 import config
 
+## An edge of the IR, i.e., a file id together with the node that writes to it
+##   and the node that reads from it (None if the edge is an input or output of the IR).
+##
+## Since it is a tuple it can still be unpacked as (fid, from_node, to_node).
+Edge = namedtuple("Edge", "fid from_node to_node")
+
 ## Creates a file id for a given resource
 def create_file_id_for_resource(resource, fileIdGen):
     file_id = create_split_file_id(fileIdGen)
@@ -37,13 +46,18 @@ def create_split_file_id(fileIdGen):
     file_id = fileIdGen.next_file_id()
     return file_id
 
+## The fifos of the file ids are created in a directory under PASH_TMP_PREFIX.
+##
+## All the generators of a compilation (see IR.get_file_id_gen) share the same directory.
+## The directory is not created here but by the prologue of the compiled script
+##   (see ir_to_ast.make_ir_prologue), and only if the script needs any fifos.
 class FileIdGen:
-    def __init__(self, next = 0, prefix = ""):
+    def __init__(self, next = 0, prefix = "", directory = None):
         self.next = next + 1
-        directory = f"{str(uuid.uuid4().hex)}"
+        if directory is None:
+            directory = f"{str(uuid.uuid4().hex)}"
+        self.directory = directory
         self.prefix = f"{directory}/{prefix}"
-        directory_path = os.path.join(config.PASH_TMP_PREFIX, self.prefix)  
-        os.makedirs(directory_path)
 
     def next_file_id(self):
         fileId = FileId(self.next, self.prefix)
@@ -129,7 +143,7 @@ def get_edge_list_from_file_id_list(dfg_edges, file_ids):
     new_edge_list = []
     for file_id in file_ids:
         fid_id = file_id.get_ident()
-        dfg_edges[fid_id] = (file_id, None, None)
+        dfg_edges[fid_id] = Edge(file_id, None, None)
         new_edge_list.append(fid_id)
     return new_edge_list
 
@@ -146,7 +160,7 @@ def add_file_id_vars(command_invocation_with_io, fileIdGen):
         resource = resource_from_file_descriptor(operand)
         file_id = create_file_id_for_resource(resource, fileIdGen)
         fid_id = file_id.get_ident()
-        dfg_edges[fid_id] = (file_id, None, None)
+        dfg_edges[fid_id] = Edge(file_id, None, None)
         access_map[fid_id] = operand.get_access()
         return fid_id
 
@@ -226,15 +240,15 @@ def compile_command_to_DFG(fileIdGen, command, options,
     for fid_id in dfg_node.get_input_list():
         fid, from_node, to_node = dfg_edges[fid_id]
         assert(to_node is None)
-        dfg_edges[fid_id] = (fid, from_node, node_id)
+        dfg_edges[fid_id] = Edge(fid, from_node, node_id)
     
     for fid_id in dfg_node.get_output_list():
         fid, from_node, to_node = dfg_edges[fid_id]
         assert(from_node is None)
-        dfg_edges[fid_id] = (fid, node_id, to_node)
+        dfg_edges[fid_id] = Edge(fid, node_id, to_node)
     
     dfg_nodes = {node_id : dfg_node}
-    dfg = IR(dfg_nodes, dfg_edges)
+    dfg = IR(dfg_nodes, dfg_edges, file_id_directory=fileIdGen.directory)
     # log(f'IR: {dfg}')
     return dfg
 
@@ -266,10 +280,26 @@ class IR:
     ##
     ## - If two nodes have the same file as output, then they both
     ##   write to it concurrently.
-    def __init__(self, nodes, edges, background = False):
+    def __init__(self, nodes, edges, background = False, file_id_directory = None):
         self.nodes = nodes
         self.edges = edges
         self.background = background
+        ## The directory of the fifos of this IR, that is shared by all the
+        ##   file id generators of its compilation (see get_file_id_gen)
+        self.file_id_directory = file_id_directory
+        ## The width of each mapper that was introduced by a parallelization (shown in graphviz)
+        self.parallelization_widths = {}
+        ## The inputs of the region before its transformations (see input_size.get_region_inputs),
+        ##   since the fifos of a parallelized graph hide them
+        self.region_inputs = None
+
+        ## Indexes of the edges that have no from_node (inputs of the IR)
+        ##   and no to_node (outputs of the IR). They are updated whenever an edge changes
+        ##   so that finding sources, sinks, stdin, and stdout does not scan all edges.
+        self.input_edge_ids = set()
+        self.output_edge_ids = set()
+        for edge_id, (_edge_fid, from_node, to_node) in self.edges.items():
+            self.index_edge(edge_id, from_node, to_node)
 
         ## Apply the redirections for each separate node.
         ## This needs to be called here because nodes do not
@@ -288,49 +318,81 @@ class IR:
         ## We need to merge common files after redirections have been applied.
         self.combine_common_files()
 
+    ## All changes to the edges go through set_edge and remove_edge
+    ##   so that the edge indexes stay up to date.
+    def set_edge(self, edge_id, edge_fid, from_node_id, to_node_id):
+        self.edges[edge_id] = Edge(edge_fid, from_node_id, to_node_id)
+        self.index_edge(edge_id, from_node_id, to_node_id)
+
+    def remove_edge(self, edge_id):
+        del self.edges[edge_id]
+        self.input_edge_ids.discard(edge_id)
+        self.output_edge_ids.discard(edge_id)
+
+    def index_edge(self, edge_id, from_node_id, to_node_id):
+        if from_node_id is None:
+            self.input_edge_ids.add(edge_id)
+        else:
+            self.input_edge_ids.discard(edge_id)
+        if to_node_id is None:
+            self.output_edge_ids.add(edge_id)
+        else:
+            self.output_edge_ids.discard(edge_id)
+
     ## Refactor these to call .add_edge, and .set_edge_to/from 
     ## Add an edge that points to a node
     def add_to_edge(self, to_edge, node_id):
         edge_id = to_edge.get_ident()
         assert(not edge_id in self.edges)
-        self.edges[edge_id] = (to_edge, None, node_id)
+        self.set_edge(edge_id, to_edge, None, node_id)
 
     ## Add an edge that starts from a node
     def add_from_edge(self, node_id, from_edge):
         edge_id = from_edge.get_ident()
         assert(not edge_id in self.edges)
-        self.edges[edge_id] = (from_edge, node_id, None)
+        self.set_edge(edge_id, from_edge, node_id, None)
 
     def set_edge_to(self, edge_id, to_node_id):
         edge_fid, from_node, old_to_node = self.edges[edge_id]
-        self.edges[edge_id] = (edge_fid, from_node, to_node_id)
+        self.set_edge(edge_id, edge_fid, from_node, to_node_id)
 
     def set_edge_from(self, edge_id, from_node_id):
         edge_fid, old_from_node, to_node = self.edges[edge_id]
-        self.edges[edge_id] = (edge_fid, from_node_id, to_node)
+        self.set_edge(edge_id, edge_fid, from_node_id, to_node)
 
     def get_edge_fid(self, fid_id):
         if(fid_id in self.edges):
-            return self.edges[fid_id][0]
+            return self.edges[fid_id].fid
         else:
             return None
 
+    ## Whether an edge is an input of the graph that is read from a file (rather than a stream),
+    ##   so that it can be split without reading it sequentially.
+    def is_file_input_edge(self, edge_id):
+        fid, from_node, _to_node = self.edges[edge_id]
+        return from_node is None and fid.has_file_resource()
+
+    ## Whether the only streaming input of a node is read from a file
+    def node_reads_file_input(self, node_id):
+        streaming_inputs = self.get_node(node_id).get_streaming_inputs()
+        return len(streaming_inputs) == 1 and self.is_file_input_edge(streaming_inputs[0])
+
     def get_edge_from(self, edge_id):
         if(edge_id in self.edges):
-            return self.edges[edge_id][1]
+            return self.edges[edge_id].from_node
         else:
             return None
 
     def replace_edge(self, old_edge_id, new_edge_fid):
-        assert(new_edge_fid not in self.all_fids())
         new_edge_id = new_edge_fid.get_ident()
+        assert(not new_edge_id in self.edges)
         old_fid, from_node, to_node = self.edges[old_edge_id]
-        self.edges[new_edge_id] = (new_edge_fid, from_node, to_node)
+        self.set_edge(new_edge_id, new_edge_fid, from_node, to_node)
         if from_node:
             self.get_node(from_node).replace_edge(old_edge_id, new_edge_id)
         if to_node:
             self.get_node(to_node).replace_edge(old_edge_id, new_edge_id)
-        del self.edges[old_edge_id]
+        self.remove_edge(old_edge_id)
         
     def get_stdin(self):
         stdin_id = self.get_stdin_id()
@@ -343,21 +405,24 @@ class IR:
         return stdout_fid
 
     ## Gets the fid that points to the stdin of this DFG
+    ##
+    ## Note: Only input edges are checked since no node can write to stdin.
     def get_stdin_id(self):
         ## ASSERT: There must be only one
         stdin_id = None
-        for edge_id, (edge_fid, _from, _to) in self.edges.items():
-            resource = edge_fid.get_resource()
+        for edge_id in self.input_edge_ids:
+            resource = self.edges[edge_id].fid.get_resource()
             if(resource.is_stdin()):
                 assert(stdin_id is None)
                 stdin_id = edge_id
         return stdin_id  
 
+    ## Note: Only output edges are checked since no node can read from stdout.
     def get_stdout_id(self):
         ## ASSERT: There must be only one
         stdout_id = None
-        for edge_id, (edge_fid, _from, _to) in self.edges.items():
-            resource = edge_fid.get_resource()
+        for edge_id in self.output_edge_ids:
+            resource = self.edges[edge_id].fid.get_resource()
             if(resource.is_stdout()):
                 # This is not true when using distributed_exec
                 # assert(stdout_id is None)
@@ -398,7 +463,7 @@ class IR:
             file_to_redirect_to = fid.to_ast()
             ## Change the stdin_id to point to this resource
             _prev_fid, from_node, to_node = self.edges[stdin_id]
-            self.edges[stdin_id] = (fid, from_node, to_node)
+            self.set_edge(stdin_id, fid, from_node, to_node)
             ## Create a command that redirects stdin to this ephemeral fid
             redirect_stdin_script = os.path.join(config.PASH_TOP, config.config['runtime']['redirect_stdin_binary'])
             com_args = [string_to_argument('source'), string_to_argument(redirect_stdin_script), file_to_redirect_to]
@@ -419,7 +484,7 @@ class IR:
         ## at random.
         stdout_edge_id = self.get_stdout_id()
         if (not stdout_edge_id is None):
-            sink_node_ids = [self.edges[stdout_edge_id][1]]
+            sink_node_ids = [self.edges[stdout_edge_id].from_node]
         else:
             sink_node_ids = self.sink_nodes()
             sink_node_ids = [sink_node_ids[0]]
@@ -502,7 +567,7 @@ class IR:
         ## ... = OtherInNode(..., my_out, ...)
         other_in_node = other.nodes[other_in_node_id]
         other_in_node.replace_edge(other_in, my_out)
-        other.edges.pop(other_in)
+        other.remove_edge(other_in)
 
         ## Make the my_out id to be ephemeral file.
         my_out_fid, from_node, to_node = self.edges[my_out]
@@ -510,7 +575,7 @@ class IR:
         my_out_fid.make_ephemeral()
 
         ## Add the other node in my edges
-        self.edges[my_out] = (my_out_fid, from_node, other_in_node_id)
+        self.set_edge(my_out, my_out_fid, from_node, other_in_node_id)
 
         ## Just call union here
         self.union(other)
@@ -532,15 +597,18 @@ class IR:
         self.union(other)
 
     def union(self, other):
+        if self.file_id_directory is None:
+            self.file_id_directory = other.file_id_directory
+
         ## Merge the nodes of the two DFGs
         all_nodes = {**self.nodes, **other.nodes}
 
-        ## Merge edges
-        all_edges = {**self.edges, **other.edges}
-
         ## TODO: Check that all ids are OK (no cycles etc)
         self.nodes = all_nodes
-        self.edges = all_edges
+
+        ## Merge edges
+        for edge_id, (edge_fid, from_node, to_node) in other.edges.items():
+            self.set_edge(edge_id, edge_fid, from_node, to_node)
 
         ## TODO: Handle connections of common files (pipes, etc)
         self.combine_common_files()
@@ -568,6 +636,16 @@ class IR:
         ## input and 1 output (or more than 1 output in general) we
         ## signal an error.
 
+        ## Index the outputs with a file resource of all nodes by their resource.
+        ##   Each entry is a [node_id, edge_id] pair (in node and output order),
+        ##   and its edge_id is updated if the output is unified with an input.
+        outputs_by_resource = {}
+        for node_id2 in self.nodes:
+            for id_out, fid_out in self.get_node_output_ids_fids(node_id2):
+                if fid_out.has_file_resource():
+                    resource_key = str(fid_out.get_resource())
+                    outputs_by_resource.setdefault(resource_key, []).append([node_id2, id_out])
+
         ## For all inputs of all nodes, check if they are the output
         ## of exactly one other node.
         # log("Combining files for:", self)
@@ -577,19 +655,18 @@ class IR:
             for id_in, fid_in in inputs_with_file_resource:
                 in_resource = fid_in.get_resource()
                 number_of_out_resources = 0
-                for node_id2, _node2 in self.nodes.items():
-                    outputs_with_file_resource = [(id, fid) for id, fid in self.get_node_output_ids_fids(node_id2)
-                                                  if fid.has_file_resource()]
-                    for id_out, fid_out in outputs_with_file_resource:
-                        out_resource = fid_out.get_resource()
-                        ## Do not combine if the ids of the edges are already the same
-                        if (not id_in == id_out
-                            and in_resource == out_resource):
-                            number_of_out_resources += 1
-                            ## They point to the same File resource so we need to unify their fids
-                            self.nodes[node_id2].replace_edge(id_out, id_in)
-                            self.set_edge_from(id_in, node_id2)
-                            self.set_edge_from(id_out, None)
+                for output_entry in outputs_by_resource.get(str(in_resource), []):
+                    node_id2, id_out = output_entry
+                    out_resource = self.edges[id_out].fid.get_resource()
+                    ## Do not combine if the ids of the edges are already the same
+                    if (not id_in == id_out
+                        and in_resource == out_resource):
+                        number_of_out_resources += 1
+                        ## They point to the same File resource so we need to unify their fids
+                        self.nodes[node_id2].replace_edge(id_out, id_in)
+                        self.set_edge_from(id_in, node_id2)
+                        self.set_edge_from(id_out, None)
+                        output_entry[1] = id_in
 
                 ## Exit with an error if a file is written by more than one node.
                 ##
@@ -603,14 +680,12 @@ class IR:
 
     ## Returns all input fids of the IR
     def all_input_fids(self):
-        all_input_fids = [fid for fid, from_node, _to_node in self.edges.values()
-                          if from_node is None]
+        all_input_fids = [self.edges[edge_id].fid for edge_id in self.input_edge_ids]
         return all_input_fids
 
     ## Returns all output fids of the IR
     def all_output_fids(self):
-        all_output_fids = [fid for fid, _from_node, to_node in self.edges.values()
-                          if to_node is None]
+        all_output_fids = [self.edges[edge_id].fid for edge_id in self.output_edge_ids]
         return all_output_fids
 
     ## Returns the sources of the IR.
@@ -618,8 +693,9 @@ class IR:
     ##     but also nodes that have no incoming edge (generator nodes). 
     def source_nodes(self):
         sources = set()
-        for _edge_fid, from_node, to_node in self.edges.values():
-            if(from_node is None and not to_node is None):
+        for edge_id in self.input_edge_ids:
+            to_node = self.edges[edge_id].to_node
+            if(not to_node is None):
                 sources.add(to_node)
         for node_id, node in self.nodes.items():
             if len(node.get_input_list()) == 0:
@@ -628,11 +704,42 @@ class IR:
 
     def sink_nodes(self):
         sources = set()
-        for _edge_fid, from_node, to_node in self.edges.values():
-            if(to_node is None and not from_node is None):
+        for edge_id in self.output_edge_ids:
+            from_node = self.edges[edge_id].from_node
+            if(not from_node is None):
                 sources.add(from_node)
         return list(sources)
 
+    ## Returns the ids of all nodes in topological order (Kahn's algorithm).
+    ##   Nodes are visited in insertion order when there is a choice.
+    def topological_order(self):
+        in_degrees = {node_id: len(self.get_previous_nodes(node_id)) for node_id in self.nodes}
+        ready = deque(node_id for node_id, in_degree in in_degrees.items() if in_degree == 0)
+        order = []
+        while len(ready) > 0:
+            node_id = ready.popleft()
+            order.append(node_id)
+            for next_node_id in self.get_next_nodes(node_id):
+                in_degrees[next_node_id] -= 1
+                if in_degrees[next_node_id] == 0:
+                    ready.append(next_node_id)
+        ## The graph must not have cycles
+        assert(len(order) == len(self.nodes))
+        return order
+
+    ## Returns an estimate of the share of the data of the region that goes through each edge,
+    ##   assuming that every input edge of the region carries the same amount
+    ##   and that every node splits the data of its inputs evenly to its outputs.
+    def estimate_edge_data_shares(self):
+        shares = {edge_id: 1.0 for edge_id in self.input_edge_ids}
+        for node_id in self.topological_order():
+            input_share = sum(shares.get(edge_id, 0.0) for edge_id in self.get_node_inputs(node_id))
+            output_ids = self.get_node_outputs(node_id)
+            for edge_id in output_ids:
+                ## Generators (nodes without inputs) are considered to produce as much as an input
+                shares[edge_id] = (input_share if input_share > 0 else 1.0) / len(output_ids)
+        return shares
+
     def get_node_inputs(self, node_id):
         input_edge_ids = self.nodes[node_id].get_input_list()
         return input_edge_ids
@@ -663,7 +770,7 @@ class IR:
 
     def get_node_input_ids_fids(self, node_id):
         node = self.get_node(node_id)
-        return [(input_edge_id, self.edges[input_edge_id][0]) for input_edge_id in node.get_input_list()]
+        return [(input_edge_id, self.edges[input_edge_id].fid) for input_edge_id in node.get_input_list()]
 
     def get_node_input_ids(self, node_id):
         return [fid_id for fid_id, _fid in self.get_node_input_ids_fids(node_id)]
@@ -673,7 +780,7 @@ class IR:
 
     def get_node_output_ids_fids(self, node_id):
         node = self.get_node(node_id)
-        return [(output_edge_id, self.edges[output_edge_id][0]) for output_edge_id in node.get_output_list()]
+        return [(output_edge_id, self.edges[output_edge_id].fid) for output_edge_id in node.get_output_list()]
 
     def get_node_output_ids(self, node_id):
         return [fid_id for fid_id, _fid in self.get_node_output_ids_fids(node_id)]
@@ -686,10 +793,12 @@ class IR:
 
     ## This command gets all file identifiers of the graph, and
     ## returns a fileId generator that won't clash with the existing
-    ## ones.
+    ## ones. The generator creates its fifos in the directory of the graph.
     def get_file_id_gen(self):
         max_id = max(self.edges.keys())
-        return FileIdGen(max_id)
+        file_id_gen = FileIdGen(max_id, directory=self.file_id_directory)
+        self.file_id_directory = file_id_gen.directory
+        return file_id_gen
 
     def remove_node(self, node_id):
         node = self.nodes.pop(node_id)
@@ -723,28 +832,29 @@ class IR:
     def add_edge(self, edge_fid):
         fid_id = edge_fid.get_ident()
         assert(not fid_id in self.edges)
-        self.edges[fid_id] = (edge_fid, None, None)
+        self.set_edge(fid_id, edge_fid, None, None)
 
     ## Note: We assume that the lack of nodes is an adequate condition
     ##       to check emptiness.
     def empty(self):
         return (len(self.nodes) == 0)
 
-    def apply_parallelization_to_node(self, node_id, parallelizer, fileIdGen, fan_out, r_split_batch_size):
+    def apply_parallelization_to_node(self, node_id, parallelizer, fileIdGen, fan_out, r_split_batch_size,
+                                      r_split_min_batch_size=None):
         splitter = parallelizer.get_splitter()
         if splitter.is_splitter_round_robin():
             self.apply_round_robin_parallelization_to_node(node_id, parallelizer, fileIdGen, fan_out,
-                                                           r_split_batch_size)
+                                                           r_split_batch_size, r_split_min_batch_size)
         elif splitter.is_splitter_round_robin_with_unwrap_flag():
             self.apply_round_robin_with_unwrap_flag_parallelization_to_node(node_id, parallelizer, fileIdGen, fan_out,
-                                                                            r_split_batch_size)
+                                                                            r_split_batch_size, r_split_min_batch_size)
         elif splitter.is_splitter_consec_chunks():
             self.apply_consecutive_chunks_parallelization_to_node(node_id, parallelizer, fileIdGen, fan_out)
         else:
             raise Exception("Splitter not yet implemented")
 
     def apply_round_robin_parallelization_to_node(self, node_id, parallelizer, fileIdGen, fan_out,
-                                                  r_split_batch_size):
+                                                  r_split_batch_size, r_split_min_batch_size=None):
         # TODO: this control flow should move done to aggregators once we implement them;
         #  currently, this cannot be done since splitter etc. would be added...
         aggregator_spec = parallelizer.get_aggregator_spec()
@@ -776,10 +886,13 @@ class IR:
 
         if can_be_fused_with_prev:
             self.remove_node(prev_nodes[0]) # also sets respective edge to's and from's to None
-            in_mapper_ids = first_pred_cmd_inv.operand_list
+            in_mapper_ids = self.repartition_round_robin_outputs(first_pred_cmd_inv.operand_list, fan_out, fileIdGen)
         else: # cannot be fused so introduce splitter
             # splitter
-            round_robin_splitter_generator = lambda input_id, output_ids: r_split.make_r_split(input_id, output_ids, r_split_batch_size)
+            ## r_split picks its block sizes depending on whether r_wrap forks the mappers for every block
+            mappers_fork_per_block = line_framing.get_line_framing_flag(original_cmd_invocation_with_io_vars) is None
+            round_robin_splitter_generator = lambda input_id, output_ids: r_split.make_r_split(input_id, output_ids, r_split_batch_size,
+                                                                                               r_split_min_batch_size, mappers_fork_per_block)
             out_split_ids = self.introduce_splitter(round_robin_splitter_generator, fan_out, fileIdGen, streaming_input)
             in_mapper_ids = out_split_ids
 
@@ -792,7 +905,7 @@ class IR:
         self.introduce_aggregator_for_round_robin(out_mapper_ids, parallelizer, streaming_output)
 
     def apply_round_robin_with_unwrap_flag_parallelization_to_node(self, node_id, parallelizer, fileIdGen, fan_out,
-                                                                   r_split_batch_size):
+                                                                   r_split_batch_size, r_split_min_batch_size=None):
         # round robin with unwrap flag is an inferred parallelizer which ensures that
         # the command is commutative and has an aggregator for consecutive chunks;
         # thus we can check whether we can re-open a previous "RR"-parallelization ending with `r_merge`
@@ -814,12 +927,12 @@ class IR:
 
         if can_be_fused_with_prev: # and node.is_commutative(): implied by how this kind of splitter is inferred
             self.remove_node(prev_nodes[0]) # also sets respective edge to's and from's to None
-            in_unwrap_ids = first_pred_cmd_inv.operand_list
+            in_unwrap_ids = self.repartition_round_robin_outputs(first_pred_cmd_inv.operand_list, fan_out, fileIdGen)
             out_unwrap_ids = self.introduce_unwraps(fileIdGen, in_unwrap_ids)
             in_mapper_ids = out_unwrap_ids
         else:
             # splitter
-            round_robin_with_unwrap_flag_splitter_generator = lambda input_id, output_ids: r_split.make_r_split_with_unwrap_flag(input_id, output_ids, r_split_batch_size)
+            round_robin_with_unwrap_flag_splitter_generator = lambda input_id, output_ids: r_split.make_r_split_with_unwrap_flag(input_id, output_ids, r_split_batch_size, r_split_min_batch_size)
             out_split_ids = self.introduce_splitter(round_robin_with_unwrap_flag_splitter_generator, fan_out, fileIdGen, streaming_input)
             in_mapper_ids = out_split_ids
 
@@ -848,7 +961,9 @@ class IR:
         if len(prev_nodes) == 1:
             first_pred_node, first_pred_cmd_inv = \
                 self.get_only_previous_node_and_only_previous_cmd_invocation(prev_nodes)
-            if first_pred_cmd_inv.is_aggregator_concatenate():
+            # the outputs of the previous node have to be grouped in order to the mappers of this one
+            if (first_pred_cmd_inv.is_aggregator_concatenate()
+                and len(first_pred_cmd_inv.operand_list) % fan_out == 0):
                 can_be_fused_with_prev = True
 
         # remove node to be parallelized
@@ -856,7 +971,7 @@ class IR:
 
         if can_be_fused_with_prev:
             self.remove_node(prev_nodes[0]) # also sets respective edge to's and from's to None
-            in_mapper_ids = first_pred_cmd_inv.operand_list
+            in_mapper_ids = self.repartition_consecutive_chunks_outputs(first_pred_cmd_inv.operand_list, fan_out, fileIdGen)
         else: # cannot be fused so introduce splitter
             # splitter
             consec_chunks_splitter_generator = lambda input_id, output_ids: pash_split.make_split_file(input_id, output_ids)
@@ -883,6 +998,38 @@ class IR:
         first_pred_cmd_inv = first_pred_node.cmd_invocation_with_io_vars
         return first_pred_node, first_pred_cmd_inv
 
+    ## Moves the (wrapped) blocks of the outputs of a round robin parallelized node
+    ##   to fan_out inputs for the mappers of the next node, if the two widths differ.
+    def repartition_round_robin_outputs(self, in_ids, fan_out, fileIdGen):
+        if len(in_ids) == fan_out:
+            return in_ids
+        out_ids = self.generate_ephemeral_edges(fileIdGen, fan_out)
+        repartition = r_repartition.make_r_repartition_node(in_ids, out_ids)
+        for in_id in in_ids:
+            self.set_edge_to(in_id, repartition.get_id())
+        for out_id in out_ids:
+            self.set_edge_from(out_id, repartition.get_id())
+        self.add_node(repartition)
+        return out_ids
+
+    ## Groups the (consecutive) outputs of a node parallelized with consecutive chunks
+    ##   into fan_out inputs for the mappers of the next node, preserving their order.
+    ##   The number of outputs must be a multiple of fan_out.
+    def repartition_consecutive_chunks_outputs(self, in_ids, fan_out, fileIdGen):
+        assert(len(in_ids) % fan_out == 0)
+        group_size = len(in_ids) // fan_out
+        if group_size == 1:
+            return in_ids
+        out_ids = self.generate_ephemeral_edges(fileIdGen, fan_out)
+        for i, out_id in enumerate(out_ids):
+            group_in_ids = in_ids[i * group_size:(i + 1) * group_size]
+            cat = make_cat_node(group_in_ids, out_id)
+            for in_id in group_in_ids:
+                self.set_edge_to(in_id, cat.get_id())
+            self.set_edge_from(out_id, cat.get_id())
+            self.add_node(cat)
+        return out_ids
+
     def introduce_splitter(self, splitter_generator, fan_out, fileIdGen, streaming_input):
         out_split_ids = self.generate_ephemeral_edges(fileIdGen, fan_out)
         splitter = splitter_generator(streaming_input, out_split_ids)
@@ -902,12 +1049,19 @@ class IR:
         # list of output, aux_output_1, aux_output_2, ...
         zip_mapper_in_out_ids = zip(in_mapper_ids, out_mapper_ids)
         all_mappers = []
+        ## All mappers are the same modulo their input and output edges, so we only instantiate
+        ##   the mapper once and then copy it (sharing its arguments) with the edges of each mapper.
+        template_mapper_cmd_inv = None
         for (in_id, out_ids) in zip_mapper_in_out_ids:
             # BEGIN: these 4 lines could be refactored to be a function in graph such that
             # creating end point of edges and the creation of edges is not decoupled
             out_id = out_ids[0]
             aux_out_ids = out_ids[1:]
-            mapper_cmd_inv = parallelizer.get_actual_mapper(original_cmd_invocation_with_io_vars, in_id, out_id, aux_out_ids)
+            if template_mapper_cmd_inv is None:
+                template_mapper_cmd_inv = parallelizer.get_actual_mapper(original_cmd_invocation_with_io_vars, in_id, out_id, aux_out_ids)
+                template_io_vars = [in_id] + out_ids
+            var_renaming = dict(zip(template_io_vars, [in_id] + out_ids))
+            mapper_cmd_inv = copy_cmd_inv_with_io_vars_renamed(template_mapper_cmd_inv, var_renaming)
             mapper = DFGNode.make_simple_dfg_node_from_cmd_inv_with_io_vars(mapper_cmd_inv)
             self.set_edge_to(in_id, mapper.get_id())
             self.set_edge_from(out_id, mapper.get_id())
@@ -920,6 +1074,7 @@ class IR:
                 self.set_edge_to(in_id, mapper_r_wrapped.get_id())
                 self.set_edge_from(out_id, mapper_r_wrapped.get_id())
                 mapper = mapper_r_wrapped
+            self.parallelization_widths[mapper.get_id()] = fan_out
             all_mappers.append(mapper)
         for new_node in all_mappers:
             self.add_node(new_node)
@@ -991,7 +1146,7 @@ class IR:
     ## Replicates an edge using tee and returns the new node_id.
     def tee_edge(self, edge_id, times, fileIdGen):
         ## Assert that the edge is unplugged
-        assert(self.edges[edge_id][2] is None)
+        assert(self.edges[edge_id].to_node is None)
 
         output_fids = [fileIdGen.next_ephemeral_file_id() for _ in range(times)]
         output_ids = [fid.get_ident() for fid in output_fids]
@@ -1019,7 +1174,11 @@ class IR:
 
         ## First generate all nodes
         for node_id, node in self.nodes.items():
-            dot = node.add_dot_node(dot, node_id)
+            if node_id in self.parallelization_widths:
+                label = f'{node.get_dot_label()}\nwidth: {self.parallelization_widths[node_id]}'
+                dot.node(str(node_id), label=label)
+            else:
+                dot = node.add_dot_node(dot, node_id)
 
         ## (I/O) File nodes should be boxes
         dot.attr('node', shape='box')
@@ -1072,6 +1231,13 @@ class IR:
                     log("Consistency Error: The from_node_id of the output_edge:", edge_id, "of the node:", node, "is equal to:", from_node_id)
                     return False
 
+        ## Check that the edge indexes are up to date
+        input_edge_ids = set(edge_id for edge_id, (_, from_node_id, _) in self.edges.items() if from_node_id is None)
+        output_edge_ids = set(edge_id for edge_id, (_, _, to_node_id) in self.edges.items() if to_node_id is None)
+        if(not (input_edge_ids == self.input_edge_ids and output_edge_ids == self.output_edge_ids)):
+            log("Consistency Error: The input and output edge indexes are not consistent with the edges")
+            return False
+
         return True
 
     ## This function checks whether an IR is valid -- that is, if it
@@ -1122,7 +1288,7 @@ class IR:
 
         ## Replace the previous final_output_id with the previous id
         node_output_edge_id = out_aggregator_id
-        final_merge_node_id = self.edges[final_output_id][1]
+        final_merge_node_id = self.edges[final_output_id].from_node
         final_merge_node = self.get_node(final_merge_node_id)
         final_merge_node.replace_edge(final_output_id, node_output_edge_id)
         self.set_edge_from(node_output_edge_id, final_merge_node_id)
@@ -9,11 +9,19 @@ import config
 RM_PASH_FIFOS_NAME="rm_pash_fifos"
 MKFIFO_PASH_FIFOS_NAME="mkfifo_pash_fifos"
 
-def to_shell(ir, args):
+## The fifos are created (and removed) by a few commands with many arguments each,
+##   instead of one process per fifo. The arguments of each command are kept well below
+##   ARG_MAX (which is shared with the environment).
+MAX_FIFO_COMMAND_ARGS_LENGTH = 128 * 1024
+
+## If remove_fifo_directories is set, then the compiled script owns the directories of its fifos
+##   and removes them whole. This is not the case for graphs that are split into
+##   multiple scripts (e.g., in distributed execution) since these share their directories.
+def to_shell(ir, args, remove_fifo_directories=True):
     backend_start_time = datetime.now()
 
     ## First call an IR to AST compilation pass
-    output_asts = ir2ast(ir, args)
+    output_asts = ir2ast(ir, args, remove_fifo_directories)
 
     ## Then just call the parser.
     output_script = from_ast_objects_to_shell(output_asts)
@@ -24,7 +32,7 @@ def to_shell(ir, args):
     return output_script
 
 
-def ir2ast(ir, args):
+def ir2ast(ir, args, remove_fifo_directories=True):
     clean_up_graph = False
     drain_streams = False
     if(args.termination == "clean_up_graph"):
@@ -58,7 +66,7 @@ def ir2ast(ir, args):
     # log("Ephemeral fids:", ephemeral_fids)
 
     ## Call the prologue that creates fifos for all ephemeral fids
-    prologue = make_ir_prologue(ephemeral_fids)
+    prologue = make_ir_prologue(ephemeral_fids, remove_fifo_directories)
 
     ## Call the epilogue that removes all ephemeral fids
     epilogue = make_ir_epilogue(ephemeral_fids, clean_up_graph, args.log_file)
@@ -69,24 +77,62 @@ def ir2ast(ir, args):
 
 def make_rms_f_prologue_epilogue(ephemeral_fids):
     asts = []
-    ## Create an `rm -f` for each ephemeral fid
-    for eph_fid in ephemeral_fids:
-        args = [eph_fid.to_ast()]
+    ## Create an `rm -f` for each chunk of ephemeral fids
+    for chunk in chunk_fids(ephemeral_fids):
+        args = [eph_fid.to_ast() for eph_fid in chunk]
         command = make_rm_f_ast(args)
         asts.append(command)
     return asts
 
-def make_ir_prologue(ephemeral_fids) -> "list[AstNode]":
+## Splits the given fids into chunks whose total length fits in a single command
+def chunk_fids(ephemeral_fids):
+    chunks = []
+    chunk = []
+    chunk_length = 0
+    for eph_fid in ephemeral_fids:
+        length = len(os.path.join(config.PASH_TMP_PREFIX, eph_fid.get_fifo_suffix())) + 1
+        if (len(chunk) > 0 and chunk_length + length > MAX_FIFO_COMMAND_ARGS_LENGTH):
+            chunks.append(chunk)
+            chunk = []
+            chunk_length = 0
+        chunk.append(eph_fid)
+        chunk_length += length
+    if (len(chunk) > 0):
+        chunks.append(chunk)
+    return chunks
+
+## Returns the (unique) directories of the given fids together with their ASTs
+def get_fifo_directory_asts(ephemeral_fids):
+    directory_asts = {}
+    for eph_fid in ephemeral_fids:
+        directory = eph_fid.get_directory()
+        if not directory in directory_asts:
+            directory_asts[directory] = eph_fid.directory_to_ast()
+    return list(directory_asts.values())
+
+def make_ir_prologue(ephemeral_fids, remove_fifo_directories=True) -> "list[AstNode]":
     asts = []
-    ## Create an `rm -f` for each ephemeral fid
-    rm_asts = make_rms_f_prologue_epilogue(ephemeral_fids)
+    ## All the fifos of a compilation are in the same directory,
+    ##   so they are all removed with a single `rm -rf` of that directory.
+    directory_asts = get_fifo_directory_asts(ephemeral_fids)
+    if (not remove_fifo_directories):
+        ## Create an `rm -f` for each ephemeral fid
+        rm_asts = make_rms_f_prologue_epilogue(ephemeral_fids)
+    elif (len(directory_asts) > 0):
+        rm_asts = [make_rm_rf_ast(directory_asts)]
+    else:
+        rm_asts = []
     defun_rm_pash_fifos = make_defun(RM_PASH_FIFOS_NAME, make_semi_sequence(rm_asts))
     asts.append(defun_rm_pash_fifos)
 
-    ## Create a `mkfifo` for each ephemeral fid
+    ## The directories of the fifos are only created here (and only if there are any fifos)
     mkfifo_asts = []
-    for eph_fid in ephemeral_fids:
-        args = [eph_fid.to_ast()]
+    if (len(directory_asts) > 0):
+        mkfifo_asts.append(make_mkdir_p_ast(directory_asts))
+
+    ## Create a `mkfifo` for each chunk of ephemeral fids
+    for chunk in chunk_fids(ephemeral_fids):
+        args = [eph_fid.to_ast() for eph_fid in chunk]
         command = make_mkfifo_ast(args)
         mkfifo_asts.append(command)
     
@@ -121,7 +167,7 @@ def make_ir_epilogue(ephemeral_fids, clean_up_graph, log_file) -> "list[AstNode]
         exit_status = make_command([string_to_argument("internal_exec_status=$?")])
         asts.extend([wait_com, exit_status])
 
-    ## Create an `rm -f` for each ephemeral fid
+    ## Remove all the fifos
     call_rm_pash_funs = make_command([string_to_argument(RM_PASH_FIFOS_NAME)])
     asts.append(call_rm_pash_funs)
 
@@ -144,6 +190,14 @@ def make_rm_f_ast(arguments):
     all_args = [string_to_argument("rm"), string_to_argument("-f")] + arguments
     return make_command(all_args)
 
+def make_rm_rf_ast(arguments):
+    all_args = [string_to_argument("rm"), string_to_argument("-rf")] + arguments
+    return make_command(all_args)
+
+def make_mkdir_p_ast(arguments):
+    all_args = [string_to_argument("mkdir"), string_to_argument("-p")] + arguments
+    return make_command(all_args)
+
 def make_mkfifo_ast(arguments):
     all_args = [string_to_argument("mkfifo")] + arguments
     return make_command(all_args)
@@ -0,0 +1,251 @@
+import os
+import shlex
+import urllib.parse
+from datetime import datetime
+
+from pash_annotations.datatypes.BasicDatatypes import Flag, ArgStringType, Operand
+from pash_annotations.datatypes.BasicDatatypesWithIO import OptionWithIO
+from shasta.ast_node import string_of_arg
+
+import config
+from definitions.ir.arg import Arg
+from definitions.ir.resource import FileDescriptorResource, FileResource, TemporaryFileResource, EphemeralResource
+from util import *
+
+##
+## The native backend: instead of a bash script that creates a fifo for every ephemeral edge
+##   and runs every node in the background, the compiled script gives the graph to runtime/pash_executor,
+##   which connects the nodes with anonymous pipes, spawns them, waits for the sink, and sends
+##   a SIGPIPE to the rest (as the bash backend does with --termination clean_up_graph).
+##
+## The graph is given to the executor as a plan (see runtime/pash_executor.c) in a here-document,
+##   so that the compiled script is still self-contained (e.g., for the plan cache).
+## A node reads and writes the pipes of its streaming input and output on its stdin and stdout,
+##   and it gets the pipes that are its arguments as /dev/fd/N.
+##
+## The executor runs every node as a command in the PATH, with all of its arguments expanded,
+##   so the graphs that it cannot run (e.g., with arguments that are not literal strings)
+##   are compiled by the bash backend instead.
+##
+## Whether a command is a shell function or a builtin (which the executor cannot run)
+##   is only known when the script runs, so the script then runs the bash backend's script instead.
+##
+
+EXECUTOR_PLAN_DELIMITER = "PASH_EXECUTOR_PLAN"
+
+## Characters that are written as they are in the plan (all others are percent-encoded)
+PLAN_SAFE_CHARS = "/._-+=:,@"
+
+## Unquoted characters that the shell would expand or interpret in an argument
+##   (the arguments of the nodes are shell words, not strings, see get_argument_words)
+SHELL_SPECIAL_CHARS = "$`*?[{~;&|<>()"
+
+## The characters that a backslash escapes in double quotes
+##   (a backslash before a newline is a line continuation instead, see get_argument_words)
+DOUBLE_QUOTE_ESCAPED_CHARS = "$`\"\\"
+
+class UnsupportedByExecutor(Exception):
+    pass
+
+## Returns the script that runs the graph with the executor, or None if the executor cannot run it.
+##   The script of the bash backend (from make_bash_script) is run instead if any command is not a file.
+def to_executor_script(ir, args, make_bash_script):
+    backend_start_time = datetime.now()
+    try:
+        plan = make_executor_plan(ir, args)
+    except UnsupportedByExecutor as e:
+        log("The native executor cannot run the graph, using the bash backend --", e)
+        return None
+
+    executor_bin = os.path.join(config.PASH_TOP, config.config['runtime']['executor_binary'])
+    script = "{} 3<<'{}'\n{}{}\n".format(shlex.quote(executor_bin), EXECUTOR_PLAN_DELIMITER,
+                                         plan, EXECUTOR_PLAN_DELIMITER)
+
+    ## The commands with a path are files, the others are looked up as the shell would
+    command_names = sorted(set(str(node.cmd_invocation_with_io_vars.cmd_name) for node in ir.nodes.values()))
+    command_names = [name for name in command_names if not "/" in name]
+    if (len(command_names) > 0):
+        types_check = "type -t -- {} | grep -vx file".format(" ".join(shlex.quote(name) for name in command_names))
+        bash_script = make_bash_script()
+        script = 'if [ -z "$({})" ]; then\n{}else\n{}\nfi\n'.format(types_check, script, bash_script.rstrip("\n"))
+
+    backend_end_time = datetime.now()
+    print_time_delta("Backend", backend_start_time, backend_end_time)
+    return script
+
+def make_executor_plan(ir, args):
+    if (args.termination != "clean_up_graph"):
+        raise UnsupportedByExecutor(f"termination {args.termination}")
+
+    ## Every ephemeral edge becomes a pipe between its two nodes
+    ##   (transformations might leave edges that no node uses)
+    pipes = {}
+    for edge_id, (fid, from_node, to_node) in ir.edges.items():
+        if (fid.is_ephemeral() and not (from_node is None and to_node is None)):
+            if (from_node is None or to_node is None):
+                raise UnsupportedByExecutor(f"ephemeral edge {edge_id} is missing one of its ends")
+            pipes[edge_id] = len(pipes)
+
+    ## The executor waits for the same node as the bash backend (see IR.to_ast)
+    stdout_edge_id = ir.get_stdout_id()
+    if (not stdout_edge_id is None):
+        sink_node_id = ir.edges[stdout_edge_id].from_node
+    else:
+        sink_node_id = ir.sink_nodes()[0]
+
+    lines = [f"pipes {len(pipes)}"]
+    for node_id, node in ir.nodes.items():
+        lines += make_node_plan(node_id, node, ir.edges, pipes)
+        if (node_id == sink_node_id):
+            lines.append("sink")
+    lines.append("end")
+    return "".join(line + "\n" for line in lines)
+
+def make_node_plan(node_id, node, edges, pipes):
+    if (len(node.com_assignments) > 0):
+        raise UnsupportedByExecutor(f"node {node_id} has assignments")
+    cmd_inv = node.cmd_invocation_with_io_vars
+    node_plan = NodePlan(node_id, edges, pipes)
+
+    argv = [str(cmd_inv.cmd_name)]
+    for flag_option in cmd_inv.flag_option_list:
+        if (isinstance(flag_option, Flag)):
+            argv.append(flag_option.get_name())
+        elif (isinstance(flag_option, OptionWithIO)):
+            argv.append(flag_option.get_name())
+            argv += node_plan.argument_to_words(flag_option.get_arg())
+        else:
+            raise UnsupportedByExecutor(f"node {node_id} has an unknown option {flag_option}")
+    for operand in cmd_inv.operand_list:
+        if (isinstance(operand, Operand)):
+            operand = operand.get_name()
+        argv += node_plan.argument_to_words(operand)
+
+    if (not cmd_inv.implicit_use_of_streaming_input is None):
+        node_plan.redirect(cmd_inv.implicit_use_of_streaming_input, 0)
+    if (not cmd_inv.implicit_use_of_streaming_output is None):
+        node_plan.redirect(cmd_inv.implicit_use_of_streaming_output, 1)
+
+    return (["node"]
+            + [f"arg {encode_plan_string(arg)}" for arg in argv]
+            + node_plan.fd_lines)
+
+## The file descriptors of a node (and the paths of its edges in its arguments)
+class NodePlan:
+    ## The pipes that are arguments are given to the node as the fds from here on
+    FIRST_ARGUMENT_FD = 3
+
+    def __init__(self, node_id, edges, pipes):
+        self.node_id = node_id
+        self.edges = edges
+        self.pipes = pipes
+        self.next_fd = NodePlan.FIRST_ARGUMENT_FD
+        self.fd_lines = []
+
+    def pipe_mode(self, edge_id):
+        return "r" if self.edges[edge_id].to_node == self.node_id else "w"
+
+    ## Returns the words that an argument is expanded to
+    def argument_to_words(self, argument):
+        if (isinstance(argument, int)):
+            return [self.edge_to_path(argument)]
+        elif (isinstance(argument, ArgStringType) or isinstance(argument, Arg)):
+            if (isinstance(argument, ArgStringType)):
+                argument = argument.get_name()
+            words = get_argument_words(argument)
+            if (words is None):
+                raise UnsupportedByExecutor(f"node {self.node_id} has an argument that is not literal: {argument}")
+            return words
+        else:
+            raise UnsupportedByExecutor(f"node {self.node_id} has an argument of type {type(argument)}")
+
+    def edge_to_path(self, edge_id):
+        fid = self.edges[edge_id].fid
+        resource = fid.get_resource()
+        if (edge_id in self.pipes):
+            fd = self.next_fd
+            self.next_fd += 1
+            self.fd_lines.append(f"fd {fd} {self.pipes[edge_id]} {self.pipe_mode(edge_id)}")
+            return f"/dev/fd/{fd}"
+        elif (isinstance(resource, FileResource)):
+            words = get_argument_words(resource.uri)
+            if (words is None or len(words) != 1):
+                raise UnsupportedByExecutor(f"node {self.node_id} has a file that is not literal: {resource.uri}")
+            return words[0]
+        elif (isinstance(resource, TemporaryFileResource)):
+            return os.path.join(config.PASH_TMP_PREFIX, fid.get_temporary_file_suffix())
+        else:
+            raise UnsupportedByExecutor(f"node {self.node_id} has an edge with resource {resource}")
+
+    ## Makes an edge the stdin (fd 0) or stdout (fd 1) of the node
+    def redirect(self, edge_id, fd):
+        resource = self.edges[edge_id].fid.get_resource()
+        if (edge_id in self.pipes):
+            self.fd_lines.append(f"fd {fd} {self.pipes[edge_id]} {self.pipe_mode(edge_id)}")
+        elif (isinstance(resource, FileDescriptorResource) and resource.uri == ('fd', fd)):
+            ## The node reads the stdin or writes the stdout of the executor
+            if (fd == 0):
+                self.fd_lines.append("stdin")
+        else:
+            mode = "r" if fd == 0 else "w"
+            self.fd_lines.append(f"open {fd} {mode} {encode_plan_string(self.edge_to_path(edge_id))}")
+
+## Returns the words that the shell would expand an argument to, or None if that depends on
+##   the expansion (e.g., of variables or globs). The argument is parsed from the same text
+##   that the bash backend prints for it, and it might be more than one word
+##   (e.g., the command of an r_wrap is the argument "bash -c", see RWrap).
+def get_argument_words(arg):
+    text = string_of_arg(arg.arg_char_list)
+    words = []
+    word = None
+    quote = None
+    i = 0
+    while i < len(text):
+        char = text[i]
+        if (quote == "'"):
+            if (char == "'"):
+                quote = None
+            else:
+                word.append(char)
+        elif (quote == '"'):
+            if (char == '"'):
+                quote = None
+            elif (char in "$`"):
+                return None
+            elif (char == "\\" and i + 1 < len(text) and text[i + 1] == "\n"):
+                ## A line continuation is removed
+                i += 1
+            elif (char == "\\" and i + 1 < len(text) and text[i + 1] in DOUBLE_QUOTE_ESCAPED_CHARS):
+                i += 1
+                word.append(text[i])
+            else:
+                word.append(char)
+        elif (char in " \t\n"):
+            if (not word is None):
+                words.append("".join(word))
+            word = None
+        elif (char in SHELL_SPECIAL_CHARS):
+            return None
+        elif (char == "\\" and i + 1 < len(text) and text[i + 1] == "\n"):
+            ## A line continuation is removed (and does not end the word)
+            i += 1
+        else:
+            word = [] if word is None else word
+            if (char in "'\""):
+                quote = char
+            elif (char == "\\"):
+                if (i + 1 == len(text)):
+                    return None
+                i += 1
+                word.append(text[i])
+            else:
+                word.append(char)
+        i += 1
+    if (not quote is None):
+        return None
+    if (not word is None):
+        words.append("".join(word))
+    return words
+
+def encode_plan_string(string):
+    return urllib.parse.quote(string, safe=PLAN_SAFE_CHARS)
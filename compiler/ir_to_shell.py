@@ -0,0 +1,229 @@
+import copy
+import os
+from datetime import datetime
+
+from pash_annotations.datatypes.BasicDatatypes import Flag, ArgStringType, Operand
+from pash_annotations.datatypes.BasicDatatypesWithIO import OptionWithIO
+from shasta.ast_node import string_of_arg
+
+import config
+from definitions.ir.arg import Arg
+from definitions.ir.resource import FileDescriptorResource, FileResource, TemporaryFileResource, EphemeralResource
+from ir_to_ast import RM_PASH_FIFOS_NAME, MKFIFO_PASH_FIFOS_NAME, chunk_fids, to_shell
+from util import *
+
+##
+## A direct emitter for the bash backend: it prints the compiled script straight from the graph,
+##   instead of building a shell AST for every node (see ir_to_ast.ir2ast and IR.to_ast),
+##   converting it to typed AST nodes, and pretty-printing it. For wide graphs,
+##   that round trip is most of the backend time.
+##
+## The emitted script is the same text as the one of the AST backend (so that the two
+##   can be compared with --check_shell_emitter), and only the arguments of the nodes
+##   are still printed by shasta (string_of_arg), since they carry the original quoting.
+##
+## The emitter only handles graphs of simple commands (no assignments, and only
+##   flags, options, and operands that are strings or edges), the rest are compiled
+##   by the AST backend.
+##
+
+class UnsupportedByEmitter(Exception):
+    pass
+
+## Returns the compiled script of the graph, or None if the emitter cannot print it
+def to_shell_text(ir, args, remove_fifo_directories=True):
+    if (args.check_shell_emitter):
+        return check_shell_emitter(ir, args, remove_fifo_directories)
+
+    backend_start_time = datetime.now()
+    try:
+        output_script = emit_script(ir, args, remove_fifo_directories)
+    except UnsupportedByEmitter as e:
+        log("The shell emitter cannot print the graph, using the AST backend --", e)
+        return None
+
+    backend_end_time = datetime.now()
+    print_time_delta("Backend", backend_start_time, backend_end_time)
+    return output_script
+
+## Compiles the graph with both backends and fails the compilation if their scripts differ
+##   (so that the tests that run with --assert_compiler_success catch it).
+##   The emitter runs on a copy of the graph, since both backends modify it (e.g., its stdin edge).
+def check_shell_emitter(ir, args, remove_fifo_directories):
+    try:
+        emitted_script = emit_script(copy.deepcopy(ir), args, remove_fifo_directories)
+    except UnsupportedByEmitter as e:
+        log("The shell emitter cannot print the graph --", e)
+        emitted_script = None
+    ast_script = to_shell(ir, args, remove_fifo_directories)
+    if (not emitted_script is None and emitted_script != ast_script):
+        log("The shell emitter printed:\n", emitted_script)
+        log("The AST backend printed:\n", ast_script)
+        raise Exception("The shell emitter and the AST backend produced different scripts!")
+    return ast_script
+
+def emit_script(ir, args, remove_fifo_directories):
+    ## The AST backend does not support draining the streams either (see DFGNode.to_ast)
+    if (args.termination != "clean_up_graph"):
+        raise UnsupportedByEmitter(f"termination {args.termination}")
+
+    ## The body is printed first since it might create additional ephemeral fids (see IR.to_ast)
+    emitter = ShellEmitter(ir)
+    body = emitter.emit_body()
+
+    ephemeral_fids = [fid for fid in ir.all_fids()
+                      if fid.is_ephemeral()]
+    prologue = emit_prologue(ephemeral_fids, remove_fifo_directories)
+    epilogue = emit_epilogue(args.log_file)
+    return "\n".join(prologue + body + epilogue) + "\n"
+
+## Prints the nodes of a graph (as IR.to_ast) and the fids of its edges (as FileId.to_ast)
+class ShellEmitter:
+    def __init__(self, ir):
+        self.ir = ir
+        ## The arguments of the parallel copies of a node are shared, so they are only printed once
+        self.arg_texts = {}
+
+    def emit_body(self):
+        lines = ['pids_to_kill=""']
+
+        ## Redirect stdin to a new ephemeral fid
+        stdin_id = self.ir.get_stdin_id()
+        if (not stdin_id is None):
+            fid = self.ir.get_file_id_gen().next_file_id()
+            fid.make_ephemeral()
+            _prev_fid, from_node, to_node = self.ir.edges[stdin_id]
+            self.ir.set_edge(stdin_id, fid, from_node, to_node)
+            redirect_stdin_script = os.path.join(config.PASH_TOP, config.config['runtime']['redirect_stdin_binary'])
+            lines.append(" ".join(["source", redirect_stdin_script, self.fid_text(fid)]))
+
+        ## The node that is waited for is printed last
+        stdout_edge_id = self.ir.get_stdout_id()
+        if (not stdout_edge_id is None):
+            sink_node_id = self.ir.edges[stdout_edge_id].from_node
+        else:
+            sink_node_id = self.ir.sink_nodes()[0]
+
+        node_ids = [node_id for node_id in self.ir.nodes.keys() if node_id != sink_node_id] + [sink_node_id]
+        for node_id in node_ids:
+            lines.append("{ " + self.node_text(self.ir.get_node(node_id)) + " & }")
+            lines.append('pids_to_kill="${!} ${pids_to_kill}"')
+        return lines
+
+    ## Prints a node as to_node_cmd_inv_with_io_vars
+    def node_text(self, node):
+        if (len(node.com_assignments) > 0):
+            raise UnsupportedByEmitter(f"node {node} has assignments")
+        cmd_inv = node.cmd_invocation_with_io_vars
+        if (not isinstance(cmd_inv.cmd_name, str)):
+            raise UnsupportedByEmitter(f"node {node} has a command name of type {type(cmd_inv.cmd_name)}")
+        words = [cmd_inv.cmd_name]
+        for flag_option in cmd_inv.flag_option_list:
+            if (isinstance(flag_option, Flag)):
+                words.append(flag_option.get_name())
+            elif (isinstance(flag_option, OptionWithIO)):
+                words.append(flag_option.get_name())
+                words.append(self.argument_text(flag_option.get_arg()))
+            else:
+                raise UnsupportedByEmitter(f"node {node} has an unknown option {flag_option}")
+        for operand in cmd_inv.operand_list:
+            if (isinstance(operand, Operand)):
+                operand = operand.get_name()
+            words.append(self.argument_text(operand))
+        text = " ".join(words)
+
+        if (not cmd_inv.implicit_use_of_streaming_input is None):
+            fid = self.ir.edges[cmd_inv.implicit_use_of_streaming_input].fid
+            if (not (fid.has_file_descriptor_resource() and fid.resource.is_stdin())):
+                text += " <" + self.fid_text(fid)
+        if (not cmd_inv.implicit_use_of_streaming_output is None):
+            fid = self.ir.edges[cmd_inv.implicit_use_of_streaming_output].fid
+            if (not (fid.has_file_descriptor_resource() and fid.resource.is_stdout())):
+                text += " >" + self.fid_text(fid)
+        return text
+
+    def argument_text(self, argument):
+        if (isinstance(argument, int)):
+            return self.fid_text(self.ir.edges[argument].fid)
+        elif (isinstance(argument, ArgStringType)):
+            return self.arg_chars_text(argument.get_name().arg_char_list)
+        elif (isinstance(argument, Arg)):
+            return self.arg_chars_text(argument.arg_char_list)
+        else:
+            raise UnsupportedByEmitter(f"argument {argument} of type {type(argument)}")
+
+    def arg_chars_text(self, arg_char_list):
+        key = id(arg_char_list)
+        if (not key in self.arg_texts):
+            self.arg_texts[key] = (arg_char_list, string_of_arg(arg_char_list))
+        return self.arg_texts[key][1]
+
+    def fid_text(self, fid):
+        resource = fid.get_resource()
+        if (isinstance(resource, TemporaryFileResource)):
+            return os.path.join(config.PASH_TMP_PREFIX, fid.get_temporary_file_suffix())
+        elif (isinstance(resource, EphemeralResource)):
+            return quoted_text(os.path.join(config.PASH_TMP_PREFIX, fid.get_fifo_suffix()))
+        elif (isinstance(resource, FileResource)):
+            return self.arg_chars_text(resource.uri.arg_char_list)
+        else:
+            raise UnsupportedByEmitter(f"fid {fid} with resource {resource}")
+
+## A string in double quotes (as a quoted argument of plain characters is printed)
+def quoted_text(string):
+    return '"' + string.replace('"', '\\"') + '"'
+
+## Prints a sequence of commands as make_semi_sequence
+def semi_sequence_text(texts):
+    if (len(texts) == 0):
+        return ":"
+    acc = texts[-1]
+    for text in texts[-2::-1]:
+        acc = "{ " + text + " ; } \n { " + acc + " ; }"
+    return acc
+
+def defun_text(name, body):
+    return name + "() {\n" + body + "\n}"
+
+## Prints the same prologue as ir_to_ast.make_ir_prologue
+def emit_prologue(ephemeral_fids, remove_fifo_directories=True):
+    directories = []
+    for eph_fid in ephemeral_fids:
+        directory = eph_fid.get_directory()
+        if (not directory in directories):
+            directories.append(directory)
+    directory_texts = [quoted_text(directory) for directory in directories]
+
+    chunks = chunk_fids(ephemeral_fids)
+    if (not remove_fifo_directories):
+        rm_texts = [" ".join(["rm", "-f"] + [fifo_path_text(eph_fid) for eph_fid in chunk])
+                    for chunk in chunks]
+    elif (len(directory_texts) > 0):
+        rm_texts = [" ".join(["rm", "-rf"] + directory_texts)]
+    else:
+        rm_texts = []
+
+    mkfifo_texts = []
+    if (len(directory_texts) > 0):
+        mkfifo_texts.append(" ".join(["mkdir", "-p"] + directory_texts))
+    for chunk in chunks:
+        mkfifo_texts.append(" ".join(["mkfifo"] + [fifo_path_text(eph_fid) for eph_fid in chunk]))
+
+    return [defun_text(RM_PASH_FIFOS_NAME, semi_sequence_text(rm_texts)),
+            defun_text(MKFIFO_PASH_FIFOS_NAME, semi_sequence_text(mkfifo_texts)),
+            RM_PASH_FIFOS_NAME,
+            MKFIFO_PASH_FIFOS_NAME]
+
+def fifo_path_text(eph_fid):
+    return quoted_text(os.path.join(config.PASH_TMP_PREFIX, eph_fid.get_fifo_suffix()))
+
+## Prints the same epilogue as ir_to_ast.make_ir_epilogue
+##   (with clean_up_graph termination)
+def emit_epilogue(log_file):
+    clean_up_path_script = os.path.join(config.PASH_TOP, config.config['runtime']['clean_up_graph_binary'])
+    clean_up_line = " ".join(["source", clean_up_path_script, "${!}"])
+    if (not log_file == ""):
+        clean_up_line += " 2>>" + log_file
+    return [clean_up_line,
+            RM_PASH_FIFOS_NAME,
+            '( exit "${internal_exec_status}" )']
@@ -0,0 +1,125 @@
+import os
+import re
+
+from pash_annotations.datatypes.BasicDatatypes import Flag, ArgStringType
+from pash_annotations.datatypes.BasicDatatypesWithIO import OptionWithIO
+from shasta.ast_node import CArgChar, EArgChar, QArgChar
+
+from definitions.ir.arg import Arg
+
+##
+## Decides whether r_wrap can keep one instance of a wrapped command for all of its blocks
+##   (instead of forking it for every block), and how it finds the boundaries of the blocks
+##   in the output of the command (see processCmdPersistent in runtime/r_wrap.c).
+##
+## - Line map (r_wrap -l): every input line produces exactly one output line (e.g., tr, cut).
+## - Line filter (r_wrap -f): the output lines are exactly the input lines for which
+##     a stateless predicate holds (e.g., grep -a).
+##
+## The annotations do not describe the shape of the output of a command, so only the invocations
+##   below are known to have one of these forms. All other commands are forked for every block.
+##
+
+LINE_MAP_FLAG = "-l"
+LINE_FILTER_FLAG = "-f"
+
+## Returns the r_wrap flag for the framing of a command invocation (without its streaming inputs and outputs),
+##   or None if it needs a fork for every block.
+def get_line_framing_flag(cmd_inv):
+    name = os.path.basename(str(cmd_inv.cmd_name))
+    framing_checks = {
+        "tr": is_tr_line_map,
+        "cut": is_cut_line_map,
+        "sed": is_sed_line_map,
+        "grep": is_grep_line_filter,
+    }
+    if not name in framing_checks:
+        return None
+    flags = []
+    options = []
+    for flag_option in cmd_inv.flag_option_list:
+        if isinstance(flag_option, Flag):
+            flags.append(flag_option.get_name())
+        elif isinstance(flag_option, OptionWithIO):
+            options.append((flag_option.get_name(), get_literal_string(flag_option.get_arg())))
+        else:
+            return None
+    operands = [get_literal_string(operand) for operand in cmd_inv.operand_list]
+    ## Operands that are not literal strings are files (or streaming inputs), or unknown
+    if any(operand is None for operand in operands):
+        return None
+    return framing_checks[name](flags, options, operands)
+
+## Returns the string of an argument if it is a literal (after expansion), and None otherwise
+def get_literal_string(arg):
+    if isinstance(arg, ArgStringType):
+        arg = arg.get_name()
+    if not isinstance(arg, Arg):
+        return None
+    return get_literal_string_of_arg_chars(arg.arg_char_list)
+
+def get_literal_string_of_arg_chars(arg_char_list):
+    chars = []
+    for arg_char in arg_char_list:
+        if isinstance(arg_char, CArgChar) or isinstance(arg_char, EArgChar):
+            chars.append(chr(arg_char.char))
+        elif isinstance(arg_char, QArgChar):
+            quoted = get_literal_string_of_arg_chars(arg_char.arg)
+            if quoted is None:
+                return None
+            chars.append(quoted)
+        else:
+            return None
+    return "".join(chars)
+
+## tr maps lines to lines unless a newline can be translated, deleted, or squeezed
+##   (escapes and character classes might include one).
+def is_tr_line_map(flags, options, operands):
+    if len(options) > 0 or not set(flags).issubset({"-d", "-s", "-t"}):
+        return None
+    if any(("\n" in operand or "\\" in operand or "[" in operand) for operand in operands):
+        return None
+    return LINE_MAP_FLAG
+
+## cut outputs one line for every line, unless -s drops the lines without a delimiter
+def is_cut_line_map(flags, options, operands):
+    if len(operands) > 0 or not set(flags).issubset({"-n", "--complement"}):
+        return None
+    for name, value in options:
+        if not name in ["-b", "-c", "-f", "-d"] or value is None or "\n" in value:
+            return None
+    return LINE_MAP_FLAG
+
+## sed maps lines to lines if its script is a single substitution that doesn't add newlines
+SED_SUBSTITUTION_FLAGS = set("gIi0123456789")
+
+def is_sed_line_map(flags, options, operands):
+    if len(options) > 0 or len(operands) != 1 or not set(flags).issubset({"-E", "-r"}):
+        return None
+    script = operands[0]
+    if len(script) < 4 or script[0] != "s" or script[1] in "\\\n":
+        return None
+    ## Split the script on the unescaped delimiters
+    delimiter = script[1]
+    parts = re.split(r'(?<!\\)' + re.escape(delimiter), script[2:])
+    if len(parts) != 3:
+        return None
+    _pattern, replacement, substitution_flags = parts
+    if "\n" in replacement or "\\n" in replacement or not set(substitution_flags).issubset(SED_SUBSTITUTION_FLAGS):
+        return None
+    return LINE_MAP_FLAG
+
+## grep outputs the lines that match, unless it adds to them, counts them, or needs context.
+##   Without -a, grep outputs "Binary file (standard input) matches" instead of the lines of a binary input.
+GREP_LINE_FILTER_FLAGS = {"-E", "-F", "-G", "-P", "-i", "-y", "-v", "-w", "-x", "-s", "-a",
+                          "--no-ignore-case", "--line-buffered"}
+
+def is_grep_line_filter(flags, options, operands):
+    if not set(flags).issubset(GREP_LINE_FILTER_FLAGS) or not "-a" in flags:
+        return None
+    if any(name != "-e" or value is None for name, value in options):
+        return None
+    ## The pattern is either an operand or given with -e
+    if len(operands) + len(options) == 0 or len(operands) > (0 if len(options) > 0 else 1):
+        return None
+    return LINE_FILTER_FLAG
@@ -1,10 +1,19 @@
 #!/bin/bash
 
 vars_file="${1?File not given}"
+## The rest of the arguments (if any) are the variables to save
+shift
 
 pash_redir_output echo "Writing vars to: $vars_file"
 
-declare -p > "$vars_file"
+if [ "$#" -eq 0 ]; then
+    declare -p > "$vars_file"
+else
+    ## Only save the given variables, the ones that hold the special parameters,
+    ##   and PWD (that relative input files are resolved against).
+    ## Unset variables are simply missing from the file.
+    declare -p "$@" PWD pash_input_args pash_previous_exit_status pash_previous_set_status pash_shell_name > "$vars_file" 2>/dev/null
+fi
 ## KK  2021-11-23 We don't actually need to export functions in the vars file. 
 ##                We never expand them in the compiler
 ## declare -f >> "$vars_file"
@@ -144,6 +144,7 @@ export -f pash_redir_all_output_always_execute
 source "$PASH_TOP/compiler/orchestrator_runtime/pash_orch_lib.sh"
 
 
+## The daemon communication functions set $daemon_response
 if [ "$pash_daemon_communicates_through_unix_pipes_flag" -eq 1 ]; then
     pash_communicate_daemon()
     {
@@ -152,7 +153,6 @@ if [ "$pash_daemon_communicates_through_unix_pipes_flag" -eq 1 ]; then
         echo "$message" > "$RUNTIME_IN_FIFO"
         daemon_response=$(cat "$RUNTIME_OUT_FIFO")
         pash_redir_output echo "Got response from daemon: $daemon_response"
-        echo "$daemon_response"
     }
 
     pash_communicate_daemon_just_send()
@@ -170,12 +170,23 @@ else
     pash_communicate_daemon()
     {
         local message=$1
-        pash_communicate_unix_socket "compilation-server" "${DAEMON_SOCKET}" "${message}"
+        if pash_can_use_unix_socket_connection "${DAEMON_SOCKET}"; then
+            pash_communicate_unix_socket_connection "compilation-server" "${message}" "expect_response"
+        else
+            pash_communicate_unix_socket "compilation-server" "${DAEMON_SOCKET}" "${message}"
+        fi
     }
 
+    ## On a persistent connection we do not need to wait for anything,
+    ##   the next request can be sent right away.
     pash_communicate_daemon_just_send()
     {
-        pash_communicate_daemon "$1"
+        local message=$1
+        if pash_can_use_unix_socket_connection "${DAEMON_SOCKET}"; then
+            pash_communicate_unix_socket_connection "compilation-server" "${message}"
+        else
+            pash_communicate_unix_socket "compilation-server" "${DAEMON_SOCKET}" "${message}"
+        fi
     }
 
     pash_wait_until_daemon_listening()
@@ -220,7 +231,7 @@ else
         then
             ## Send and receive from daemon
             msg="Done"
-            daemon_response=$(pash_communicate_daemon "$msg")
+            pash_communicate_daemon "$msg"
             if [ "$distributed_exec" -eq 1 ]; then
                 # kill $worker_manager_pid
                 manager_response=$(pash_communicate_worker_manager "$msg")
@@ -27,6 +27,7 @@ pash_wait_until_unix_socket_listening()
     done
 }
 
+## Sends a message over a new connection and sets $daemon_response
 pash_communicate_unix_socket()
 {
     local server_name=$1
@@ -35,8 +36,64 @@ pash_communicate_unix_socket()
     pash_redir_output echo "Sending msg to ${server_name}: $message"
     daemon_response=$(echo "$message" | nc -U "${socket}")
     pash_redir_output echo "Got response from ${server_name}: $daemon_response"
-    echo "$daemon_response"
+}
+
+## Opens a persistent connection to a unix socket server through an `nc` process
+##   that is owned by the current shell process.
+## The shell talks to `nc` through two fifos. The input fifo is opened for both
+##   reading and writing so that writes to it can never fail with SIGPIPE.
+pash_open_unix_socket_connection()
+{
+    local socket=$1
+    local connection_dir="${PASH_TMP_PREFIX}/connection_${BASHPID}"
+    mkdir -p "$connection_dir"
+    mkfifo "${connection_dir}/in" "${connection_dir}/out"
+    ## The connection must not be waited by the `wait`s of the script
+    nc -U "$socket" <"${connection_dir}/in" >"${connection_dir}/out" 2>/dev/null &
+    disown
+    exec {pash_unix_socket_connection_in}<>"${connection_dir}/in"
+    exec {pash_unix_socket_connection_out}<"${connection_dir}/out"
+    pash_unix_socket_connection_owner=$BASHPID
+}
+
+## Returns success if the current shell process can use the persistent connection,
+##   opening it if it is the first one to need it.
+##
+## Subshells inherit the connection of their parent but they cannot use it
+##   since they might be running concurrently with it.
+pash_can_use_unix_socket_connection()
+{
+    local socket=$1
+    if [ -z "${pash_unix_socket_connection_owner:-}" ]; then
+        pash_open_unix_socket_connection "$socket"
+    fi
+    [ "$pash_unix_socket_connection_owner" = "$BASHPID" ]
+}
+
+## Sends a length-prefixed message on the persistent connection
+##   and, if the third argument is set, waits for a response and sets $daemon_response.
+pash_communicate_unix_socket_connection()
+{
+    local server_name=$1
+    local message=$2
+    local expect_response=${3:-}
+    ## Lengths are in bytes
+    local LC_ALL=C
+    local response_length
+    pash_redir_output echo "Sending msg to ${server_name}: $message"
+    printf '%s\n%s' "${#message}" "$message" >&"${pash_unix_socket_connection_in}"
+    if [ -n "$expect_response" ]; then
+        daemon_response=""
+        if read -r -u "${pash_unix_socket_connection_out}" response_length; then
+            IFS= read -r -N "$response_length" -u "${pash_unix_socket_connection_out}" daemon_response
+        fi
+        daemon_response="${daemon_response%$'\n'}"
+        pash_redir_output echo "Got response from ${server_name}: $daemon_response"
+    fi
 }
 
 export -f pash_wait_until_unix_socket_listening
 export -f pash_communicate_unix_socket
+export -f pash_open_unix_socket_connection
+export -f pash_can_use_unix_socket_connection
+export -f pash_communicate_unix_socket_connection
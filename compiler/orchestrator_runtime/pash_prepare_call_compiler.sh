@@ -18,9 +18,13 @@ tmp="$pash_sequential_script_file"
 unset pash_sequential_script_file
 pash_sequential_script_file="$tmp"
 
+## The variables that the region might expand (computed by the preprocessor)
+IFS=' ' read -r -a pash_region_variables_array <<< "$pash_region_variables"
+unset pash_region_variables
+
 ## Save the shell variables to a file (necessary for expansion)
 export pash_runtime_shell_variables_file="${PASH_TMP_PREFIX}/variables_$RANDOM$RANDOM$RANDOM"
-source "$RUNTIME_DIR/pash_declare_vars.sh" "$pash_runtime_shell_variables_file"
+source "$RUNTIME_DIR/pash_declare_vars.sh" "$pash_runtime_shell_variables_file" "${pash_region_variables_array[@]}"
 pash_redir_output echo "$$: (1) Bash variables saved in: $pash_runtime_shell_variables_file"
 
 ## The parallel script will be saved in the following file if compilation is successful.
@@ -30,8 +34,13 @@ pash_compiled_script_file="${PASH_TMP_PREFIX}/pash_$RANDOM$RANDOM$RANDOM"
 ## TODO: Make a proper client for the daemon
 pash_redir_output echo "$$: (2) Before asking the daemon for compilation..."
 ## Send and receive from daemon
-msg="Compile:${pash_compiled_script_file}| Variable File:${pash_runtime_shell_variables_file}| Input IR File:${pash_input_ir_file}"
-daemon_response=$(pash_communicate_daemon "$msg") # Blocking step, daemon will not send response until it's safe to continue
+## The size of stdin (if it is a regular file) lets the compiler avoid parallelizing small inputs
+pash_stdin_size=""
+if [ -f /dev/stdin ]; then
+    pash_stdin_size=$(stat -L -c %s /dev/stdin)
+fi
+msg="Compile:${pash_compiled_script_file}| Variable File:${pash_runtime_shell_variables_file}| Input IR File:${pash_input_ir_file}| Stdin Size:${pash_stdin_size}"
+pash_communicate_daemon "$msg" # Blocking step, daemon will not send response until it's safe to continue
 
 if [[ "$daemon_response" == *"OK:"* ]]; then
     pash_runtime_return_code=0
@@ -49,6 +58,8 @@ fi
 # shellcheck disable=SC2206
 response_args=($daemon_response)
 process_id=${response_args[1]}
+## The runtime primitives of the region report what they observe in this file (see compiler/region_stats.py)
+export PASH_REGION_STATS="${PASH_TMP_PREFIX}/region_stats_${process_id}"
 
 pash_redir_output echo "$$: (2) Compiler exited with code: $pash_runtime_return_code"
 if [ "$pash_runtime_return_code" -ne 0 ] && [ "$pash_assert_compiler_success_flag" -eq 1 ]; then
@@ -74,6 +85,6 @@ fi
 function inform_daemon_exit () {
     ## Send to daemon
     msg="Exit:${process_id}"
-    daemon_response=$(pash_communicate_daemon_just_send "$msg")
+    pash_communicate_daemon_just_send "$msg"
 } 
 
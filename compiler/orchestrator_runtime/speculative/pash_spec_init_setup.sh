@@ -2,6 +2,7 @@
 
 source "$PASH_TOP/compiler/orchestrator_runtime/pash_orch_lib.sh"
 
+## Sets $daemon_response (see pash_communicate_unix_socket)
 pash_spec_communicate_scheduler()
 {
     local message=$1
@@ -35,7 +36,7 @@ cleanup_server()
     then
         ## Send and receive from daemon
         msg="Done"
-        daemon_response=$(pash_spec_communicate_scheduler "$msg")
+        pash_spec_communicate_scheduler "$msg"
         wait 2> /dev/null 1>&2 
     fi
 }
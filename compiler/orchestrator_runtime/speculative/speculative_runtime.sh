@@ -22,7 +22,7 @@ pash_redir_output echo "$$: Loop node iteration counters: $pash_loop_iter_counte
 
 ## Send and receive from daemon
 msg="Wait:${pash_speculative_command_id}|Loop iters:${pash_loop_iter_counters}"
-daemon_response=$(pash_spec_communicate_scheduler "$msg") # Blocking step, daemon will not send response until it's safe to continue
+pash_spec_communicate_scheduler "$msg" # Sets $daemon_response. Blocking step, daemon will not send response until it's safe to continue
 
 ## Receive an exit code
 if [[ "$daemon_response" == *"OK:"* ]]; then
@@ -1,14 +1,21 @@
 import argparse
+import multiprocessing
+import select
 import signal
 import traceback
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from threading import Thread
 from datetime import datetime, timedelta
 # import queue
 
 import config
 import env_vars_util
+import input_size
 from pash_graphviz import maybe_generate_graphviz
 import pash_compiler
+import region_stats
+from plan_cache import PlanCache, PlanCacheEntry
 from util import *
 from dspash.worker_manager import WorkersManager
 import server_util
@@ -61,6 +68,10 @@ class ProcIdInfo:
         self.compiler_config = compiler_config
         self.exec_time = exec_time
         self.start_exec_time = start_exec_time
+        self.exited = False
+        ## What the runtime observed while running the region (see region_stats.py),
+        ##   only read after the region has exited
+        self.stats = None
         ## TODO: Extend it with other info from scheduler, like dependencies
 
     def set_exec_time(self, exec_time):
@@ -73,7 +84,75 @@ class ProcIdInfo:
         return self.start_exec_time
 
     def __repr__(self):
-        return f'ProcIdInfo(InputIR:{self.input_ir}, CompConfig:{self.compiler_config}, ExecTime:{self.exec_time})'
+        return f'ProcIdInfo(InputIR:{self.input_ir}, CompConfig:{self.compiler_config}, ExecTime:{self.exec_time}, Stats:{self.stats})'
+
+
+##
+## This class holds the state of a compilation request until we respond to it
+##
+class PendingCompilation:
+    def __init__(self, process_id, compiled_script_file, var_file, input_ir_file,
+                 request_processing_start_time, connection):
+        self.process_id = process_id
+        self.compiled_script_file = compiled_script_file
+        self.var_file = var_file
+        self.input_ir_file = input_ir_file
+        self.request_processing_start_time = request_processing_start_time
+        ## The connection that we have to respond to
+        self.connection = connection
+        self.plan_cache_key = None
+        ## The compilation result (a PlanCacheEntry) if it is known
+        self.plan = None
+        ## The future of the compile worker if the region is compiled in the pool
+        self.future = None
+
+    def is_done(self):
+        return not self.plan is None or self.future.done()
+
+    def __repr__(self):
+        return f'PendingCompilation(Id:{self.process_id}, InputIR:{self.input_ir_file}, Done:{self.is_done()})'
+
+
+##
+## The compilation of a single region. This runs either in the daemon
+##   or in one of its compile workers.
+##
+def compile_region(process_id, compiled_script_file, var_file, vars_dict, input_ir_file, compiler_config):
+    config.set_vars_file(var_file, vars_dict)
+
+    daemon_compile_start_time = datetime.now()
+    ast_or_ir = pash_compiler.compile_ir(
+        input_ir_file, compiled_script_file, config.pash_args, compiler_config)
+
+    daemon_compile_end_time = datetime.now()
+    print_time_delta("Daemon Compile", daemon_compile_start_time, daemon_compile_end_time)
+
+    if ast_or_ir is None:
+        return PlanCacheEntry(None, None, None)
+
+    ## The plan can only be reused if the size of its inputs leads to the same width
+    region_inputs = ast_or_ir.region_inputs
+    input_size_width, _reason = input_size.choose_region_width(region_inputs, compiler_config,
+                                                               vars_dict, config.pash_args)
+
+    maybe_generate_graphviz(ast_or_ir, config.pash_args, name=f'dfg-{process_id}')
+
+    ## Keep the compiled script and the resources of the compilation so that
+    ##   they can be reused if the same region is compiled again.
+    proc_input_resources = set(map(lambda out: str(out.resource) if str(
+        out.resource) != "None" else out, ast_or_ir.all_input_fids()))
+    proc_output_resources = set(map(lambda out: str(out.resource) if str(
+        out.resource) != "None" else out, ast_or_ir.all_output_fids()))
+
+    with open(compiled_script_file) as f:
+        script = f.read()
+    return PlanCacheEntry(script, proc_input_resources, proc_output_resources,
+                          region_inputs, input_size_width)
+
+def init_compile_worker():
+    config.LOGGING_PREFIX = "Daemon worker: "
+    ## The daemon handles termination, workers are shut down by it
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
 
 
 class Scheduler:
@@ -109,13 +188,33 @@ class Scheduler:
         self.cmd_buffer = ""
         self.connection_manager = None
         self.reader_pipes_are_blocking = True
-        self.request_processing_start_time = 0
         ## TODO: Make that be a class or something
         
-        ## A map that keeps mappings between proc_id and (input_ir, width, exec_time)
+        ## A map that keeps mappings between proc_id and (input_ir, compiler_config, exec_time, stats).
+        ## The compiler configs keep the widths of previous runs, and the stats the sizes of their piped stdin.
         self.process_id_input_ir_map = {}
         ## This is a map from input IRs, i.e., locations in the code, to a list of process_ids
         self.input_ir_to_process_id_map = {}
+        ## A cache of compiled plans, so that regions that are executed
+        ## many times with the same inputs are not recompiled
+        self.plan_cache = PlanCache(config.pash_args.plan_cache_entries,
+                                    config.pash_args.plan_cache_size)
+        ## Compilation requests that we have not responded to yet (in request order)
+        self.pending_compilations = deque()
+        ## Compile workers (if enabled) that compile regions concurrently.
+        ## We fork them so that they inherit the configuration and the logging setup.
+        self.compile_pool = None
+        if config.pash_args.compilation_workers > 0:
+            self.compile_pool = ProcessPoolExecutor(max_workers=config.pash_args.compilation_workers,
+                                                    mp_context=multiprocessing.get_context("fork"),
+                                                    initializer=init_compile_worker)
+            ## The pool forks all of its workers at its first submit, which has to happen
+            ##   before the daemon starts any threads (e.g., the one of the SocketManager),
+            ##   since a child forked from a multithreaded process can deadlock on locks
+            ##   that the other threads were holding.
+            self.compile_pool.submit(int).result()
+        ## The compile workers notify the main loop through this pipe
+        self.compilation_done_reader, self.compilation_done_writer = os.pipe()
 
     def check_resources_safety(self, process_id):
         proc_input_resources, proc_output_resources = self.process_resources[process_id]
@@ -134,7 +233,7 @@ class Scheduler:
     ##       If that becomes an overhead, we need to consider removing old ones
     ##         or keeping sketches of the information (instead of their raw numbers).
 
-    def determine_compiler_config(self, input_ir_file):
+    def determine_compiler_config(self, input_ir_file, stdin_size):
         if config.pash_args.profile_driven:
             ## A default value
             selected_width = config.pash_args.width
@@ -175,7 +274,46 @@ class Scheduler:
             selected_width = config.pash_args.width
 
         log("Selected width:", selected_width)
-        return pash_compiler.CompilerConfig(selected_width)
+
+        ## The runtime only sends the size of stdin if it is a regular file
+        if stdin_size is None:
+            stdin_size = self.get_observed_stdin_size(input_ir_file)
+            if not stdin_size is None:
+                log("Using the stdin size observed in a previous run:", stdin_size)
+
+        ## Eager nodes only report their peaks when they share a memory budget
+        eager_peaks = None
+        if config.pash_args.eager_memory_budget > 0:
+            eager_peaks = self.get_observed_eager_peaks(input_ir_file)
+        return pash_compiler.CompilerConfig(selected_width, config.pash_args.core_budget, stdin_size, eager_peaks)
+
+    ## Returns the number of bytes read from stdin in the latest run of this region that reported it,
+    ##   i.e., that read stdin with a splitter (see pash_compiler.add_stdin_size_reports)
+    def get_observed_stdin_size(self, input_ir_file):
+        for proc_id in reversed(self.input_ir_to_process_id_map.get(input_ir_file, [])):
+            stats = self.get_region_stats(proc_id)
+            if not stats is None and not stats.stdin_bytes is None:
+                return stats.stdin_bytes
+        return None
+
+    ## Returns the most data that each eager node buffered in the latest run of this region that reported it.
+    ##   The peaks are rounded up to a power of two, so that runs that buffer about
+    ##   the same amount of data lead to the same compiler config (and reuse the same plan).
+    def get_observed_eager_peaks(self, input_ir_file):
+        for proc_id in reversed(self.input_ir_to_process_id_map.get(input_ir_file, [])):
+            stats = self.get_region_stats(proc_id)
+            if not stats is None and len(stats.eager_peaks) > 0:
+                return {edge_id: 1 << max(peak - 1, 0).bit_length()
+                        for edge_id, peak in stats.eager_peaks.items()}
+        return None
+
+    ## Returns what the runtime reported for a process, or None if it hasn't exited yet.
+    ##   The stats file is read once, the first time that they are needed after the process has exited.
+    def get_region_stats(self, process_id):
+        proc_info = self.process_id_input_ir_map[process_id]
+        if proc_info.stats is None and proc_info.exited:
+            proc_info.stats = region_stats.read_region_stats(process_id)
+        return proc_info.stats
 
     def get_averages_per_width(self, input_ir_file):
         ## If we haven't gathered any statistic yet
@@ -234,10 +372,11 @@ class Scheduler:
 
     ##############################################################################
 
-    def compile_and_add(self, compiled_script_file, var_file, input_ir_file):
+    ## Starts the compilation of a region. The compilation is finished
+    ##   (in request order) by finish_compilations.
+    def start_compilation(self, compiled_script_file, var_file, input_ir_file, stdin_size):
+        request_processing_start_time = datetime.now()
         process_id = self.get_next_id()
-        run_parallel = False
-        compile_success = False
 
         variable_reading_start_time = datetime.now()
         # Read any shell variables files if present
@@ -247,29 +386,76 @@ class Scheduler:
         variable_reading_end_time = datetime.now()
         print_time_delta("Variable Loading", variable_reading_start_time, variable_reading_end_time)
 
-        daemon_compile_start_time = datetime.now()
         ## TODO: Make the compiler config based on profiling data
-        compiler_config = self.determine_compiler_config(input_ir_file)
+        compiler_config = self.determine_compiler_config(input_ir_file, stdin_size)
         ## Add the process_id -> input_ir mapping
         self.add_proc_id_map(process_id, input_ir_file, compiler_config)
 
-        ast_or_ir = pash_compiler.compile_ir(
-            input_ir_file, compiled_script_file, config.pash_args, compiler_config)
+        compilation = PendingCompilation(process_id, compiled_script_file, var_file, input_ir_file,
+                                         request_processing_start_time,
+                                         self.connection_manager.detach_last_connection())
+
+        ## The distributed execution backend does not produce a self-contained script
+        ##   so we cannot reuse it.
+        if self.plan_cache.is_enabled() and not config.pash_args.distributed_exec:
+            compilation.plan_cache_key = self.plan_cache.make_key(input_ir_file, compiler_config, vars_dict)
+            compilation.plan = self.plan_cache.lookup(compilation.plan_cache_key, compiler_config,
+                                                      vars_dict, config.pash_args)
+
+        if compilation.plan is None:
+            compile_args = (process_id, compiled_script_file, var_file, vars_dict, input_ir_file, compiler_config)
+            if self.compile_pool is None:
+                compilation.plan = compile_region(*compile_args)
+                self.add_to_plan_cache(compilation)
+            else:
+                compilation.future = self.compile_pool.submit(compile_region, *compile_args)
+                compilation.future.add_done_callback(self.notify_compilation_done)
+        else:
+            if compilation.plan.compile_success():
+                log("Optimized script (cached) saved in:", compiled_script_file)
+                with open(compiled_script_file, "w") as f:
+                    f.write(compilation.plan.script)
+            self.plan_cache.start_process(process_id, compilation.plan_cache_key, compilation.plan)
+
+        self.pending_compilations.append(compilation)
+
+    def add_to_plan_cache(self, compilation):
+        if not compilation.plan_cache_key is None:
+            self.plan_cache.add(compilation.plan_cache_key, compilation.plan)
+            self.plan_cache.start_process(compilation.process_id, compilation.plan_cache_key, compilation.plan)
+
+    ## This is called by the thread that waits for the compile workers
+    def notify_compilation_done(self, future):
+        os.write(self.compilation_done_writer, b'\n')
+
+    ## Finishes all the compilations (in request order) that are done,
+    ##   stopping at the first one that is still being compiled.
+    def finish_compilations(self):
+        while (len(self.pending_compilations) > 0 
+               and self.pending_compilations[0].is_done()):
+            compilation = self.pending_compilations.popleft()
+            self.finish_compilation(compilation)
+
+    def finish_compilation(self, compilation):
+        process_id = compilation.process_id
+        run_parallel = False
+        compile_success = False
 
-        daemon_compile_end_time = datetime.now()
-        print_time_delta("Daemon Compile", daemon_compile_start_time, daemon_compile_end_time)
+        if compilation.plan is None:
+            try:
+                compilation.plan = compilation.future.result()
+            except Exception as e:
+                log("WARNING: Compile worker failed:", e)
+                compilation.plan = PlanCacheEntry(None, None, None)
+            self.add_to_plan_cache(compilation)
+        plan = compilation.plan
 
         self.wait_unsafe()
-        if ast_or_ir != None:
+        if plan.compile_success():
             compile_success = True
 
-            maybe_generate_graphviz(ast_or_ir, config.pash_args, name=f'dfg-{process_id}')
-
-
-            proc_input_resources = set(map(lambda out: str(out.resource) if str(
-                out.resource) != "None" else out, ast_or_ir.all_input_fids()))
-            proc_output_resources = set(map(lambda out: str(out.resource) if str(
-                out.resource) != "None" else out, ast_or_ir.all_output_fids()))
+            proc_input_resources = plan.input_resources
+            proc_output_resources = plan.output_resources
 
             self.process_resources[process_id] = (proc_input_resources, proc_output_resources)
 
@@ -284,7 +470,7 @@ class Scheduler:
             
         if compile_success:
             response = server_util.success_response(
-                f'{process_id} {compiled_script_file} {var_file} {input_ir_file}')
+                f'{process_id} {compilation.compiled_script_file} {compilation.var_file} {compilation.input_ir_file}')
         else:
             response = server_util.error_response(f'{process_id} failed to compile')
             self.unsafe_running = True
@@ -296,13 +482,18 @@ class Scheduler:
         else:
             self.running_procs += 1
 
+        request_processing_end_time = datetime.now()
+        print_time_delta("Request handling", compilation.request_processing_start_time, request_processing_end_time)
+        ## Send output to the specific command
+        self.respond(response, compilation.connection)
+
         ## Get the time before we start executing (roughly) to determine how much time this command execution will take
         command_exec_start_time = datetime.now()
         self.process_id_input_ir_map[process_id].set_start_exec_time(command_exec_start_time)
-        return response
 
     def remove_process(self, process_id):
         log("The following process exited:", process_id)
+        self.plan_cache.remove_process(process_id)
         if process_id in self.process_resources:
             del self.process_resources[process_id]
             # TODO: Should be improved to not rebuild inputs and outputs from scratch maybe use counters
@@ -324,6 +515,11 @@ class Scheduler:
             # must be exit command or something is wrong
             if (input_cmd.startswith("Exit:")):
                 self.handle_exit(input_cmd)
+            elif (input_cmd.startswith("Compile")
+                  and self.connection_manager.supports_concurrent_requests):
+                ## We start compiling the region while waiting,
+                ##   but we only respond to it after we are done waiting.
+                self.start_compilation(*self.__parse_compile_command(input_cmd))
             else:
                 raise Exception(
                     f"Command should be exit but it was {input_cmd}")
@@ -339,6 +535,7 @@ class Scheduler:
         exec_time = (command_finish_exec_time - command_start_exec_time) / timedelta(milliseconds=1)
         log("Process:", process_id, "exited. Exec time was:", exec_time)
         self.handle_time_measurement(process_id, exec_time)
+        self.process_id_input_ir_map[process_id].exited = True
         self.remove_process(process_id)
         ## Necessary so that Exit doesn't block
         self.close_last_connection()
@@ -352,16 +549,11 @@ class Scheduler:
 
     def parse_and_run_cmd(self, input_cmd):
         if(input_cmd.startswith("Compile")):
-            compiled_script_file, var_file, input_ir_file = self.__parse_compile_command(
-                input_cmd)
-            response = self.compile_and_add(compiled_script_file, var_file, input_ir_file)
-            request_processing_end_time = datetime.now()
-            print_time_delta("Request handling", self.request_processing_start_time, request_processing_end_time)
-            ## Send output to the specific command
-            self.respond(response)
+            self.start_compilation(*self.__parse_compile_command(input_cmd))
         elif (input_cmd.startswith("Exit:")):
             self.handle_exit(input_cmd)
         elif (input_cmd.startswith("Done")):
+            self.wait_for_all_compilations()
             self.wait_for_all()
             ## We send output to the top level pash process
             ## to signify that we are done.
@@ -379,9 +571,32 @@ class Scheduler:
     def get_input(self):
         return self.connection_manager.get_next_cmd()
 
-    ## This method responds to the last connection and closes it
-    def respond(self, message):
-        self.connection_manager.respond(message)
+    ## This method finishes pending compilations (in request order)
+    ##   until there is a new request to read.
+    def wait_for_input(self):
+        while True:
+            self.finish_compilations()
+            if len(self.pending_compilations) == 0:
+                return
+
+            if not self.connection_manager.supports_concurrent_requests:
+                ## We cannot read another request before responding to this one
+                self.finish_compilation(self.pending_compilations.popleft())
+                continue
+
+            ready, _, _ = select.select([self.connection_manager, self.compilation_done_reader], [], [])
+            if self.compilation_done_reader in ready:
+                os.read(self.compilation_done_reader, config.SOCKET_BUF_SIZE)
+            if self.connection_manager in ready:
+                return
+
+    def wait_for_all_compilations(self):
+        while len(self.pending_compilations) > 0:
+            self.finish_compilation(self.pending_compilations.popleft())
+
+    ## This method responds to the given connection (or the last connection) and closes it
+    def respond(self, message, connection=None):
+        self.connection_manager.respond(message, connection)
 
     ## This method closes the last connection that we got input from
     def close_last_connection(self):
@@ -393,7 +608,10 @@ class Scheduler:
             compiled_script_file = components[0].split(":")[1]
             var_file = components[1].split(":")[1]
             input_ir_file = components[2].split(":")[1]
-            return compiled_script_file, var_file, input_ir_file
+            ## The size of stdin is only sent if it is a regular file
+            stdin_size = components[3].split(":")[1].strip()
+            stdin_size = int(stdin_size) if stdin_size != "" else None
+            return compiled_script_file, var_file, input_ir_file, stdin_size
         except:
             raise Exception(f'Parsing failure for line: {input}')
 
@@ -407,20 +625,26 @@ class Scheduler:
             self.connection_manager = server_util.SocketManager(os.getenv('DAEMON_SOCKET'))
         while not self.done:
             # Process a single request
+            self.wait_for_input()
             input_cmd = self.get_input()
-            self.request_processing_start_time = datetime.now()
 
             ## Parse the command (potentially also sending a response)
             self.parse_and_run_cmd(input_cmd)
         
         self.connection_manager.close()
+        if not self.compile_pool is None:
+            self.compile_pool.shutdown()
         shutdown()
 
 
 
+scheduler = None
+
 def shutdown():
     ## There may be races since this is called through the signal handling
     log("PaSh daemon is shutting down...")
+    if not scheduler is None:
+        scheduler.plan_cache.log_counters("statistics")
     log("PaSh daemon shut down successfully...")
 
 def main():
@@ -428,10 +652,15 @@ def main():
     if args.distributed_exec:
         worker_manager = WorkersManager()
         config.worker_manager = worker_manager
+
+    ## The scheduler starts the compile workers, so it is created before any thread is started
+    global scheduler
+    scheduler = Scheduler()
+
+    if args.distributed_exec:
         worker_manager_thread = Thread(target=worker_manager.run)
         worker_manager_thread.start()
 
-    scheduler = Scheduler()
     scheduler.run()
    
 
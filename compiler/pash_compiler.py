@@ -7,7 +7,13 @@ from datetime import datetime
 from pash_annotations.annotation_generation.datatypes.parallelizability.AggregatorKind import AggregatorKindEnum
 
 import config
+import cost_model
 import env_vars_util
+import input_consumption
+import input_size
+import ir_to_executor
+import ir_to_shell
+import line_framing
 from ir import *
 from ast_to_ir import compile_asts
 from ir_to_ast import to_shell
@@ -59,7 +65,7 @@ def main_body():
     log("Input:", args.input_ir, "Compiled file:", args.compiled_script_file)
 
     ## Call the main procedure
-    compiler_config = CompilerConfig(args.width)
+    compiler_config = CompilerConfig(args.width, args.core_budget)
     ast_or_ir = compile_optimize_output_script(args.input_ir, args.compiled_script_file, args, compiler_config)
     maybe_generate_graphviz(ast_or_ir, args)
 
@@ -79,11 +85,17 @@ def parse_args():
 
 ## TODO: Add more fields from args in this
 class CompilerConfig:
-    def __init__(self, width):
+    def __init__(self, width, core_budget=0, stdin_size=None, eager_peaks=None):
         self.width = width
+        self.core_budget = core_budget
+        ## The size of the stdin of the region (if known), see input_size.py
+        self.stdin_size = stdin_size
+        ## The most data that each eager node buffered in a previous run of the region,
+        ##   by the id of its input edge (see get_eager_buffer_sizes)
+        self.eager_peaks = eager_peaks
     
     def __repr__(self):
-        return f'CompilerConfig(Width:{self.width})'
+        return f'CompilerConfig(Width:{self.width}, Core budget:{self.core_budget}, Stdin size:{self.stdin_size}, Eager peaks:{self.eager_peaks})'
 
 def compile_ir(ir_filename, compiled_script_file, args, compiler_config):
     """
@@ -127,7 +139,12 @@ def compile_optimize_output_script(ir_filename, compiled_script_file, args, comp
                 obj = (optimized_ast_or_ir, config.config['shell_variables'])
                 pickle.dump(obj, f)
         else:
-            script_to_execute = to_shell(optimized_ast_or_ir, args)
+            script_to_execute = None
+            if args.executor == "native":
+                script_to_execute = ir_to_executor.to_executor_script(optimized_ast_or_ir, args,
+                                                                      lambda: to_bash_script(optimized_ast_or_ir, args))
+            if script_to_execute is None:
+                script_to_execute = to_bash_script(optimized_ast_or_ir, args)
             
         log("Optimized script saved in:", compiled_script_file)
         with open(compiled_script_file, "w") as f:
@@ -139,6 +156,13 @@ def compile_optimize_output_script(ir_filename, compiled_script_file, args, comp
     
     return ret
 
+## The shell emitter prints the graph, unless it cannot (then the AST backend does)
+def to_bash_script(ir, args):
+    script = ir_to_shell.to_shell_text(ir, args)
+    if script is None:
+        script = to_shell(ir, args)
+    return script
+
 def load_df_region(ir_filename):
     log("Retrieving candidate DF region: {} ... ".format(ir_filename), end='')
     with open(ir_filename, "rb") as ir_file:
@@ -211,21 +235,33 @@ def optimize_irs(asts_and_irs, args, compiler_config):
             ## Assert that the graph that was returned from compilation is valid
             assert(ast_or_ir.valid())
 
+            ## Small inputs are not worth (widely) parallelizing
+            region_inputs = input_size.get_region_inputs(ast_or_ir)
+            width, reason = input_size.choose_region_width(region_inputs, compiler_config,
+                                                           config.config['shell_variables'], args)
+            log("Input size decision -- width:", width, "out of:", compiler_config.width, "reason:", reason)
+
             # log(ir_node)
             # with cProfile.Profile() as pr:
-            distributed_graph = choose_and_apply_parallelizing_transformations(ast_or_ir, compiler_config.width,
+            distributed_graph = choose_and_apply_parallelizing_transformations(ast_or_ir, width,
+                                                                      compiler_config.core_budget,
                                                                       runtime_config['batch_size'],
-                                                                      args.r_split_batch_size)
+                                                                      args.r_split_batch_size,
+                                                                      args.r_split_min_batch_size)
             # pr.print_stats()
 
+            add_stdin_size_reports(distributed_graph)
+
             # Eagers are added in remote notes when using distributed exec
             if(not args.no_eager and not args.distributed_exec): 
-                eager_distributed_graph = add_eager_nodes(distributed_graph)
+                eager_distributed_graph = add_eager_nodes(distributed_graph, args.eager_memory_budget,
+                                                          compiler_config.eager_peaks)
             else:
                 eager_distributed_graph = distributed_graph
 
             ## Assert that the graph stayed valid after all transformations
             assert(eager_distributed_graph.valid())
+            eager_distributed_graph.region_inputs = region_inputs
 
             ## Print statistics of output nodes
             print_graph_statistics(eager_distributed_graph)
@@ -248,54 +284,166 @@ def print_graph_statistics(graph):
     log("Eager nodes:", len(eager_nodes))
 
 
-def choose_and_apply_parallelizing_transformations(graph, fan_out, batch_size, r_split_batch_size):
-    parallelizer_map = choose_parallelizing_transformations(graph)
-    apply_parallelizing_transformations(graph, parallelizer_map, fan_out, batch_size, 
-                                        r_split_batch_size)
+def choose_and_apply_parallelizing_transformations(graph, max_width, core_budget, batch_size, r_split_batch_size,
+                                                   r_split_min_batch_size):
+    parallelizer_map = choose_parallelizing_transformations(graph, max_width, core_budget)
+    apply_parallelizing_transformations(graph, parallelizer_map, batch_size,
+                                        r_split_batch_size, r_split_min_batch_size)
     return graph
 
 
-def choose_parallelizing_transformations(graph): # shall return map
-    source_node_ids = graph.source_nodes()
-    parallelizer_map = {}
-    workset = source_node_ids
-    visited = set()
-    # We apply a modified BFS such that we ensure that we know which parallelizer was chosen for all previous nodes
-    # and assume that the decision for any subsequent node will exploit any potential synergy effects
-    while (len(workset) > 0):
-        curr_id = workset.pop(0)
+## Chooses a parallelizer and a width (or None to keep it sequential) for each node
+##   so that the estimated cost (see cost_model.py) of the whole graph is the lowest,
+##   and the total width of all nodes does not exceed the core budget (if there is one).
+##
+## The budget is enforced by charging a price for each core that a node uses,
+##   and finding the lowest price for which the best plan fits in the budget.
+##   Since a higher price can only lead to fewer cores, the price is found with bisection.
+def choose_parallelizing_transformations(graph, max_width, core_budget): # shall return map
+    node_choices = {node_id: get_parallelizing_transformation_choices(node_id, graph, max_width)
+                    for node_id in graph.topological_order()}
+    node_works = {node_id: cost_model.node_work(graph.get_node(node_id))
+                  for node_id in node_choices}
+    node_file_inputs = {node_id: graph.node_reads_file_input(node_id)
+                        for node_id in node_choices}
+    node_persistent_wraps = {node_id: line_framing.get_line_framing_flag(graph.get_node(node_id).cmd_invocation_with_io_vars) is not None
+                             for node_id in node_choices}
+
+    core_price = 0.0
+    plan = plan_parallelizing_transformations(graph, node_choices, node_works, node_file_inputs, node_persistent_wraps, core_price)
+    if core_budget > 0 and get_plan_cores(plan) > core_budget:
+        ## At this price no node gains anything from using more than one core
+        low_price = 0.0
+        high_price = max(node_works.values()) * cost_model.SEQUENTIAL_COST
+        plan = plan_parallelizing_transformations(graph, node_choices, node_works, node_file_inputs, node_persistent_wraps, high_price)
+        core_price = high_price
+        for _ in range(CORE_PRICE_BISECTION_STEPS):
+            mid_price = (low_price + high_price) / 2
+            mid_plan = plan_parallelizing_transformations(graph, node_choices, node_works, node_file_inputs, node_persistent_wraps, mid_price)
+            if get_plan_cores(mid_plan) > core_budget:
+                low_price = mid_price
+            else:
+                high_price = mid_price
+                plan = mid_plan
+                core_price = mid_price
+
+    for node_id, (choice, width, cost) in plan.items():
+        log("Parallelization plan -- node:", node_id, graph.get_node(node_id).get_dot_label(),
+            "choice:", describe_parallelizer(choice), "width:", width, "chain cost:", round(cost, 3))
+    log("Parallelization plan -- total width:", get_plan_cores(plan), "core budget:", core_budget,
+        "core price:", round(core_price, 4))
+
+    ## The transformations are applied in topological order (to fuse with the previous ones)
+    return {node_id: (choice, width) for node_id, (choice, width, _cost) in plan.items()}
+
+CORE_PRICE_BISECTION_STEPS = 20
+
+def get_plan_cores(plan):
+    return sum(width for (_choice, width, _cost) in plan.values())
+
+## Returns the best (choice, width, chain cost) for each node, when each core costs core_price.
+##
+## The cost of a node only depends on the choice for its previous node (because of fusion),
+##   and a node can only fuse with its previous node if it is the only next node of it.
+##   Therefore, these nodes form chains, and we find the best choices for each chain
+##   with dynamic programming over the topological order.
+def plan_parallelizing_transformations(graph, node_choices, node_works, node_file_inputs, node_persistent_wraps, core_price):
+    ## For each node, a list of (choice, width, cost, index of the choice of the fusable previous node),
+    ##   where cost is the lowest cost of the chain up to this node with this choice.
+    node_plans = {}
+    fusable_prev_ids = {}
+    for curr_id, choices in node_choices.items():
         assert(isinstance(curr_id, int))
-        all_previous_nodes_visited = all(prev in visited for prev in graph.get_previous_nodes(curr_id))
-        if not all_previous_nodes_visited:
-            workset.append(curr_id)
-        elif not curr_id in visited:
-            next_node_ids = graph.get_next_nodes(curr_id)
-            workset += next_node_ids
-            parallelizer_map[curr_id] = choose_parallelizing_transformation(curr_id, graph)
-            visited.add(curr_id)
-    return parallelizer_map
-
-
-## This currently chooses the best parallelization based on priority:
+        prev_id = get_fusable_previous_node(curr_id, graph)
+        fusable_prev_ids[curr_id] = prev_id
+        node_plans[curr_id] = []
+        work = node_works[curr_id]
+        file_input = node_file_inputs[curr_id]
+        persistent_wrap = node_persistent_wraps[curr_id]
+        for choice, width in choices:
+            own_cost = core_price * width
+            if prev_id is None:
+                best_cost = own_cost + cost_model.parallelization_cost(work, choice, width, None, 1,
+                                                                       file_input, persistent_wrap)
+                best_prev_index = None
+            else:
+                best_cost = None
+                for prev_index, (prev_choice, prev_width, prev_cost, _) in enumerate(node_plans[prev_id]):
+                    cost = (prev_cost + own_cost
+                            + cost_model.parallelization_cost(work, choice, width, prev_choice, prev_width,
+                                                              file_input, persistent_wrap))
+                    if best_cost is None or cost < best_cost:
+                        best_cost = cost
+                        best_prev_index = prev_index
+            node_plans[curr_id].append((choice, width, best_cost, best_prev_index))
+
+    ## Pick the best choice for the last node of each chain and follow the chain backwards
+    plan = {}
+    chain_ends = set(node_plans.keys()).difference(fusable_prev_ids.values())
+    for end_id in chain_ends:
+        curr_id = end_id
+        ## The first choice with the lowest cost is picked (choices are in priority order)
+        curr_index = min(range(len(node_plans[curr_id])), key=lambda index: node_plans[curr_id][index][2])
+        while not curr_id is None:
+            choice, width, cost, prev_index = node_plans[curr_id][curr_index]
+            plan[curr_id] = (choice, width, cost)
+            curr_id = fusable_prev_ids[curr_id]
+            curr_index = prev_index
+
+    return {node_id: plan[node_id] for node_id in node_plans}
+
+## Returns the previous node of a node if their parallelizations could be fused
+def get_fusable_previous_node(node_id, graph):
+    prev_ids = graph.get_previous_nodes(node_id)
+    if len(prev_ids) == 1 and len(graph.get_next_nodes(prev_ids[0])) == 1:
+        return prev_ids[0]
+    return None
+
+
+## Returns the implemented parallelizers of a node in priority order:
 ## 1. The round robin
 ## 2. The round robin after having performed unwrap (not sure why this is the second priority)
 ## 3. The consecutive chunks
-## 
-## TODO: In the future, we could develop more complex strategies      
-def choose_parallelizing_transformation(curr_id, graph): # shall return map entry
+##
+## each with all candidate widths (widest first), followed by None, i.e., not parallelizing the node.
+def get_parallelizing_transformation_choices(curr_id, graph, max_width):
     curr = graph.get_node(curr_id)
     list_all_parallelizers_in_priority = [curr.get_option_implemented_round_robin_parallelizer(),
                                           curr.get_option_implemented_round_robin_with_unwrap_parallelizer(),
                                           curr.get_option_implemented_consecutive_chunks_parallelizer()]
-    return next((item for item in list_all_parallelizers_in_priority if item is not None), None)
+    widths = get_candidate_widths(max_width)
+    return ([(item, width) for item in list_all_parallelizers_in_priority if item is not None
+                           for width in widths]
+            + [(None, 1)])
+
+## The widths that a node can be parallelized with: the maximum width and all powers of two below it
+def get_candidate_widths(max_width):
+    widths = [max_width] if max_width > 1 else []
+    width = 2
+    while width < max_width:
+        widths.append(width)
+        width *= 2
+    return sorted(widths, reverse=True)
+
+def describe_parallelizer(parallelizer):
+    if parallelizer is None:
+        return "sequential"
+    splitter = parallelizer.get_splitter()
+    if splitter.is_splitter_round_robin():
+        return "round robin"
+    elif splitter.is_splitter_round_robin_with_unwrap_flag():
+        return "round robin with unwrap"
+    else:
+        return "consecutive chunks"
 
 
-def apply_parallelizing_transformations(graph, parallelizer_map, fan_out, batch_size, r_split_batch_size):
+def apply_parallelizing_transformations(graph, parallelizer_map, batch_size, r_split_batch_size, r_split_min_batch_size):
     fileIdGen = graph.get_file_id_gen()
-    node_id_non_none_parallelizer_list = [(node_id, parallelizer) for (node_id, parallelizer) in parallelizer_map.items()
-                                                                  if parallelizer is not None]
-    for (node_id, parallelizer) in node_id_non_none_parallelizer_list:
-        graph.apply_parallelization_to_node(node_id, parallelizer, fileIdGen, fan_out, r_split_batch_size)
+    node_id_non_none_parallelizer_list = [(node_id, parallelizer, width) for (node_id, (parallelizer, width)) in parallelizer_map.items()
+                                                                         if parallelizer is not None]
+    for (node_id, parallelizer, width) in node_id_non_none_parallelizer_list:
+        graph.apply_parallelization_to_node(node_id, parallelizer, fileIdGen, width, r_split_batch_size,
+                                            r_split_min_batch_size)
 
 def split_hdfs_cat_input(hdfs_cat, next_node, graph, fileIdGen):
     """
@@ -342,19 +490,38 @@ def split_hdfs_cat_input(hdfs_cat, next_node, graph, fileIdGen):
 
 
 
+## The splitter that reads the stdin of the region reports how many bytes it read,
+##   so that the next compilation of the region knows the size of a piped stdin (see input_size.py)
+def add_stdin_size_reports(graph):
+    for node_id, node in graph.nodes.items():
+        if isinstance(node, (r_split.RSplit, Split)):
+            for fid in graph.get_node_input_fids(node_id):
+                if fid.has_file_descriptor_resource() and fid.get_resource().is_stdin():
+                    node.add_s_flag()
+
 ## This functions adds an eager on a given edge.
-def add_eager(eager_input_id, graph, fileIdGen):
+##
+## An eager with a buffer size out of a memory budget is the eager of the runtime (instead of dgsh-tee),
+##   so that it reports the most data that it buffered, with the id of the edge as its label.
+def add_eager(eager_input_id, graph, fileIdGen, buffer_size=None):
     new_fid = fileIdGen.next_ephemeral_file_id()
     new_id = new_fid.get_ident()
 
-    ## TODO: seperate to better use dgsh-tee params and maybe deprecate eager
-    eager_node = dgsh_tee.make_dgsh_tee_node(eager_input_id, new_id)
+    if buffer_size is None:
+        eager_node = dgsh_tee.make_dgsh_tee_node(eager_input_id, new_id)
+    else:
+        ## The spill file goes in the fifo directory, that is removed when the region exits
+        intermediate_file = os.path.join(new_fid.get_directory(),
+                                         f"{runtime_config['eager_intermediate_prefix']}{new_id}")
+        eager_exec_path = os.path.join(config.PASH_TOP, runtime_config['eager_executable_path'])
+        eager_node = make_eager_node(eager_input_id, new_id, intermediate_file, eager_exec_path,
+                                     buffer_size, label=eager_input_id)
 
     ## Add the edges and the nodes to the graph
     graph.add_edge(new_fid)
 
     ## Modify the next node inputs to be the new inputs
-    next_node_id = graph.edges[eager_input_id][2]
+    next_node_id = graph.edges[eager_input_id].to_node
     if(not next_node_id is None):
         next_node = graph.get_node(next_node_id)
         next_node.replace_edge(eager_input_id, new_id)
@@ -362,17 +529,70 @@ def add_eager(eager_input_id, graph, fileIdGen):
 
     graph.add_node(eager_node)
 
+## The smallest buffer that an eager gets out of a memory budget
+MIN_EAGER_BUFFER_SIZE = 64 * 1024
+
+## Splits the memory budget for eager nodes in proportion to their weights.
+##   Without a budget, all eager nodes get the configured buffer size (None).
+##
+## If a previous run of the region reported how much data each of its eager nodes buffered
+##   (and it had the same eager nodes), the weights are those peaks instead of the estimated ones.
+##
+## The nodes whose share is below MIN_EAGER_BUFFER_SIZE get that instead,
+##   and the rest of the budget is split again across the other nodes.
+def get_eager_buffer_sizes(eager_edge_weights, eager_memory_budget, eager_peaks=None):
+    if eager_memory_budget <= 0 or len(eager_edge_weights) == 0:
+        return {edge_id: None for edge_id in eager_edge_weights}
+    if (not eager_peaks is None
+        and set(eager_peaks.keys()) == set(eager_edge_weights.keys())
+        and sum(eager_peaks.values()) > 0):
+        log("Using the eager peaks of a previous run as weights:", dict(sorted(eager_peaks.items())))
+        eager_edge_weights = eager_peaks
+
+    buffer_sizes = {}
+    remaining_weights = dict(eager_edge_weights)
+    remaining_budget = eager_memory_budget
+    while len(remaining_weights) > 0:
+        total_weight = sum(remaining_weights.values())
+        below_minimum = [edge_id for edge_id, weight in remaining_weights.items()
+                         if total_weight == 0 or remaining_budget * weight / total_weight < MIN_EAGER_BUFFER_SIZE]
+        if len(below_minimum) == 0:
+            for edge_id, weight in remaining_weights.items():
+                buffer_sizes[edge_id] = int(remaining_budget * weight / total_weight)
+            break
+        for edge_id in below_minimum:
+            buffer_sizes[edge_id] = MIN_EAGER_BUFFER_SIZE
+            remaining_budget -= MIN_EAGER_BUFFER_SIZE
+            del remaining_weights[edge_id]
+
+    if sum(buffer_sizes.values()) > eager_memory_budget:
+        log("WARNING: The eager memory budget:", eager_memory_budget, "is below the minimum buffer size",
+            MIN_EAGER_BUFFER_SIZE, "for each of the", len(buffer_sizes), "eager nodes")
+    log("Eager buffer sizes -- budget:", eager_memory_budget, "sizes:", dict(sorted(buffer_sizes.items())))
+    return buffer_sizes
 
 ## This function adds eager nodes wherever the width of graph is
 ## becoming smaller.
-def add_eager_nodes(graph):
+##
+## If there is a memory budget, it is split across the eager nodes by their weights,
+##   i.e., by the share of the data that goes through their edge and
+##   by how their consumer reads its inputs (see input_consumption),
+##   or by how much they buffered in a previous run (see get_eager_buffer_sizes).
+def add_eager_nodes(graph, eager_memory_budget=0, eager_peaks=None):
     source_node_ids = graph.source_nodes()
 
     ## Generate a fileIdGen that doesnt clash with graph fids.
     fileIdGen = graph.get_file_id_gen()
 
-    ## Get the next nodes
-    workset = [node for source_node_id in source_node_ids for node in graph.get_next_nodes(source_node_id)]
+    ## The edges that need an eager, and their weight for the memory budget.
+    ##   The eager nodes are only added after the traversal, when all of them are known.
+    edge_data_shares = graph.estimate_edge_data_shares()
+    eager_edge_weights = {}
+    def add_eager_edge(edge_id, weight):
+        eager_edge_weights[edge_id] = max(eager_edge_weights.get(edge_id, 0), weight * edge_data_shares[edge_id])
+
+    ## Start from the source nodes (e.g., an r_split that reads the input of the region)
+    workset = list(source_node_ids)
     visited = set()
     while (len(workset) > 0):
         curr_id = workset.pop(0)
@@ -382,38 +602,35 @@ def add_eager_nodes(graph):
             next_node_ids = graph.get_next_nodes(curr_id)
             workset += next_node_ids
 
-            ## TODO: Make sure that we don't add duplicate eager nodes
-
-            ## Add eager nodes if the node has more than one input
+            ## Add eager nodes if the node has more than one input,
+            ##   only on the inputs that might stall because of the order
+            ##   that the node consumes them (see input_consumption)
             curr_input_ids = graph.get_node_input_ids(curr_id)
             if (len(curr_input_ids) > 1):
-                ## TODO: If we know that a command reads its inputs in a list,
-                ##       then we might not need to put an eager on its first input.
-                ## Note: This cannot be done for `sort -m` so we need to know in the
-                ##       annotations whether input consumption is in order or not.
-
-                for curr_input_id in curr_input_ids:
+                for curr_input_id in input_consumption.get_inputs_needing_eager(curr, curr_input_ids):
                     _fid, from_node, to_node = graph.edges[curr_input_id]
                     assert(to_node == curr_id)
                     ## If the edge is an input edge, then we don't want to put eager.
                     if(not from_node is None):
-                        add_eager(curr_input_id, graph, fileIdGen)
+                        add_eager_edge(curr_input_id, input_consumption.get_eager_buffer_weight(curr))
 
-            if(isinstance(curr, Split)):
-                eager_input_ids = curr.get_output_list()[:-1]
-                for edge_id in eager_input_ids:
-                    add_eager(edge_id, graph, fileIdGen)
+            ## The consecutive chunks splitter doesn't block on any of its outputs,
+            ##   so there is no eager after it (see make_split_file)
 
-            ## Add an eager after r_unwrap            
+            ## Add an eager after r_unwrap
             if(isinstance(curr, r_unwrap.RUnwrap)):
                 eager_input_id = curr.get_output_list()[0]
-                add_eager(eager_input_id, graph, fileIdGen)
+                add_eager_edge(eager_input_id, 1)
 
-            ## Add an eager after r_split
+            ## r_split buffers its outputs itself (instead of an eager after each of them)
             if(isinstance(curr, r_split.RSplit)):
-                eager_input_ids = curr.get_output_list()
-                for edge_id in eager_input_ids:
-                    add_eager(edge_id, graph, fileIdGen)
+                curr.add_e_flag()
+
+    ## An edge gets a single eager, even if it needs one for more than one reason
+    ##   (e.g., after r_unwrap and in front of a node with many inputs)
+    eager_buffer_sizes = get_eager_buffer_sizes(eager_edge_weights, eager_memory_budget, eager_peaks)
+    for eager_input_id, buffer_size in eager_buffer_sizes.items():
+        add_eager(eager_input_id, graph, fileIdGen, buffer_size)
 
     return graph
 
@@ -107,6 +107,8 @@ else
         trap inform_daemon_exit SIGTERM SIGINT EXIT
         export SCRIPT_TO_EXECUTE="$pash_script_to_execute"
         source "$RUNTIME_DIR/pash_restore_state_and_execute.sh"
+        ## The daemon must only be informed once for each process id
+        trap - SIGTERM SIGINT EXIT
         inform_daemon_exit
     }
 
@@ -0,0 +1,146 @@
+import hashlib
+import pickle
+from collections import OrderedDict
+
+import input_size
+from shell_ast.ast_util import find_referenced_variables
+from util import *
+
+##
+## A cache of compiled plans that the daemon keeps across compilation requests.
+##
+## The same region (e.g., a pipeline in the body of a loop) is usually compiled
+## again and again with the same inputs. Since the compiled script only depends on
+## the region, the selected width and core budget, the eager peaks of its previous run,
+## and the values of the variables that the region expands,
+## we can reuse it instead of going through the whole compiler.
+##
+## The width of a compiled region also depends on the size of its inputs (see input_size.py),
+## so an entry is only reused if its inputs would still lead to the same width.
+##
+
+class PlanCacheEntry:
+    def __init__(self, script, input_resources, output_resources, region_inputs=None, input_size_width=None):
+        ## The compiled script (None if the region failed to compile)
+        self.script = script
+        self.input_resources = input_resources
+        self.output_resources = output_resources
+        ## The inputs of the region and the width that their size led to
+        self.region_inputs = region_inputs
+        self.input_size_width = input_size_width
+        ## The process ids that are currently executing this script.
+        ## The fifos of the compiled script are fixed, so we cannot
+        ## have the same script running twice at the same time.
+        self.running_process_ids = set()
+
+    def compile_success(self):
+        return not self.script is None
+
+    def size(self):
+        if self.script is None:
+            return 0
+        return len(self.script)
+
+    def is_running(self):
+        return len(self.running_process_ids) > 0
+
+    def matches_input_size(self, compiler_config, vars_dict, args):
+        if not self.compile_success():
+            return True
+        width, _reason = input_size.choose_region_width(self.region_inputs, compiler_config, vars_dict, args)
+        return width == self.input_size_width
+
+    def __repr__(self):
+        return f'PlanCacheEntry(Success:{self.compile_success()}, Size:{self.size()}, Running:{self.running_process_ids})'
+
+
+class PlanCache:
+    def __init__(self, max_entries, max_size):
+        self.max_entries = max_entries
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.total_size = 0
+        self.hits = 0
+        self.misses = 0
+        ## A map from input IR files to (digest, referenced variable names).
+        ## The input IR files are written once by the preprocessor and never change.
+        self.input_ir_info = {}
+        ## A map from process ids to the key of the entry that they are executing
+        self.process_id_keys = {}
+
+    def is_enabled(self):
+        return self.max_entries > 0 and self.max_size > 0
+
+    ## Returns the key of a compilation request
+    def make_key(self, input_ir_file, compiler_config, vars_dict):
+        digest, variable_names = self.get_input_ir_info(input_ir_file)
+        variable_values = tuple((name, repr(vars_dict.get(name))) for name in variable_names)
+        eager_peaks = None
+        if not compiler_config.eager_peaks is None:
+            eager_peaks = tuple(sorted(compiler_config.eager_peaks.items()))
+        return (digest, compiler_config.width, compiler_config.core_budget, eager_peaks, variable_values)
+
+    def get_input_ir_info(self, input_ir_file):
+        if not input_ir_file in self.input_ir_info:
+            with open(input_ir_file, "rb") as f:
+                ir_bytes = f.read()
+            digest = hashlib.sha1(ir_bytes).hexdigest()
+            variable_names = sorted(find_referenced_variables(pickle.loads(ir_bytes)))
+            self.input_ir_info[input_ir_file] = (digest, variable_names)
+        return self.input_ir_info[input_ir_file]
+
+    ## Returns the entry for this key if it can be used by a new process
+    def lookup(self, key, compiler_config, vars_dict, args):
+        entry = self.entries.get(key)
+        if (not entry is None
+            and not entry.is_running()
+            and not entry.matches_input_size(compiler_config, vars_dict, args)):
+            ## The inputs changed size, so the entry is replaced by the new compilation
+            log("Plan cache entry is stale since the size of its inputs changed")
+            self.remove(key)
+            entry = None
+        if entry is None or entry.is_running():
+            self.misses += 1
+            self.log_counters("miss")
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        self.log_counters("hit")
+        return entry
+
+    def add(self, key, entry):
+        if key in self.entries or entry.size() > self.max_size:
+            return
+        self.entries[key] = entry
+        self.total_size += entry.size()
+        self.evict()
+
+    def remove(self, key):
+        entry = self.entries.pop(key)
+        self.total_size -= entry.size()
+
+    def evict(self):
+        while (len(self.entries) > self.max_entries
+               or self.total_size > self.max_size):
+            evicted_key, evicted_entry = self.entries.popitem(last=False)
+            self.total_size -= evicted_entry.size()
+            ## If the evicted entry is still running we have to forget its process ids
+            for process_id in evicted_entry.running_process_ids:
+                del self.process_id_keys[process_id]
+
+    ## Marks that a process is going to execute the script of this entry.
+    ## The entry might not be in the cache (e.g., if it was too big, or if
+    ##   the same region was concurrently compiled by another request).
+    def start_process(self, process_id, key, entry):
+        if entry.compile_success() and self.entries.get(key) is entry:
+            entry.running_process_ids.add(process_id)
+            self.process_id_keys[process_id] = key
+
+    def remove_process(self, process_id):
+        key = self.process_id_keys.pop(process_id, None)
+        if not key is None:
+            self.entries[key].running_process_ids.discard(process_id)
+
+    def log_counters(self, outcome):
+        log(f'Plan cache {outcome} -- hits: {self.hits}, misses: {self.misses}, entries: {len(self.entries)}, size: {self.total_size}')
+
@@ -0,0 +1,174 @@
+import fcntl
+import hashlib
+import os
+import shutil
+import tempfile
+from datetime import timedelta
+
+import config
+from util import *
+
+##
+## An on-disk cache of preprocessed scripts that is shared across pa.sh runs.
+##
+## Each entry is a directory (named after the key) that contains the preprocessed script
+##   and the files of its regions (pickled IRs and sequential scripts), since the
+##   preprocessed script refers to them by path.
+##
+## Preprocessing is deterministic, so the region files of an entry have fixed names
+##   (see TransformationState.write_region_file) and all files are written atomically.
+##   This means that concurrent runs of the same script can populate the same entry
+##   without any locking. An entry is complete once its preprocessed script exists.
+##
+## The least recently used entries are evicted when the cache exceeds its maximum size.
+##   A run holds a shared lock (flock) on the directory of the entry that it uses until it exits,
+##   since the daemon and the runtime read the region files while the script executes,
+##   and eviction only removes the entries that it can lock exclusively.
+##   The lock is released by the kernel when the run exits, however it exits.
+##   (With --preprocess_only, the entry is not protected while the script is executed later.)
+##
+
+PREPROCESSED_SCRIPT_FILENAME = "preprocessed.sh"
+PREPROCESSING_TIME_FILENAME = "preprocessing_time"
+
+class PreprocessingCache:
+    def __init__(self, cache_dir, max_size):
+        ## The preprocessed scripts refer to the region files with absolute paths
+        self.cache_dir = os.path.abspath(cache_dir) if cache_dir != "" else ""
+        self.max_size = max_size
+        ## The directories of the entries that this run uses, kept open (and locked) until it exits
+        self.entry_lock_fds = {}
+
+    def is_enabled(self):
+        return self.cache_dir != "" and self.max_size > 0
+
+    ## The key depends on the script, the PaSh version and installation,
+    ##   and the preprocessing mode.
+    def make_key(self, input_script_path, args):
+        key_hash = hashlib.sha1()
+        for part in [config.__version__, config.PASH_TOP, args.preprocess_mode]:
+            key_hash.update(part.encode("utf-8") + b"\0")
+        with open(input_script_path, "rb") as f:
+            key_hash.update(f.read())
+        return key_hash.hexdigest()
+
+    def get_entry_dir(self, key):
+        return os.path.join(self.cache_dir, key)
+
+    ## Locks the entry so that it is not evicted while this run uses it.
+    ##   Returns False if the entry does not exist.
+    def lock_entry(self, key):
+        if key in self.entry_lock_fds:
+            return True
+        entry_dir = self.get_entry_dir(key)
+        while True:
+            try:
+                fd = os.open(entry_dir, os.O_RDONLY | os.O_DIRECTORY)
+            except FileNotFoundError:
+                return False
+            fcntl.flock(fd, fcntl.LOCK_SH)
+            ## The entry might have been evicted (and even recreated) before it was locked
+            try:
+                is_same_entry = os.path.samestat(os.fstat(fd), os.stat(entry_dir))
+            except FileNotFoundError:
+                is_same_entry = False
+            if is_same_entry:
+                self.entry_lock_fds[key] = fd
+                return True
+            os.close(fd)
+
+    ## Returns the preprocessed script and the time that its preprocessing took, or None
+    def lookup(self, key):
+        entry_dir = self.get_entry_dir(key)
+        if not self.lock_entry(key):
+            log("Preprocessing cache miss:", key)
+            return None
+        try:
+            with open(os.path.join(entry_dir, PREPROCESSED_SCRIPT_FILENAME)) as f:
+                preprocessed_shell_script = f.read()
+            with open(os.path.join(entry_dir, PREPROCESSING_TIME_FILENAME)) as f:
+                preprocessing_time = timedelta(milliseconds=float(f.read()))
+        except (FileNotFoundError, ValueError):
+            log("Preprocessing cache miss:", key)
+            return None
+        ## Mark the entry as recently used
+        os.utime(os.path.join(entry_dir, PREPROCESSED_SCRIPT_FILENAME))
+        log("Preprocessing cache hit:", key)
+        return preprocessed_shell_script, preprocessing_time
+
+    ## Returns the directory where the region files of a new entry should be written
+    def start_entry(self, key):
+        entry_dir = self.get_entry_dir(key)
+        while True:
+            os.makedirs(entry_dir, exist_ok=True)
+            ## It might be evicted right after it is created
+            if self.lock_entry(key):
+                return entry_dir
+
+    def add(self, key, preprocessed_shell_script, preprocessing_time):
+        entry_dir = self.get_entry_dir(key)
+        write_file_atomically(os.path.join(entry_dir, PREPROCESSING_TIME_FILENAME),
+                              str(preprocessing_time / timedelta(milliseconds=1)).encode("utf-8"))
+        ## This has to be written last since it marks the entry as complete
+        write_file_atomically(os.path.join(entry_dir, PREPROCESSED_SCRIPT_FILENAME),
+                              preprocessed_shell_script.encode("utf-8"))
+        self.evict(key)
+
+    ## Evicts the least recently used entries (except the given one, and the ones that other runs use)
+    ##   until the cache fits in its size
+    def evict(self, keep_key):
+        entries = []
+        total_size = 0
+        for key in os.listdir(self.cache_dir):
+            entry_dir = self.get_entry_dir(key)
+            try:
+                entry_size = sum(entry.stat().st_size for entry in os.scandir(entry_dir))
+                ## Incomplete entries (e.g., of interrupted runs) are the first to go
+                script_path = os.path.join(entry_dir, PREPROCESSED_SCRIPT_FILENAME)
+                last_used = os.stat(script_path).st_mtime if os.path.exists(script_path) else 0
+            except OSError:
+                ## Another run might be evicting this entry
+                continue
+            total_size += entry_size
+            if key != keep_key:
+                entries.append((last_used, entry_size, key))
+
+        entries.sort()
+        for _last_used, entry_size, key in entries:
+            if total_size <= self.max_size:
+                break
+            if self.evict_entry(key):
+                total_size -= entry_size
+
+    ## Removes an entry unless another run uses it (or it is already removed)
+    def evict_entry(self, key):
+        entry_dir = self.get_entry_dir(key)
+        try:
+            fd = os.open(entry_dir, os.O_RDONLY | os.O_DIRECTORY)
+        except FileNotFoundError:
+            return False
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            log("Preprocessing cache not evicting:", key, "since it is in use")
+            os.close(fd)
+            return False
+        try:
+            is_same_entry = os.path.samestat(os.fstat(fd), os.stat(entry_dir))
+        except FileNotFoundError:
+            is_same_entry = False
+        if not is_same_entry:
+            os.close(fd)
+            return False
+        log("Preprocessing cache evicting:", key)
+        shutil.rmtree(entry_dir, ignore_errors=True)
+        os.close(fd)
+        return True
+
+
+## Writes a file so that concurrent readers see either its old or its new contents
+def write_file_atomically(path, data: bytes):
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp_")
+    with os.fdopen(fd, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
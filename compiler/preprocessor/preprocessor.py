@@ -6,6 +6,7 @@ import config
 from shell_ast import ast_to_ast
 from ir import FileIdGen
 from parse import parse_shell_to_asts, from_ast_objects_to_shell
+from preprocessing_cache import PreprocessingCache
 from util import *
 import server_util
 from speculative import util_spec
@@ -14,6 +15,32 @@ LOGGING_PREFIX = "PaSh Preprocessor: "
 
 @logging_prefix(LOGGING_PREFIX)
 def preprocess(input_script_path, args):
+    preprocessing_cache = PreprocessingCache(args.preprocessing_cache_dir, args.preprocessing_cache_size)
+    ## The speculative preprocessing has side effects (partial order file), so it is never cached
+    if (not preprocessing_cache.is_enabled()
+        or ast_to_ast.TransformationType(args.preprocess_mode) is ast_to_ast.TransformationType.SPECULATIVE):
+        return preprocess_script(input_script_path, args)
+
+    preprocessing_cache_lookup_start_time = datetime.now()
+    cache_key = preprocessing_cache.make_key(input_script_path, args)
+    cached = preprocessing_cache.lookup(cache_key)
+    preprocessing_cache_lookup_end_time = datetime.now()
+    print_time_delta("Preprocessing -- Cache Lookup", preprocessing_cache_lookup_start_time, preprocessing_cache_lookup_end_time)
+    if not cached is None:
+        preprocessed_shell_script, preprocessing_time = cached
+        ## The time that it would have taken to preprocess the script
+        print_time_delta("Preprocessing -- Cache Saved", preprocessing_cache_lookup_end_time,
+                         preprocessing_cache_lookup_start_time + preprocessing_time)
+        return preprocessed_shell_script
+
+    preprocessing_start_time = datetime.now()
+    region_file_dir = preprocessing_cache.start_entry(cache_key)
+    preprocessed_shell_script = preprocess_script(input_script_path, args, region_file_dir)
+    preprocessing_end_time = datetime.now()
+    preprocessing_cache.add(cache_key, preprocessed_shell_script, preprocessing_end_time - preprocessing_start_time)
+    return preprocessed_shell_script
+
+def preprocess_script(input_script_path, args, region_file_dir=None):
     ## 1. Execute the POSIX shell parser that returns the AST in JSON
     preprocessing_parsing_start_time = datetime.now()
     ast_objects = parse_shell_to_asts(input_script_path)
@@ -23,7 +50,7 @@ def preprocess(input_script_path, args):
     ## 2. Preprocess ASTs by replacing possible candidates for compilation
     ##    with calls to the PaSh runtime.
     preprocessing_pash_start_time = datetime.now()
-    preprocessed_asts = preprocess_asts(ast_objects, args)
+    preprocessed_asts = preprocess_asts(ast_objects, args, region_file_dir)
     preprocessing_pash_end_time = datetime.now()
     print_time_delta("Preprocessing -- PaSh", preprocessing_pash_start_time, preprocessing_pash_end_time)
 
@@ -36,14 +63,15 @@ def preprocess(input_script_path, args):
     return preprocessed_shell_script
 
 
-def preprocess_asts(ast_objects, args):
+def preprocess_asts(ast_objects, args, region_file_dir=None):
     trans_mode = ast_to_ast.TransformationType(args.preprocess_mode)
     if trans_mode is ast_to_ast.TransformationType.SPECULATIVE:
         trans_options = ast_to_ast.SpeculativeTransformationState(mode=trans_mode,
                                                                   po_file=args.partial_order_file)
         util_spec.initialize(trans_options)
     else:
-        trans_options = ast_to_ast.TransformationState(mode=trans_mode)
+        trans_options = ast_to_ast.TransformationState(mode=trans_mode,
+                                                       region_file_dir=region_file_dir)
 
     ## Preprocess ASTs by replacing AST regions with calls to PaSh's runtime.
     ## Then the runtime will do the compilation and optimization with additional
@@ -0,0 +1,46 @@
+import os
+
+import config
+
+##
+## The runtime primitives of a region report what they observed while running it
+##   by appending lines to a file for its process id (see runtime/region_stats.h):
+##
+##   stdin_bytes <bytes>: the number of bytes that the splitter read from the stdin of the region
+##   eager_peak <edge id> <bytes>: the most data that the eager on that edge buffered at once
+##
+## The runtime exports the path of that file in PASH_REGION_STATS (see pash_prepare_call_compiler.sh),
+##   and the compilation server reads it after the region has exited, the next time it compiles the region.
+##
+
+class RegionStats:
+    def __init__(self, stdin_bytes=None, eager_peaks=None):
+        self.stdin_bytes = stdin_bytes
+        self.eager_peaks = {} if eager_peaks is None else eager_peaks
+
+    def __repr__(self):
+        return f'RegionStats(Stdin bytes:{self.stdin_bytes}, Eager peaks:{self.eager_peaks})'
+
+## The runtime exports the same path
+def get_region_stats_file(process_id):
+    return os.path.join(config.PASH_TMP_PREFIX, f'region_stats_{process_id}')
+
+## Reads (and removes) the statistics that the runtime reported for a process
+def read_region_stats(process_id):
+    stats = RegionStats()
+    stats_file = get_region_stats_file(process_id)
+    try:
+        with open(stats_file) as f:
+            lines = f.readlines()
+        os.remove(stats_file)
+    except FileNotFoundError:
+        return stats
+
+    for line in lines:
+        fields = line.split()
+        if len(fields) == 2 and fields[0] == "stdin_bytes":
+            stats.stdin_bytes = max(int(fields[1]), stats.stdin_bytes or 0)
+        elif len(fields) == 3 and fields[0] == "eager_peak":
+            edge_id = int(fields[1])
+            stats.eager_peaks[edge_id] = max(int(fields[2]), stats.eager_peaks.get(edge_id, 0))
+    return stats
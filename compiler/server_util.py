@@ -1,5 +1,8 @@
+import asyncio
 import os
+import queue
 import socket
+from threading import Thread
 
 import config
 from util import log
@@ -12,6 +15,10 @@ def error_response(string):
     return f'ERROR: {string}\n'
 
 class UnixPipeReader:
+    ## All clients read their responses from the same fifo, so we cannot
+    ##   have more than one outstanding request at a time.
+    supports_concurrent_requests = False
+
     def __init__(self, in_filename, out_filename, blocking = True):
         self.in_filename = in_filename
         self.out_filename = out_filename
@@ -77,7 +84,7 @@ class UnixPipeReader:
     ## This method respond to the connection we last got input from
     ## In the case of the UnixPipes, we don't have any state management here
     ##   since all reads/writes go to/from the same fifos
-    def respond(self, message):
+    def respond(self, message, connection=None):
         fout = open(self.out_filename, "w")
         fout.write(message)
         fout.flush()
@@ -89,6 +96,9 @@ class UnixPipeReader:
     def close_last_connection(self):
         pass
 
+    def detach_last_connection(self):
+        return None
+
     def close(self):
         log("Reader closed")
         if not self.blocking:
@@ -113,15 +123,55 @@ def unix_socket_send_and_forget(socket_file: str, msg: str):
 
 
 
-## TODO: Instead of this, think of using a standard SocketServer
-##   see: https://docs.python.org/3/library/socketserver.html#module-socketserver
 ##
+## Clients can talk to the SocketManager in two ways:
+##
+## - Legacy: connect, send a single newline-terminated command, and read the
+##     response until the connection is closed (e.g., `echo "$msg" | nc -U "$socket"`).
+##
+## - Persistent: keep the connection open and send length-prefixed messages on it,
+##     i.e., `<length>\n<message>`, where <length> is the size of the message in bytes.
+##     Responses are framed in the same way. Requests can be pipelined, e.g., a
+##     client can send `Exit:<id>` (which has no response) and then immediately
+##     `Compile:...` without waiting for anything.
+##
+class SocketConnection:
+    def __init__(self, writer):
+        self.writer = writer
+        ## Becomes true when the client sends its first length-prefixed message
+        self.persistent = False
+        self.has_requests = False
+
+    ## These are called in the event loop thread
+    def send(self, bytes_message):
+        if self.writer.is_closing():
+            return
+        if self.persistent:
+            self.writer.write(str(len(bytes_message)).encode('utf-8') + b'\n' + bytes_message)
+        else:
+            self.writer.write(bytes_message)
+            self.close()
+
+    ## The connection might have been inherited by forked processes (e.g., compile workers),
+    ##   so we explicitly shut it down to make sure that the client sees the end of the response.
+    def close(self):
+        if self.writer.is_closing():
+            return
+        try:
+            self.writer.write_eof()
+        except OSError:
+            ## The client might have already closed its side
+            pass
+        self.writer.close()
+
+
 ## TODO: SocketManager might need to handle errors more gracefully
 class SocketManager:
+    supports_concurrent_requests = True
+
     def __init__(self, socket_addr: str):
         ## Configure them outside
         server_address = socket_addr
-        self.buf_size = config.SOCKET_BUF_SIZE
 
         # Make sure the socket does not already exist
         ## TODO: Is this necessary?
@@ -132,51 +182,101 @@ class SocketManager:
                 raise
         log("SocketManager: Made sure that socket does not exist")
 
-        # Create a UDS socket
-        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
-        log("SocketManager: Created socket")
+        ## All connections are served by an asyncio event loop in a separate thread.
+        ## It puts the requests that it receives in a queue, and writes a byte in a pipe
+        ##   for each of them, so that the main loop can wait for them using select.
+        self.requests = queue.Queue()
+        self.requests_reader, self.requests_writer = os.pipe()
+        self.loop = asyncio.new_event_loop()
 
-        self.sock.bind(server_address)
-        log("SocketManager: Successfully bound to socket")    
+        self.server = self.loop.run_until_complete(
+            asyncio.start_unix_server(self.handle_connection, path=server_address))
+        log("SocketManager: Successfully bound to socket")
 
-        ## TODO: Check if we need to configure the backlog
-        self.sock.listen()    
-        log("SocketManager: Listenting on socket")    
+        self.open_connections = set()
+        self.loop_thread = Thread(target=self.loop.run_forever, daemon=True)
+        self.loop_thread.start()
+        log("SocketManager: Listenting on socket")
 
         ## Connection stack
         self.connections = []
-    
 
-    def get_next_cmd(self):
-        connection, client_address = self.sock.accept()
-        data = connection.recv(self.buf_size)
+    ## This runs in the event loop thread for each client connection
+    async def handle_connection(self, reader, writer):
+        connection = SocketConnection(writer)
+        self.open_connections.add(connection)
+        try:
+            while True:
+                header = await reader.readline()
+                if len(header) == 0:
+                    ## The old protocol treats an empty connection as an empty command
+                    if not connection.persistent and not connection.has_requests:
+                        self.add_request(connection, "")
+                    break
 
-        ## TODO: This could be avoided for efficiency
-        str_data = data.decode('utf-8')
+                str_header = header.decode('utf-8')
+                if str_header.rstrip("\n").isdigit():
+                    connection.persistent = True
+                    data = await reader.readexactly(int(str_header))
+                    self.add_request(connection, data.decode('utf-8'))
+                else:
+                    ## We need to ensure that we read a command at once
+                    assert(str_header.endswith("\n"))
+                    ## Legacy clients send a single command per connection
+                    self.add_request(connection, str_header)
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError) as e:
+            log("SocketManager: Connection error:", e)
+        finally:
+            self.open_connections.discard(connection)
+            ## Persistent connections are closed when the client closes them
+            if connection.persistent:
+                connection.close()
+
+    def add_request(self, connection, str_data):
+        connection.has_requests = True
+        self.requests.put((connection, str_data))
+        os.write(self.requests_writer, b'\n')
+
+    def get_next_cmd(self):
+        os.read(self.requests_reader, 1)
+        connection, str_data = self.requests.get()
         log("Received data:", str_data)
-        ## TODO: Lift this requirement if needed
-        ##
-        ## We need to ensure that we read a command at once or the command was empty (only relevant in the first invocation)
-        assert(str_data.endswith("\n") or str_data == "")
-        
         self.connections.append(connection)
         return str_data
 
-    ## This method respond to the connection we last got input from
-    ## In the case of the UnixPipes, we don't have any state management here
-    ##   since all reads/writes go to/from the same fifos
-    def respond(self, message):
+    ## This method responds to the given connection (or the connection we last got input from).
+    ##   Legacy connections are closed after their response.
+    def respond(self, message, connection=None):
+        if connection is None:
+            connection = self.connections.pop()
         bytes_message = message.encode('utf-8')
-        self.connections[-1].sendall(bytes_message)
-        self.close_last_connection()
+        self.loop.call_soon_threadsafe(connection.send, bytes_message)
 
-    ## This method doesn't do anything for unix pipe reader since we always read and write
-    ## to and from the same fifos
+    ## This method removes the connection we last got input from, so that
+    ##   we can respond to it later, after serving other connections.
+    def detach_last_connection(self):
+        return self.connections.pop()
+
+    ## This is used to wait (with select) for new requests
+    def fileno(self):
+        return self.requests_reader
+
+    ## This is used for requests that have no response (e.g., Exit).
+    ##   Persistent connections stay open for the next requests.
     def close_last_connection(self):
-        # Clean up the connection
         last_connection = self.connections.pop()
-        last_connection.close()
+        if not last_connection.persistent:
+            self.loop.call_soon_threadsafe(last_connection.close)
 
     def close(self):
-        self.sock.close()
+        asyncio.run_coroutine_threadsafe(self.close_server(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.loop_thread.join()
         log("SocketManager: Closed")
+
+    async def close_server(self):
+        self.server.close()
+        for connection in list(self.open_connections):
+            connection.close()
+        await self.server.wait_closed()
@@ -1,5 +1,6 @@
 from enum import Enum
 import copy
+import os
 import pickle
 
 import config
@@ -9,6 +10,7 @@ from shell_ast.ast_util import *
 from shasta.ast_node import ast_match
 from shasta.json_to_ast import to_ast_node
 from parse import from_ast_objects_to_shell
+from preprocessing_cache import write_file_atomically
 from speculative import util_spec
 
 ## There are two types of ast_to_ast transformations
@@ -19,15 +21,35 @@ class TransformationType(Enum):
 ## Use this object to pass options inside the preprocessing
 ## trasnformation.
 class TransformationState:
-    def __init__(self, mode: TransformationType):
+    def __init__(self, mode: TransformationType, region_file_dir=None):
         self.mode = mode
         self.node_counter = 0
         self.loop_counter = 0
         self.loop_contexts = []
+        ## If set, region files are written in this directory (e.g., of the preprocessing cache)
+        self.region_file_dir = region_file_dir
+        self.region_file_counter = 0
             
     def get_mode(self):
         return self.mode
 
+    ## Writes a region file (e.g., a pickled IR) and returns its path.
+    ##
+    ## Region files are temporary files, unless a region file directory is given.
+    ##   In that case they are named after their order, so that preprocessing the
+    ##   same script twice writes the same files.
+    def write_region_file(self, data: bytes, suffix: str):
+        if self.region_file_dir is None:
+            region_filename = ptempfile()
+            with open(region_filename, "wb") as region_file:
+                region_file.write(data)
+        else:
+            self.region_file_counter += 1
+            region_filename = os.path.join(self.region_file_dir,
+                                           f'region_{self.region_file_counter}.{suffix}')
+            write_file_atomically(region_filename, data)
+        return region_filename
+
     ## Node id related
     def get_next_id(self):
         new_id = self.node_counter
@@ -547,20 +569,18 @@ def preprocess_node_case(ast_node, trans_options, last_object=False):
 def replace_df_region(asts, trans_options, disable_parallel_pipelines=False, ast_text=None) -> AstNode:
     transformation_mode = trans_options.get_mode()
     if transformation_mode is TransformationType.PASH:
-        ir_filename = ptempfile()
-
         ## Serialize the node in a file
-        with open(ir_filename, "wb") as ir_file:
-            pickle.dump(asts, ir_file)
+        ir_filename = trans_options.write_region_file(pickle.dumps(asts), "ir")
 
         ## Serialize the candidate df_region asts back to shell
         ## so that the sequential script can be run in parallel to the compilation.
-        sequential_script_file_name = ptempfile()
         text_to_output = get_shell_from_ast(asts, ast_text=ast_text)
         ## However, if we have the original ast text, then we can simply output that.
-        with open(sequential_script_file_name, "w") as script_file:
-            script_file.write(text_to_output)
-        replaced_node = make_call_to_pash_runtime(ir_filename, sequential_script_file_name, disable_parallel_pipelines)
+        sequential_script_file_name = trans_options.write_region_file(text_to_output.encode("utf-8"), "sh")
+        ## The runtime only saves the variables that the region might expand
+        region_variables = find_region_variables(asts)
+        replaced_node = make_call_to_pash_runtime(ir_filename, sequential_script_file_name,
+                                                  region_variables, disable_parallel_pipelines)
     elif transformation_mode is TransformationType.SPECULATIVE:
         text_to_output = get_shell_from_ast(asts, ast_text=ast_text)
         ## Generate an ID
@@ -613,7 +633,7 @@ def get_shell_from_ast(asts, ast_text=None) -> str:
 ## (MAYBE) TODO: The way I did it, is by calling the parser once, and seeing
 ## what it returns. Maybe it would make sense to call the parser on
 ## the fly to have a cleaner implementation here?
-def make_call_to_pash_runtime(ir_filename, sequential_script_file_name,
+def make_call_to_pash_runtime(ir_filename, sequential_script_file_name, region_variables,
                               disable_parallel_pipelines) -> AstNode:
 
     ## Disable parallel pipelines if we are in the last command of the script.
@@ -630,6 +650,8 @@ def make_call_to_pash_runtime(ir_filename, sequential_script_file_name,
                         string_to_argument(sequential_script_file_name)])
     assignments.append(["pash_input_ir_file", 
                         string_to_argument(ir_filename)])
+    assignments.append(["pash_region_variables",
+                        [quote_arg(string_to_argument(" ".join(region_variables)))]])
 
     ## Call the runtime
     arguments = [string_to_argument("source"),
@@ -1,3 +1,4 @@
+import re
 
 from env_var_names import *
 from shasta.ast_node import *
@@ -196,32 +197,33 @@ def make_increment_var(var_name: str):
     node = make_command([], assignments=assignments)
     return node
 
-def make_echo_ast(argument, var_file_path):
-    nodes = []
-    ## Source variables if present
-    if(not var_file_path is None):
-        arguments = [string_to_argument("source"), string_to_argument(var_file_path)]
-
-        line_number = 0
-        node = make_kv('Command', [line_number, [], arguments, []])
-        nodes.append(node)
-
-    ## Reset the exit status
-    variable_arg = make_kv('V', ['Normal', "false", 'pash_previous_exit_status', []])
-    arguments = [string_to_argument("exit"), [variable_arg]]
-    exit_node = make_kv('Command', [0, [], arguments, []])
-    node = make_kv('Subshell', [0, exit_node, []])
-    nodes.append(node)
-
-    ## Reset the input arguments
-    variable_arg = make_kv('V', ['Normal', "false", 'pash_input_args', []])
-    arguments = [string_to_argument("set"), string_to_argument("--"), [variable_arg]]
-    set_node = make_kv('Command', [0, [], arguments, []])
-    nodes.append(set_node)
-
-    arguments = [string_to_argument("echo"), string_to_argument("-n"), argument]
-
-    line_number = 0
-    node = make_kv('Command', [line_number, [], arguments, []])
-    nodes.append(node)
-    return nodes
\ No newline at end of file
+## Variables that are read by the expansion even if they are not mentioned in the region
+IMPLICIT_VARIABLES = ["IFS", "-"]
+
+## Returns the names of all the variables that the expansion of the given object might read.
+def find_referenced_variables(obj):
+    variable_names = set(IMPLICIT_VARIABLES)
+    worklist = [obj]
+    while len(worklist) > 0:
+        curr = worklist.pop()
+        if isinstance(curr, (list, tuple)):
+            worklist.extend(curr)
+        elif isinstance(curr, VArgChar):
+            variable_names.add(curr.var)
+            worklist.append(curr.arg)
+        elif isinstance(curr, TArgChar):
+            variable_names.add("HOME")
+        elif hasattr(curr, "__dict__"):
+            worklist.extend(vars(curr).values())
+    return variable_names
+
+SHELL_VARIABLE_NAME_RE = re.compile(r'[A-Za-z_][A-Za-z0-9_]*')
+
+## Returns the names of the shell variables that the runtime has to save
+##   so that the given region can be expanded.
+##
+## Special parameters (e.g., $1, $#, $-) are not included since the runtime
+##   always saves them through the pash_* variables (see set_special_parameters).
+def find_region_variables(asts) -> "list[str]":
+    return sorted(name for name in find_referenced_variables(asts)
+                  if SHELL_VARIABLE_NAME_RE.fullmatch(name))
@@ -13,7 +13,7 @@ case "$distro" in
     ;;
 esac
 
-[ "$1" = "-c" ] && rm-files 1M.txt all_cmds.txt words sorted_words 10M.txt
+[ "$1" = "-c" ] && rm-files 1M.txt all_cmds.txt words sorted_words 10M.txt no_trailing_newline.txt
 
 if [ ! -f ./1M.txt ]; then
   curl -sf --connect-timeout 10 'http://ndr.md/data/dummy/1M.txt' > 1M.txt
@@ -70,6 +70,10 @@ if [ ! -f ./ab.txt ]; then
   done
 fi
 
+if [ ! -f ./no_trailing_newline.txt ]; then
+  cp 1M.txt no_trailing_newline.txt
+  printf 'the last line does not end with a newline' >> no_trailing_newline.txt
+fi
 
 ## Re-sort words for this machine
 if [ ! -f ./sorted_words ]; then
@@ -0,0 +1,12 @@
+#!/bin/bash
+
+## Tests that the last line of the input is kept when it does not end with a newline
+##   (e.g., by the commands that r_wrap keeps one instance of)
+
+FILE="$PASH_TOP/evaluation/tests/input/no_trailing_newline.txt"
+
+cat $FILE | tr a-z A-Z
+cat $FILE | cut -c 1-20
+cat $FILE | sed 's/the/THE/g'
+cat $FILE | grep -a 'e'
+cat $FILE | tr a-z A-Z | sort
@@ -0,0 +1,88 @@
+#!/bin/bash
+
+## Tests that the compiler reads back the variables files that the runtime saves with declare -p
+##   (see parse_declare_output in compiler/env_vars_util.py).
+##
+## The variables are parsed, printed back as assignments, and declared again in a new bash,
+##   whose declare -p has to print them exactly as the original one did.
+## The whole declare -p of this shell also has to parse, and contain all of its variables.
+
+export PASH_TOP=${PASH_TOP:-$(git rev-parse --show-toplevel --show-superproject-working-tree)}
+export PYTHONPATH="${PASH_TOP}/compiler:${PASH_TOP}/python_pkgs/:${PYTHONPATH}"
+## The compiler modules need it to be set, even though nothing is written there
+export PASH_TMP_PREFIX=${PASH_TMP_PREFIX:-/tmp/}
+
+test_dir=$(mktemp -d)
+trap 'rm -rf "$test_dir"' EXIT
+
+variables=(IFS words sparse empty_array counts multiline ansi control quoted spaces number exported unset_variable)
+
+IFS=$' \t\n'
+words=(the and "of the" $'tab\there' '' "it's")
+sparse=([3]=three [10]=$'ten\n')
+empty_array=()
+declare -A counts=([the]=1 ["of the"]=2 [$'new\nline']=3 ['"quoted" key']=4 ['a]b']=5)
+multiline='first line
+second line'
+ansi=$'tab\tand \'quotes\''
+control=$'bell\a escape\e del\x7f'
+quoted='a "double" quoted $value with `backticks` and \backslashes\'
+spaces='   leading and trailing   '
+declare -i number=42
+declare -x exported='exported value'
+declare unset_variable
+
+declare -p > "$test_dir/all_variables"
+compgen -v > "$test_dir/all_variable_names"
+declare -p "${variables[@]}" > "$test_dir/variables"
+
+python3 - "$test_dir" <<'EOF' || exit 1
+import os
+import shlex
+import sys
+
+from env_vars_util import parse_declare_output
+
+test_dir = sys.argv[1]
+
+def read(filename):
+    with open(os.path.join(test_dir, filename)) as f:
+        return f.read()
+
+all_variables = parse_declare_output(read("all_variables"))
+missing = [name for name in read("all_variable_names").split()
+           if not name in all_variables]
+if len(missing) > 0:
+    print("Variables missing from the parsed declare -p:", missing)
+    sys.exit(1)
+
+def assignment(name, var_type, value):
+    if isinstance(value, dict):
+        items = [f"[{shlex.quote(key)}]={shlex.quote(item)}" for key, item in value.items()]
+        return f"declare -A {name}=({' '.join(items)})"
+    elif isinstance(value, list):
+        items = [f"[{index}]={shlex.quote(item)}" for index, item in enumerate(value)
+                 if not item is None]
+        return f"declare -a {name}=({' '.join(items)})"
+    else:
+        flags = "--" if var_type is None else var_type
+        return f"declare {flags} {name}={shlex.quote(value)}"
+
+variables = parse_declare_output(read("variables"))
+with open(os.path.join(test_dir, "assignments"), "w") as f:
+    for name, (var_type, value) in variables.items():
+        ## Declared but unset variables are parsed as empty
+        if name == "unset_variable":
+            f.write(f"declare {name}\n")
+        else:
+            f.write(assignment(name, var_type, value) + "\n")
+EOF
+
+bash -c 'source "$1"; shift; declare -p "$@"' bash "$test_dir/assignments" "${variables[@]}" > "$test_dir/variables_again"
+
+if diff "$test_dir/variables" "$test_dir/variables_again"; then
+    echo "declare -p parsing: OK"
+else
+    echo "declare -p parsing: FAIL"
+    exit 1
+fi
@@ -45,14 +45,18 @@ n_inputs=(
     8
 )
 
+## The test inputs are small, so the regions would mostly run sequentially or at a reduced width
+##   (see --sequential_input_size and --input_size_per_width) instead of at the width of the test
 if [ "$EXPERIMENTAL" -eq 1 ]; then
     configurations=(
         # "" # Commenting this out since the tests take a lot of time to finish
-        "--parallel_pipelines"
+        "--parallel_pipelines --check_shell_emitter --sequential_input_size 0 --input_size_per_width 0"
+        "--parallel_pipelines --executor native --sequential_input_size 0 --input_size_per_width 0"
     )
 else
     configurations=(
-        "--parallel_pipelines --profile_driven"
+        "--parallel_pipelines --profile_driven --check_shell_emitter --sequential_input_size 0 --input_size_per_width 0"
+        "--parallel_pipelines --profile_driven --executor native --sequential_input_size 0 --input_size_per_width 0"
     )
 fi
 
@@ -89,6 +93,7 @@ pipeline_microbenchmarks=(
     tr-test              # Tests all possible behaviors of tr that exist in our evaluation
     grep-test            # Tests some interesting grep invocations
     ann-agg              # Tests custom aggregators in annotations
+    no_trailing_newline  # Tests inputs whose last line does not end with a newline
     # # # # micro_1000           # Not being run anymore, as it is very slow. Tests whether the compiler is fast enough. It is a huge pipeline without any computation.
 )
 
@@ -0,0 +1,93 @@
+#!/bin/bash
+
+## Tests which command invocations r_wrap can keep running for all of its blocks
+##   (see get_line_framing_flag in compiler/line_framing.py).
+##
+## Every invocation is checked against the framing that it is expected to get:
+##   -l (line map), -f (line filter), or none (a fork for every block).
+
+export PASH_TOP=${PASH_TOP:-$(git rev-parse --show-toplevel --show-superproject-working-tree)}
+export PYTHONPATH="${PASH_TOP}/compiler:${PASH_TOP}/python_pkgs/:${PYTHONPATH}"
+## The compiler modules need it to be set, even though nothing is written there
+export PASH_TMP_PREFIX=${PASH_TMP_PREFIX:-/tmp/}
+
+python3 - <<'EOF' || { echo "line framing: FAIL"; exit 1; }
+import sys
+
+from pash_annotations.datatypes.BasicDatatypes import Flag, ArgStringType
+from pash_annotations.datatypes.BasicDatatypesWithIO import OptionWithIO
+from pash_annotations.datatypes.CommandInvocationWithIOVars import CommandInvocationWithIOVars
+
+from definitions.ir.arg import Arg
+from line_framing import get_line_framing_flag, LINE_MAP_FLAG, LINE_FILTER_FLAG
+
+## (command, flags, options, operands, expected framing)
+invocations = [
+    ## tr maps lines to lines, unless it might translate, delete, or squeeze a newline
+    ("tr", [], [], ["a-z", "A-Z"], LINE_MAP_FLAG),
+    ("tr", ["-d"], [], ["aeiou"], LINE_MAP_FLAG),
+    ("tr", ["-s"], [], [" "], LINE_MAP_FLAG),
+    ("tr", ["-d"], [], ["\n"], None),
+    ("tr", [], [], ["\\n", " "], None),
+    ("tr", [], [], ["[:upper:]", "[:lower:]"], None),
+    ("tr", ["-c"], [], ["a", "b"], None),
+    ## cut outputs a line for every line, unless -s drops some, or it reads a file
+    ("cut", [], [("-d", ","), ("-f", "1")], [], LINE_MAP_FLAG),
+    ("cut", [], [("-c", "1-5")], [], LINE_MAP_FLAG),
+    ("cut", ["-n"], [("-b", "1")], [], LINE_MAP_FLAG),
+    ("cut", ["--complement"], [("-f", "2")], [], LINE_MAP_FLAG),
+    ("cut", ["-s"], [("-d", ","), ("-f", "2")], [], None),
+    ("cut", [], [("-d", "\n"), ("-f", "1")], [], None),
+    ("cut", [], [("-f", "1")], ["file.txt"], None),
+    ## sed maps lines to lines only with a single substitution that doesn't add newlines
+    ("sed", [], [], ["s/a/b/"], LINE_MAP_FLAG),
+    ("sed", ["-E"], [], ["s/(a+)/\\1b/g"], LINE_MAP_FLAG),
+    ("sed", [], [], ["s|a/b|c|2"], LINE_MAP_FLAG),
+    ("sed", [], [], ["s/a/b\\nc/"], None),
+    ("sed", [], [], ["s/a/b/w out.txt"], None),
+    ("sed", [], [], ["s/a/b/;p"], None),
+    ("sed", ["-n"], [], ["s/a/b/p"], None),
+    ("sed", [], [], ["y/abc/xyz/"], None),
+    ("sed", [], [], ["p"], None),
+    ("sed", [], [], ["s/a/b/", "file.txt"], None),
+    ## grep -a outputs the lines that match, unless it adds to them, counts them, or needs context
+    ("grep", ["-a"], [], ["foo"], LINE_FILTER_FLAG),
+    ("grep", ["-a", "-v", "-i"], [("-e", "foo")], [], LINE_FILTER_FLAG),
+    ("grep", ["-a", "-E"], [("-e", "a|b"), ("-e", "c")], [], LINE_FILTER_FLAG),
+    ("grep", [], [], ["foo"], None),
+    ("grep", ["-v"], [], ["foo"], None),
+    ("grep", ["-a", "-c"], [], ["foo"], None),
+    ("grep", ["-a", "-n"], [], ["foo"], None),
+    ("grep", ["-a", "-o"], [], ["foo"], None),
+    ("grep", ["-a"], [("-A", "1")], ["foo"], None),
+    ("grep", ["-a"], [("-e", "foo")], ["file.txt"], None),
+    ("grep", ["-a"], [], ["foo", "file.txt"], None),
+    ("grep", ["-a"], [], [], None),
+    ## All other commands are forked for every block
+    ("sort", [], [], [], None),
+]
+
+def make_invocation(command, flags, options, operands):
+    flag_option_list = [Flag(flag) for flag in flags]
+    flag_option_list += [OptionWithIO(name, ArgStringType(Arg.string_to_arg(value)))
+                         for name, value in options]
+    ## The operands of a parsed command are its (expanded) arguments
+    operand_list = [Arg.string_to_arg(operand) for operand in operands]
+    return CommandInvocationWithIOVars(cmd_name=command,
+                                       flag_option_list=flag_option_list,
+                                       operand_list=operand_list,
+                                       implicit_use_of_streaming_input=None,
+                                       implicit_use_of_streaming_output=None,
+                                       access_map={})
+
+failed = False
+for command, flags, options, operands, expected in invocations:
+    framing = get_line_framing_flag(make_invocation(command, flags, options, operands))
+    if framing != expected:
+        print(f"{command} {flags} {options} {operands}: expected {expected} but got {framing}")
+        failed = True
+if failed:
+    sys.exit(1)
+EOF
+
+echo "line framing: OK"
@@ -1,9 +1,11 @@
 #include <assert.h>
 #include "eager_lib.h"
+#include "region_stats.h"
 
-#define READ_WRITE_BUFFER_SIZE 2 * 1024
+// The default capacity of the in-memory buffer (the ring only grows to it if the output falls behind)
+#define DEFAULT_BUFFER_SIZE (16 * 1024 * 1024)
 
-void EagerLoop(char* input, char* output, char* intermediate) {
+void EagerLoop(char* input, char* output, char* intermediate, size_t bufferSize, const char* label) {
 
     int doneReading = 0;
     int doneWriting = 0;
@@ -11,20 +13,20 @@ void EagerLoop(char* input, char* output, char* intermediate) {
     struct timeval ts1, ts2, ts3, ts4;
     gettimeofday(&ts1, NULL);
 
-    // Open the intermediate file for both reading and writing
-    // TODO: Think of using O_TMPFILE
-    int intermediateWriter = safeOpen3(intermediate, O_CREAT | O_WRONLY, S_IRWXU);
-    int intermediateReader = safeOpen(intermediate, O_RDONLY);
+    // The input is buffered in memory, and only once that is full, in a file
+    // (an unlinked file in the directory of the intermediate file)
+    eager_buffer_t buffer;
+    initBuffer(&buffer, bufferSize, intermediate);
 
     // It is fine for the input to block, since when we ask for it we
-    // don't have anything in the intermediate file or buffer.
+    // don't have anything in the buffer.
     int inputFd = safeOpen(input, O_RDONLY);
     debug("opened input file %s\n", input);
 
     debug("will open outputFile from %s \n", output);
     int outputFd = tryOpenOutput(output);
     while(outputFd < 0 && !doneReading) {
-        if (readInputWriteToFile(inputFd, intermediateWriter, READ_WRITE_BUFFER_SIZE) == 0) {
+        if (readInputToBuffer(&buffer, inputFd) == 0) {
             /* printf("Input was done before even output was opened\n"); */
             doneReading = 1;
         }
@@ -48,47 +50,32 @@ void EagerLoop(char* input, char* output, char* intermediate) {
         FD_ZERO(&readFds); // Clear FD set for select
         FD_ZERO(&writeFds); // Clear FD set for select
         FD_SET(inputFd, &readFds);
-        FD_SET(outputFd, &writeFds);
+        // If there is nothing in the buffer, we only wait for the input
+        if (bufferedBytes(&buffer) > 0) {
+            FD_SET(outputFd, &writeFds);
+        }
 
         maxFd = MAX(inputFd, outputFd);
 
-        // TODO: Should I handle some error here?
-        select(maxFd + 1, &readFds, &writeFds, NULL, NULL);
+        if (select(maxFd + 1, &readFds, &writeFds, NULL, NULL) < 0) {
+            if (errno == EINTR) {
+                continue;
+            }
+            fprintf(stderr, "ERROR: %s, when waiting for the input or the output!\n", strerror(errno));
+            exit(1);
+        }
 
-        // TODO: Make writing more preferable by trying to rewrite if
-        // it was possible once since this would help not accumulate
-        // memory in this intermediate buffer.
+        // Writing goes first, so that as little as possible accumulates in the buffer
+        if (FD_ISSET(outputFd, &writeFds)) {
+            writeBufferToOutput(&buffer, outputFd, &doneWriting);
+        }
         if (FD_ISSET(inputFd, &readFds)) {
-            if (readInputWriteToFile(inputFd, intermediateWriter, READ_WRITE_BUFFER_SIZE) == 0) {
+            if (readInputToBuffer(&buffer, inputFd) == 0) {
                 doneReading = 1;
                 debug("Input is done!\n");
                 break;
             }
         }
-        if (FD_ISSET(outputFd, &writeFds)) {
-            // There is something to read in the intermediate file. We
-            // then read from the intermediate file and write to the
-            // output.
-            off_t intermediateFileDiff =
-                safeLseek(intermediateWriter) - safeLseek(intermediateReader);
-
-            // There is nothing to read in the intermediate file. We
-            // then have to block read from the input until it gives
-            // us something.
-            if (intermediateFileDiff == 0) {
-                if (readInputWriteToFile(inputFd, intermediateWriter, READ_WRITE_BUFFER_SIZE) == 0) {
-                    doneReading = 1;
-                    debug("Input is done!\n");
-                    break;
-                }
-                intermediateFileDiff =
-                    safeLseek(intermediateWriter) - safeLseek(intermediateReader);
-            }
-
-            // Here we know that the intermediate file has something.
-            assert(intermediateFileDiff > 0);
-            safeWriteOutput(outputFd, intermediateReader, intermediateFileDiff, &doneWriting);
-        }
     }
 
     gettimeofday(&ts3, NULL);
@@ -103,11 +90,13 @@ void EagerLoop(char* input, char* output, char* intermediate) {
     // Set the output file to blocking so that writing to it doesn't lead to a busy loop
     fdSetBlocking(outputFd, 1);
 
-    // Output the rest of the intermediate file
-    outputRestIntermediateFile(outputFd, intermediateWriter, intermediateReader, &doneWriting);
+    // Output the rest of the buffer
+    while (!doneWriting && bufferedBytes(&buffer) > 0) {
+        writeBufferToOutput(&buffer, outputFd, &doneWriting);
+    }
 
     gettimeofday(&ts4, NULL);
-    debug("Finishing up writing the intermediate file took %lu us\n",
+    debug("Finishing up writing the buffer took %lu us\n",
            (ts4.tv_sec - ts3.tv_sec) * 1000000 + ts4.tv_usec - ts3.tv_usec);
 
     // TODO: We have to handle the case where reading is not done but
@@ -118,14 +107,19 @@ void EagerLoop(char* input, char* output, char* intermediate) {
         exit(1);
     }
     close(outputFd);
-    close(intermediateReader);
-    close(intermediateWriter);
+    // The compiler sizes the buffer of this eager in the next run of the region by its peak (see compiler/region_stats.py)
+    if (label != NULL) {
+        reportRegionStat("eager_peak %s %llu\n", label, buffer.peakBufferedBytes);
+    }
+    freeBuffer(&buffer);
 }
 
 int main(int argc, char* argv[]) {
     // arg#1 -> input file name
     // arg#2 -> output file name
-    // arg#3 -> intermediate file name
+    // arg#3 -> intermediate file name (only its directory is used, for the spill file)
+    // arg#4 -> (optional) buffer size in bytes, optionally followed by K, M, or G
+    // arg#5 -> (optional) a label with which the eager reports the most data that it buffered
     if (argc < 4) {
         printf("ERROR: missing input!\n");
         exit(1);
@@ -139,7 +133,13 @@ int main(int argc, char* argv[]) {
     char* intermediateFileName = calloc(strlen(argv[3]) + 1, sizeof(char));
     strcpy(intermediateFileName, argv[3]);
 
-    EagerLoop(inputFileName, outputFileName, intermediateFileName);
+    size_t bufferSize = DEFAULT_BUFFER_SIZE;
+    if (argc > 4) {
+        bufferSize = parseSize(argv[4]);
+    }
+    const char* label = argc > 5 ? argv[5] : NULL;
+
+    EagerLoop(inputFileName, outputFileName, intermediateFileName, bufferSize, label);
 
     return 0;
 }
@@ -3,6 +3,8 @@
 input=${1?"ERROR: Eager: No input file given"}
 output=${2?"ERROR: Eager: No output file given"}
 intermediate_file=${3?"ERROR: Eager: No intermediate file given"}
+buffer_size=$4
+label=$5
 
 # Set a default DISH_TOP in this directory if it doesn't exist
 PASH_TOP=${PASH_TOP:-$(git rev-parse --show-toplevel)}
@@ -17,5 +19,7 @@ PASH_TOP=${PASH_TOP:-$(git rev-parse --show-toplevel)}
 # $PASH_TOP/runtime/eager "$input" "$output" "$intermediate_file" &
 # eager_pid=$!
 # wait $eager_pid
-"$PASH_TOP"/runtime/eager "$input" "$output" "$intermediate_file"
-rm "$intermediate_file"
+"$PASH_TOP"/runtime/eager "$input" "$output" "$intermediate_file" ${buffer_size:+"$buffer_size"} ${label:+"$label"}
+# The eager only creates the intermediate file (unlinked) if its buffer fills up,
+#   but it might be left behind if the eager is killed before it unlinks it
+rm -f "$intermediate_file"
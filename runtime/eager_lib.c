@@ -283,7 +283,7 @@ ssize_t safeWriteOutput(int outputFd, int intermediateReader,
         printf("ERROR: %s, when outputing %ld bytes!\n", strerror(errno), intermediateFileDiff);
         exit(1);
     } else if (res == 0) {
-        debug("We tried to write %d, but output is done!\n", intermediateFileDiff);
+        debug("We tried to write %ld, but output is done!\n", (long) intermediateFileDiff);
         *doneWriting = 1;
     }
     return res;
@@ -302,3 +302,255 @@ void outputRestIntermediateFile(int outputFd, int intermediateWriter,
 
     return;
 }
+
+// The ring starts at the capacity of a pipe and doubles whenever it is full, up to its capacity
+#define INITIAL_RING_SIZE (64 * 1024)
+
+// Input that goes to the spill file is read in chunks of this size
+#define SPILL_BUFFER_SIZE (1024 * 1024)
+
+void initBuffer(eager_buffer_t* buffer, size_t ringCapacity, const char* spillPath) {
+    buffer->ringCapacity = MAX(ringCapacity, (size_t) INITIAL_RING_SIZE);
+    buffer->ringSize = INITIAL_RING_SIZE;
+    buffer->ring = malloc(buffer->ringSize);
+    if (buffer->ring == NULL) {
+        fprintf(stderr, "ERROR: could not allocate the eager buffer!\n");
+        exit(1);
+    }
+    buffer->ringStart = 0;
+    buffer->ringLength = 0;
+    buffer->peakRingLength = 0;
+    buffer->peakBufferedBytes = 0;
+    buffer->spillPath = spillPath;
+    buffer->spillFd = -1;
+    buffer->spillBuffer = NULL;
+    buffer->spillReadOffset = 0;
+    buffer->spillWriteOffset = 0;
+    buffer->spilledBytes = 0;
+}
+
+static off_t spillLength(const eager_buffer_t* buffer) {
+    return buffer->spillWriteOffset - buffer->spillReadOffset;
+}
+
+size_t bufferedBytes(const eager_buffer_t* buffer) {
+    return buffer->ringLength + spillLength(buffer);
+}
+
+// Doubles the ring (up to its capacity), moving its data to the start of the new one
+static void growRing(eager_buffer_t* buffer) {
+    size_t newSize = MIN(buffer->ringSize * 2, buffer->ringCapacity);
+    char* newRing = malloc(newSize);
+    if (newRing == NULL) {
+        fprintf(stderr, "ERROR: could not grow the eager buffer to %zu bytes!\n", newSize);
+        exit(1);
+    }
+    size_t firstPart = MIN(buffer->ringLength, buffer->ringSize - buffer->ringStart);
+    memcpy(newRing, buffer->ring + buffer->ringStart, firstPart);
+    memcpy(newRing + firstPart, buffer->ring, buffer->ringLength - firstPart);
+    free(buffer->ring);
+    buffer->ring = newRing;
+    buffer->ringSize = newSize;
+    buffer->ringStart = 0;
+}
+
+// Returns the free space of the ring that is right after its data (so that it can be filled with a single read)
+static char* ringFreeSpace(eager_buffer_t* buffer, size_t* freeBytes) {
+    if (buffer->ringLength == 0) {
+        buffer->ringStart = 0;
+    }
+    size_t end = (buffer->ringStart + buffer->ringLength) % buffer->ringSize;
+    if (end < buffer->ringStart || buffer->ringLength == buffer->ringSize) {
+        *freeBytes = buffer->ringStart - end;
+    } else {
+        *freeBytes = buffer->ringSize - end;
+    }
+    return buffer->ring + end;
+}
+
+static void addToRing(eager_buffer_t* buffer, size_t bytes) {
+    buffer->ringLength += bytes;
+    buffer->peakRingLength = MAX(buffer->peakRingLength, buffer->ringLength);
+}
+
+// Creates the spill file, preferably without a name (with O_TMPFILE), so that it is removed
+// when the eager node exits, however it exits.
+static void openSpillFile(eager_buffer_t* buffer) {
+#ifdef O_TMPFILE
+    char* directory = strdup(buffer->spillPath);
+    char* slash = strrchr(directory, '/');
+    if (slash == NULL) {
+        strcpy(directory, ".");
+    } else if (slash == directory) {
+        slash[1] = '\0';
+    } else {
+        slash[0] = '\0';
+    }
+    buffer->spillFd = open(directory, O_TMPFILE | O_RDWR, S_IRUSR | S_IWUSR);
+    free(directory);
+#endif
+    // The file system might not support O_TMPFILE, in which case the file is unlinked right after it is created
+    if (buffer->spillFd < 0) {
+        buffer->spillFd = safeOpen3(buffer->spillPath, O_CREAT | O_TRUNC | O_RDWR, S_IRUSR | S_IWUSR);
+        unlink(buffer->spillPath);
+    }
+    buffer->spillBuffer = malloc(SPILL_BUFFER_SIZE);
+    if (buffer->spillBuffer == NULL) {
+        fprintf(stderr, "ERROR: could not allocate the spill buffer!\n");
+        exit(1);
+    }
+    debug("Spilling to a file in the directory of %s\n", buffer->spillPath);
+}
+
+static void appendToSpillFile(eager_buffer_t* buffer, const char* data, size_t bytes) {
+    while (bytes > 0) {
+        ssize_t res = pwrite(buffer->spillFd, data, bytes, buffer->spillWriteOffset);
+        if (res < 0) {
+            if (errno == EINTR) {
+                continue;
+            }
+            fprintf(stderr, "ERROR: %s, when writing to the spill file!\n", strerror(errno));
+            exit(1);
+        }
+        data += res;
+        bytes -= res;
+        buffer->spillWriteOffset += res;
+        buffer->spilledBytes += res;
+    }
+}
+
+// Moves the oldest data of the spill file to the free space of the ring
+static void refillRing(eager_buffer_t* buffer) {
+    size_t freeBytes;
+    char* freeSpace = ringFreeSpace(buffer, &freeBytes);
+    size_t bytes = MIN(freeBytes, (size_t) spillLength(buffer));
+    if (bytes == 0) {
+        return;
+    }
+    ssize_t res = pread(buffer->spillFd, freeSpace, bytes, buffer->spillReadOffset);
+    if (res <= 0) {
+        fprintf(stderr, "ERROR: %s, when reading back the spill file!\n",
+                res < 0 ? strerror(errno) : "unexpected end of file");
+        exit(1);
+    }
+    addToRing(buffer, res);
+    buffer->spillReadOffset += res;
+
+    // Once all of it is read back, the spill file starts over (and gives back its blocks)
+    if (spillLength(buffer) == 0) {
+        buffer->spillReadOffset = 0;
+        buffer->spillWriteOffset = 0;
+        if (ftruncate(buffer->spillFd, 0) < 0) {
+            fprintf(stderr, "ERROR: %s, when truncating the spill file!\n", strerror(errno));
+            exit(1);
+        }
+    }
+}
+
+// Returns the number of bytes read, or 0 if the input was done.
+ssize_t readInputToBuffer(eager_buffer_t* buffer, int inputFd) {
+    // The data that is read goes after the data in the spill file, if there is any
+    if (spillLength(buffer) == 0 && buffer->ringLength == buffer->ringSize
+        && buffer->ringSize < buffer->ringCapacity) {
+        growRing(buffer);
+    }
+    int toRing = spillLength(buffer) == 0 && buffer->ringLength < buffer->ringSize;
+
+    char* destination;
+    size_t bytes;
+    if (toRing) {
+        destination = ringFreeSpace(buffer, &bytes);
+    } else {
+        if (buffer->spillFd < 0) {
+            openSpillFile(buffer);
+        }
+        destination = buffer->spillBuffer;
+        bytes = SPILL_BUFFER_SIZE;
+    }
+
+    ssize_t res;
+    do {
+        res = read(inputFd, destination, bytes);
+    } while (res < 0 && errno == EINTR);
+    if (res < 0) {
+        fprintf(stderr, "ERROR: %s, when reading from the input!\n", strerror(errno));
+        exit(1);
+    }
+
+    if (toRing) {
+        addToRing(buffer, res);
+    } else {
+        appendToSpillFile(buffer, destination, res);
+    }
+    buffer->peakBufferedBytes = MAX(buffer->peakBufferedBytes, (unsigned long long) bufferedBytes(buffer));
+    return res;
+}
+
+// Writes the oldest buffered data to the output, and returns the number of bytes written
+// (0 if the output would block, or if it is done).
+ssize_t writeBufferToOutput(eager_buffer_t* buffer, int outputFd, int* doneWriting) {
+    if (spillLength(buffer) > 0) {
+        refillRing(buffer);
+    }
+    size_t bytes = MIN(buffer->ringLength, buffer->ringSize - buffer->ringStart);
+    if (bytes == 0) {
+        return 0;
+    }
+
+    ssize_t res = write(outputFd, buffer->ring + buffer->ringStart, bytes);
+    if (res < 0) {
+        if (errno == EAGAIN || errno == EINTR) {
+            return 0;
+        } else if (errno == EPIPE) {
+            debug("We tried to write %zu bytes, but output is done!\n", bytes);
+            *doneWriting = 1;
+            return 0;
+        }
+        fprintf(stderr, "ERROR: %s, when outputing %zu bytes!\n", strerror(errno), bytes);
+        exit(1);
+    }
+    buffer->ringStart = (buffer->ringStart + res) % buffer->ringSize;
+    buffer->ringLength -= res;
+    return res;
+}
+
+void freeBuffer(eager_buffer_t* buffer) {
+    debug("Peak memory: %zu bytes (a ring of %zu bytes, that held at most %zu bytes%s), spilled %llu bytes, buffered at most %llu bytes\n",
+          buffer->ringSize + (buffer->spillBuffer == NULL ? 0 : SPILL_BUFFER_SIZE),
+          buffer->ringSize, buffer->peakRingLength,
+          buffer->spillBuffer == NULL ? "" : ", and the spill buffer", buffer->spilledBytes,
+          buffer->peakBufferedBytes);
+    free(buffer->ring);
+    free(buffer->spillBuffer);
+    if (buffer->spillFd >= 0) {
+        close(buffer->spillFd);
+    }
+}
+
+// Parses a size in bytes, optionally followed by K, M, or G (as the buffer size of dgsh-tee)
+size_t parseSize(const char* string) {
+    char* end;
+    errno = 0;
+    unsigned long long size = strtoull(string, &end, 10);
+    if (errno != 0 || end == string) {
+        fprintf(stderr, "ERROR: invalid buffer size %s\n", string);
+        exit(1);
+    }
+    switch (*end) {
+    case 'G': case 'g':
+        size *= 1024;
+        /* fall through */
+    case 'M': case 'm':
+        size *= 1024;
+        /* fall through */
+    case 'K': case 'k':
+        size *= 1024;
+        end++;
+        break;
+    }
+    if (*end != '\0') {
+        fprintf(stderr, "ERROR: invalid buffer size %s\n", string);
+        exit(1);
+    }
+    return size;
+}
@@ -22,7 +22,7 @@
 #define __DEBUG__
 
 #ifdef DEBUG
-#define debug(fmt, ...) printf(fmt, ##__VA_ARGS__)
+#define debug(fmt, ...) fprintf(stderr, fmt, ##__VA_ARGS__)
 #else
 #define debug(fmt, ...) ((void)0)
 #endif
@@ -68,3 +68,36 @@ ssize_t safeWriteOutput(int outputFd, int intermediateReader,
 
 void outputRestIntermediateFile(int outputFd, int intermediateWriter,
                                 int intermediateReader, int* doneWriting);
+
+// The data that an eager node has read but not written yet. It is kept in an in-memory ring
+// (that grows up to its capacity), and once the ring is full, the rest is appended to a spill file,
+// which is read back into the ring (in order) as the ring is emptied.
+typedef struct eager_buffer {
+    char* ring;
+    size_t ringCapacity;
+    size_t ringSize;
+    size_t ringStart;
+    size_t ringLength;
+    size_t peakRingLength;
+    // The most data that was buffered at once, in the ring and in the spill file
+    unsigned long long peakBufferedBytes;
+    // The spill file is created (unlinked) in the directory of this path the first time that the ring fills up
+    const char* spillPath;
+    int spillFd;
+    char* spillBuffer;
+    off_t spillReadOffset;
+    off_t spillWriteOffset;
+    unsigned long long spilledBytes;
+} eager_buffer_t;
+
+void initBuffer(eager_buffer_t* buffer, size_t ringCapacity, const char* spillPath);
+
+size_t bufferedBytes(const eager_buffer_t* buffer);
+
+ssize_t readInputToBuffer(eager_buffer_t* buffer, int inputFd);
+
+ssize_t writeBufferToOutput(eager_buffer_t* buffer, int outputFd, int* doneWriting);
+
+void freeBuffer(eager_buffer_t* buffer);
+
+size_t parseSize(const char* string);
@@ -0,0 +1,521 @@
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+#include <stdbool.h>
+#include <unistd.h>
+#include <fcntl.h>
+#include <errno.h>
+#include <err.h>
+#include <signal.h>
+#include <spawn.h>
+#include <sys/resource.h>
+#include <sys/wait.h>
+
+#ifdef DEBUG
+#define PRINTDBG(fmt, ...) fprintf(stderr, fmt, ##__VA_ARGS__)
+#else
+#define PRINTDBG(fmt, ...)
+#endif
+
+#define PLAN_FD 3
+#define READ_BUFFER_SIZE (64 * 1024)
+
+extern char **environ;
+
+/*
+Runs a dataflow graph that the compiler gives as a plan on file descriptor 3 (see compiler/ir_to_executor.py),
+instead of a bash script that creates a fifo for every edge and runs every node in the background.
+
+The plan has one directive per line:
+  pipes <n>                   the number of anonymous pipes (one for every ephemeral edge)
+  node                        starts a new node
+  arg <string>                the next argument of the node (the first one is the command)
+  fd <target> <pipe> r|w      gives the read or the write end of a pipe to the node as its fd target
+  open <target> r|w <path>    opens a file (for reading, or truncated for writing) as the fd target of the node
+  stdin                       the node reads the stdin of the executor (otherwise its stdin is /dev/null,
+                              as for a command in the background)
+  sink                        the executor waits for this node
+  end
+Strings are percent-encoded, so that they don't contain spaces or newlines.
+
+The nodes are spawned with posix_spawnp. The pipes are kept above all the target fds and are closed on exec,
+so every node only gets the ends that it uses. posix_spawnp suspends the executor until the node is started,
+and opening a file might block (e.g., a named pipe, until another node of the graph opens its other end),
+so the nodes that open files are forked instead. When the sink exits, the nodes that are still running get
+a SIGPIPE (as in wait_for_output_and_sigpipe_rest.sh), and the executor exits with the exit status of the sink.
+*/
+
+typedef struct fd_action
+{
+  int target;
+  // The pipe whose end is given to the node, or -1 if a file is opened
+  int pipe;
+  bool write;
+  char *path;
+} fd_action_t;
+
+typedef struct node
+{
+  char **argv;
+  int argc;
+  int argvCapacity;
+  fd_action_t *fdActions;
+  int numFdActions;
+  int fdActionsCapacity;
+  bool inheritStdin;
+  bool sink;
+  pid_t pid;
+  bool running;
+} node_t;
+
+typedef struct plan
+{
+  int numPipes;
+  node_t *nodes;
+  int numNodes;
+  int nodesCapacity;
+} plan_t;
+
+char *readPlan(int fd)
+{
+  size_t size = 0;
+  size_t capacity = READ_BUFFER_SIZE;
+  char *buffer = malloc(capacity + 1);
+  for (;;)
+  {
+    if (size == capacity)
+    {
+      capacity *= 2;
+      buffer = realloc(buffer, capacity + 1);
+    }
+    ssize_t len = read(fd, buffer + size, capacity - size);
+    if (len < 0)
+    {
+      if (errno == EINTR)
+        continue;
+      err(2, "could not read the plan");
+    }
+    if (len == 0)
+      break;
+    size += len;
+  }
+  buffer[size] = '\0';
+  return buffer;
+}
+
+int hexValue(char c)
+{
+  if (c >= '0' && c <= '9')
+    return c - '0';
+  if (c >= 'a' && c <= 'f')
+    return c - 'a' + 10;
+  if (c >= 'A' && c <= 'F')
+    return c - 'A' + 10;
+  return -1;
+}
+
+// Decodes a percent-encoded string in place
+char *decodeString(char *string)
+{
+  char *out = string;
+  for (char *in = string; *in; in++)
+  {
+    if (*in == '%' && hexValue(in[1]) >= 0 && hexValue(in[2]) >= 0)
+    {
+      *out++ = (char)(hexValue(in[1]) * 16 + hexValue(in[2]));
+      in += 2;
+    }
+    else
+    {
+      *out++ = *in;
+    }
+  }
+  *out = '\0';
+  return string;
+}
+
+node_t *currentNode(plan_t *plan, int lineNumber)
+{
+  if (plan->numNodes == 0)
+    errx(2, "plan line %d: directive before the first node", lineNumber);
+  return &plan->nodes[plan->numNodes - 1];
+}
+
+void addArg(node_t *node, char *arg)
+{
+  // Keep room for the NULL at the end
+  if (node->argc + 1 >= node->argvCapacity)
+  {
+    node->argvCapacity = 2 * node->argvCapacity + 2;
+    node->argv = realloc(node->argv, sizeof(char *) * node->argvCapacity);
+  }
+  node->argv[node->argc++] = arg;
+  node->argv[node->argc] = NULL;
+}
+
+void addFdAction(node_t *node, fd_action_t action)
+{
+  if (node->numFdActions == node->fdActionsCapacity)
+  {
+    node->fdActionsCapacity = 2 * node->fdActionsCapacity + 2;
+    node->fdActions = realloc(node->fdActions, sizeof(fd_action_t) * node->fdActionsCapacity);
+  }
+  node->fdActions[node->numFdActions++] = action;
+}
+
+bool parseMode(char *mode, int lineNumber)
+{
+  if (mode && strcmp(mode, "r") == 0)
+    return false;
+  if (mode && strcmp(mode, "w") == 0)
+    return true;
+  errx(2, "plan line %d: expected r or w", lineNumber);
+}
+
+int parseTarget(char *target, int lineNumber)
+{
+  if (!target || atoi(target) < 0)
+    errx(2, "plan line %d: expected a target fd", lineNumber);
+  return atoi(target);
+}
+
+void parsePlan(char *text, plan_t *plan)
+{
+  memset(plan, 0, sizeof(plan_t));
+  bool ended = false;
+  int lineNumber = 0;
+  char *lineSave;
+  for (char *line = strtok_r(text, "\n", &lineSave); line; line = strtok_r(NULL, "\n", &lineSave))
+  {
+    lineNumber++;
+    char *tokenSave;
+    char *directive = strtok_r(line, " ", &tokenSave);
+    if (!directive)
+      continue;
+    if (strcmp(directive, "pipes") == 0)
+    {
+      char *numPipes = strtok_r(NULL, " ", &tokenSave);
+      plan->numPipes = numPipes ? atoi(numPipes) : 0;
+    }
+    else if (strcmp(directive, "node") == 0)
+    {
+      if (plan->numNodes == plan->nodesCapacity)
+      {
+        plan->nodesCapacity = 2 * plan->nodesCapacity + 1;
+        plan->nodes = realloc(plan->nodes, sizeof(node_t) * plan->nodesCapacity);
+      }
+      memset(&plan->nodes[plan->numNodes++], 0, sizeof(node_t));
+    }
+    else if (strcmp(directive, "arg") == 0)
+    {
+      char *arg = strtok_r(NULL, " ", &tokenSave);
+      addArg(currentNode(plan, lineNumber), decodeString(arg ? arg : ""));
+    }
+    else if (strcmp(directive, "fd") == 0)
+    {
+      fd_action_t action = {.path = NULL};
+      action.target = parseTarget(strtok_r(NULL, " ", &tokenSave), lineNumber);
+      char *pipe = strtok_r(NULL, " ", &tokenSave);
+      action.pipe = pipe ? atoi(pipe) : -1;
+      if (action.pipe < 0 || action.pipe >= plan->numPipes)
+        errx(2, "plan line %d: unknown pipe", lineNumber);
+      action.write = parseMode(strtok_r(NULL, " ", &tokenSave), lineNumber);
+      addFdAction(currentNode(plan, lineNumber), action);
+    }
+    else if (strcmp(directive, "open") == 0)
+    {
+      fd_action_t action = {.pipe = -1};
+      action.target = parseTarget(strtok_r(NULL, " ", &tokenSave), lineNumber);
+      action.write = parseMode(strtok_r(NULL, " ", &tokenSave), lineNumber);
+      char *path = strtok_r(NULL, " ", &tokenSave);
+      if (!path)
+        errx(2, "plan line %d: expected a path", lineNumber);
+      action.path = decodeString(path);
+      addFdAction(currentNode(plan, lineNumber), action);
+    }
+    else if (strcmp(directive, "stdin") == 0)
+    {
+      currentNode(plan, lineNumber)->inheritStdin = true;
+    }
+    else if (strcmp(directive, "sink") == 0)
+    {
+      currentNode(plan, lineNumber)->sink = true;
+    }
+    else if (strcmp(directive, "end") == 0)
+    {
+      ended = true;
+    }
+    else
+    {
+      errx(2, "plan line %d: unknown directive %s", lineNumber, directive);
+    }
+  }
+  if (!ended)
+    errx(2, "the plan was not complete");
+  for (int i = 0; i < plan->numNodes; i++)
+  {
+    if (plan->nodes[i].argc == 0)
+      errx(2, "node %d has no command", i);
+  }
+}
+
+// Returns the lowest fd above all the target fds of the nodes
+int getPipeFdBase(plan_t *plan)
+{
+  int base = PLAN_FD + 1;
+  for (int i = 0; i < plan->numNodes; i++)
+  {
+    for (int j = 0; j < plan->nodes[i].numFdActions; j++)
+    {
+      if (plan->nodes[i].fdActions[j].target >= base)
+        base = plan->nodes[i].fdActions[j].target + 1;
+    }
+  }
+  return base;
+}
+
+// Makes sure that all the pipes fit in the open file limit
+void raiseFdLimit(int maxFd)
+{
+  struct rlimit limit;
+  if (getrlimit(RLIMIT_NOFILE, &limit) < 0 || limit.rlim_cur == RLIM_INFINITY || limit.rlim_cur > maxFd)
+    return;
+  limit.rlim_cur = (limit.rlim_max == RLIM_INFINITY || limit.rlim_max > maxFd) ? maxFd + 1 : limit.rlim_max;
+  if (setrlimit(RLIMIT_NOFILE, &limit) < 0)
+    warn("could not raise the open file limit");
+}
+
+// Creates the pipes with both of their ends above base, so that they never clash with a target fd,
+// and closed on exec, so that a node only gets the ends that it dups
+int (*createPipes(int numPipes, int base))[2]
+{
+  int(*pipeFds)[2] = malloc(sizeof(int[2]) * (numPipes > 0 ? numPipes : 1));
+  raiseFdLimit(base + 2 * numPipes);
+  for (int i = 0; i < numPipes; i++)
+  {
+    int fds[2];
+    if (pipe(fds) < 0)
+      err(2, "pipe");
+    for (int end = 0; end < 2; end++)
+    {
+      pipeFds[i][end] = fcntl(fds[end], F_DUPFD_CLOEXEC, base);
+      if (pipeFds[i][end] < 0)
+        err(2, "could not move a pipe above fd %d", base);
+      close(fds[end]);
+    }
+  }
+  return pipeFds;
+}
+
+bool hasTarget(node_t *node, int target)
+{
+  for (int i = 0; i < node->numFdActions; i++)
+  {
+    if (node->fdActions[i].target == target)
+      return true;
+  }
+  return false;
+}
+
+bool opensFiles(node_t *node)
+{
+  for (int i = 0; i < node->numFdActions; i++)
+  {
+    if (node->fdActions[i].path)
+      return true;
+  }
+  return false;
+}
+
+// Forks a node that opens files (see above), and returns false if it could not be forked.
+// The child reports its own errors, and exits with the status that the shell would.
+bool forkNode(node_t *node, int (*pipeFds)[2], int numPipes)
+{
+  node->pid = fork();
+  if (node->pid < 0)
+  {
+    warn("fork");
+    return false;
+  }
+  if (node->pid > 0)
+  {
+    PRINTDBG("pash_executor: forked %s as %d\n", node->argv[0], node->pid);
+    node->running = true;
+    return true;
+  }
+
+  // The child gets its pipe ends and closes all the pipes before it opens any file, since the open might
+  // block until another node opens the same named pipe, and that node might wait for the end of a pipe.
+  for (int i = 0; i < node->numFdActions; i++)
+  {
+    fd_action_t *action = &node->fdActions[i];
+    if (!action->path && dup2(pipeFds[action->pipe][action->write ? 1 : 0], action->target) < 0)
+    {
+      warn("dup2");
+      _exit(1);
+    }
+  }
+  for (int i = 0; i < numPipes; i++)
+  {
+    close(pipeFds[i][0]);
+    close(pipeFds[i][1]);
+  }
+  for (int i = 0; i < node->numFdActions; i++)
+  {
+    fd_action_t *action = &node->fdActions[i];
+    if (!action->path)
+      continue;
+    int flags = action->write ? O_WRONLY | O_CREAT | O_TRUNC : O_RDONLY;
+    int fd = open(action->path, flags, 0666);
+    if (fd < 0)
+    {
+      warn("%s", action->path);
+      _exit(1);
+    }
+    if (fd != action->target)
+    {
+      if (dup2(fd, action->target) < 0)
+      {
+        warn("dup2");
+        _exit(1);
+      }
+      close(fd);
+    }
+  }
+  if (!node->inheritStdin && !hasTarget(node, STDIN_FILENO))
+  {
+    int fd = open("/dev/null", O_RDONLY);
+    if (fd < 0 || dup2(fd, STDIN_FILENO) < 0)
+    {
+      warn("/dev/null");
+      _exit(1);
+    }
+    close(fd);
+  }
+
+  execvp(node->argv[0], node->argv);
+  int execErrno = errno;
+  warnx("%s: %s", node->argv[0], execErrno == ENOENT ? "command not found" : strerror(execErrno));
+  _exit(execErrno == ENOENT ? 127 : 126);
+}
+
+// Spawns a node, and returns false if its command could not be started
+bool spawnNode(node_t *node, int (*pipeFds)[2], int numPipes)
+{
+  if (opensFiles(node))
+    return forkNode(node, pipeFds, numPipes);
+
+  posix_spawn_file_actions_t fileActions;
+  posix_spawn_file_actions_init(&fileActions);
+  for (int i = 0; i < node->numFdActions; i++)
+  {
+    fd_action_t *action = &node->fdActions[i];
+    if (action->path)
+    {
+      int flags = action->write ? O_WRONLY | O_CREAT | O_TRUNC : O_RDONLY;
+      posix_spawn_file_actions_addopen(&fileActions, action->target, action->path, flags, 0666);
+    }
+    else
+    {
+      posix_spawn_file_actions_adddup2(&fileActions, pipeFds[action->pipe][action->write ? 1 : 0], action->target);
+    }
+  }
+  if (!node->inheritStdin && !hasTarget(node, STDIN_FILENO))
+    posix_spawn_file_actions_addopen(&fileActions, STDIN_FILENO, "/dev/null", O_RDONLY, 0);
+
+  int ret = posix_spawnp(&node->pid, node->argv[0], &fileActions, NULL, node->argv, environ);
+  posix_spawn_file_actions_destroy(&fileActions);
+  if (ret != 0)
+  {
+    warnx("%s: %s", node->argv[0], ret == ENOENT ? "command not found" : strerror(ret));
+    return false;
+  }
+  PRINTDBG("pash_executor: spawned %s as %d\n", node->argv[0], node->pid);
+  node->running = true;
+  return true;
+}
+
+int exitStatus(int status)
+{
+  if (WIFEXITED(status))
+    return WEXITSTATUS(status);
+  if (WIFSIGNALED(status))
+    return 128 + WTERMSIG(status);
+  return 1;
+}
+
+node_t *findNode(plan_t *plan, pid_t pid)
+{
+  for (int i = 0; i < plan->numNodes; i++)
+  {
+    if (plan->nodes[i].running && plan->nodes[i].pid == pid)
+      return &plan->nodes[i];
+  }
+  return NULL;
+}
+
+int main(int argc, char *argv[])
+{
+  if (argc != 1)
+  {
+    fprintf(stderr, "usage: %s 3< plan\n", argv[0]);
+    exit(1);
+  }
+
+  plan_t plan;
+  char *text = readPlan(PLAN_FD);
+  close(PLAN_FD);
+  parsePlan(text, &plan);
+
+  int (*pipeFds)[2] = createPipes(plan.numPipes, getPipeFdBase(&plan));
+
+  node_t *sink = NULL;
+  int sinkStatus = 0;
+  for (int i = 0; i < plan.numNodes; i++)
+  {
+    node_t *node = &plan.nodes[i];
+    bool spawned = spawnNode(node, pipeFds, plan.numPipes);
+    if (node->sink)
+    {
+      sink = node;
+      if (!spawned)
+        sinkStatus = 127 << 8;
+    }
+  }
+
+  // The executor keeps no end of a pipe open, so that the nodes see the end of their inputs
+  for (int i = 0; i < plan.numPipes; i++)
+  {
+    close(pipeFds[i][0]);
+    close(pipeFds[i][1]);
+  }
+
+  while (sink && sink->running)
+  {
+    int status;
+    pid_t pid = waitpid(-1, &status, 0);
+    if (pid < 0)
+    {
+      if (errno == EINTR)
+        continue;
+      err(2, "waitpid");
+    }
+    node_t *node = findNode(&plan, pid);
+    if (!node)
+      continue;
+    node->running = false;
+    if (node == sink)
+      sinkStatus = status;
+  }
+
+  // The rest of the graph is not needed anymore
+  for (int i = 0; i < plan.numNodes; i++)
+  {
+    if (plan.nodes[i].running)
+      kill(plan.nodes[i].pid, SIGPIPE);
+  }
+  while (waitpid(-1, NULL, WNOHANG) > 0)
+    ;
+
+  return exitStatus(sinkStatus);
+}
@@ -0,0 +1,269 @@
+#include "r_split.h"
+
+/*
+Reorder buffer for the blocks of a round robin parallelization (used by r_merge and r_repartition).
+
+r_split sends each block to whichever of its outputs is writable, so block k is not necessarily on input k % n.
+Blocks are read from whichever input has data, and are emitted in id order: the block with the next id
+is emitted as soon as it is read, and blocks that are ahead are kept in memory until their turn.
+The parts of a block (see r_wrap) are always on the same input, in order, and the ids on each input are increasing.
+
+A block that is next when its header is read is given to moveChunk (if there is one) with the input it is on,
+so that its data can be moved without reading it (see moveBytes), and it is read and given to emitChunk otherwise.
+
+Once REORDER_BUFFER_SIZE bytes are buffered, the inputs that are ahead are not read any further
+(which eventually stops r_split from sending them more blocks), unless no input could make progress otherwise.
+*/
+
+#define REORDER_BUFFER_SIZE (64 * CHUNKSIZE)
+
+// Called for the parts of each block in id order (isLast is set on the last part of a block)
+typedef void (*emit_chunk_t)(void *ctx, int64_t id, char *data, size_t size, bool isLast);
+// Called instead of emitChunk for a part that is next, which is still to be read from inputFd
+typedef void (*move_chunk_t)(void *ctx, int64_t id, int inputFd, size_t size, bool isLast);
+
+typedef struct reorder_input
+{
+  int fd;
+  bool eof;
+  // The header of the next chunk has been read, but not its data
+  bool hasHeader;
+  block_header header;
+} reorder_input_t;
+
+typedef struct buffered_block
+{
+  int64_t id;
+  char *data;
+  size_t size;
+  bool complete;
+} buffered_block_t;
+
+typedef struct reorder_buffer
+{
+  buffered_block_t *blocks;
+  unsigned int numBlocks;
+  unsigned int capacity;
+  size_t bufferedBytes;
+} reorder_buffer_t;
+
+int findBufferedBlock(reorder_buffer_t *reorderBuffer, int64_t id)
+{
+  for (int i = 0; i < reorderBuffer->numBlocks; i++)
+  {
+    if (reorderBuffer->blocks[i].id == id)
+      return i;
+  }
+  return -1;
+}
+
+void bufferChunk(reorder_buffer_t *reorderBuffer, int64_t id, char *data, size_t size, bool isLast)
+{
+  int idx = findBufferedBlock(reorderBuffer, id);
+  if (idx < 0)
+  {
+    if (reorderBuffer->numBlocks == reorderBuffer->capacity)
+    {
+      reorderBuffer->capacity = 2 * reorderBuffer->capacity + 1;
+      reorderBuffer->blocks = realloc(reorderBuffer->blocks, sizeof(buffered_block_t) * reorderBuffer->capacity);
+    }
+    idx = reorderBuffer->numBlocks++;
+    reorderBuffer->blocks[idx].id = id;
+    reorderBuffer->blocks[idx].data = NULL;
+    reorderBuffer->blocks[idx].size = 0;
+  }
+  buffered_block_t *block = &reorderBuffer->blocks[idx];
+  block->data = realloc(block->data, block->size + size + 1);
+  memcpy(block->data + block->size, data, size);
+  block->size += size;
+  block->complete = isLast;
+  reorderBuffer->bufferedBytes += size;
+}
+
+// Emits the buffered blocks that are next in order, and returns the id of the next block
+int64_t emitBufferedBlocks(reorder_buffer_t *reorderBuffer, int64_t nextID, emit_chunk_t emitChunk, void *ctx)
+{
+  int idx;
+  while ((idx = findBufferedBlock(reorderBuffer, nextID)) >= 0)
+  {
+    buffered_block_t block = reorderBuffer->blocks[idx];
+    reorderBuffer->blocks[idx] = reorderBuffer->blocks[--reorderBuffer->numBlocks];
+    reorderBuffer->bufferedBytes -= block.size;
+    emitChunk(ctx, block.id, block.data, block.size, block.complete);
+    free(block.data);
+    // The rest of the block is still to be read from its input
+    if (!block.complete)
+      break;
+    nextID += 1;
+  }
+  return nextID;
+}
+
+void readChunkHeader(reorder_input_t *input)
+{
+  size_t len = readFull(input->fd, (char *)&input->header, sizeof(block_header));
+  if (len == 0)
+  {
+    input->eof = 1;
+    return;
+  }
+  if (len < sizeof(block_header))
+  {
+    PRINTDBG("Pipe closed before the full block header was written");
+    exit(0);
+  }
+  input->hasHeader = 1;
+}
+
+// Reads the data of the chunk whose header has been read from an input,
+// and either emits it (if it is next) or buffers it. Returns the id of the next block.
+int64_t readChunk(reorder_input_t *input, char **chunk, size_t *chunkLen, reorder_buffer_t *reorderBuffer,
+                  int64_t nextID, emit_chunk_t emitChunk, move_chunk_t moveChunk, void *ctx)
+{
+  block_header *header = &input->header;
+
+  // The earlier parts of the block might have been buffered before it was next
+  if (header->id == nextID)
+    nextID = emitBufferedBlocks(reorderBuffer, nextID, emitChunk, ctx);
+
+  if (header->id == nextID && moveChunk)
+  {
+    input->hasHeader = 0;
+    moveChunk(ctx, header->id, input->fd, header->blockSize, header->isLast);
+    if (header->isLast)
+      nextID += 1;
+    return nextID;
+  }
+
+  if (header->blockSize > *chunkLen)
+  {
+    *chunkLen = header->blockSize;
+    *chunk = realloc(*chunk, *chunkLen + 1);
+  }
+  if (readFull(input->fd, *chunk, header->blockSize) != header->blockSize)
+  {
+    PRINTDBG("Pipe closed before the full block data was written");
+    exit(0);
+  }
+  input->hasHeader = 0;
+
+  if (header->id == nextID)
+  {
+    emitChunk(ctx, header->id, *chunk, header->blockSize, header->isLast);
+    if (header->isLast)
+      nextID += 1;
+  }
+  else
+  {
+    bufferChunk(reorderBuffer, header->id, *chunk, header->blockSize, header->isLast);
+  }
+  return nextID;
+}
+
+void ReorderBlocks(char *inputFileNames[], unsigned int numInputFiles, emit_chunk_t emitChunk, move_chunk_t moveChunk,
+                   void *ctx)
+{
+  reorder_input_t *inputs = malloc(sizeof(reorder_input_t) * numInputFiles);
+  struct pollfd *pollFds = malloc(sizeof(struct pollfd) * numInputFiles);
+  int *pollInputIdx = malloc(sizeof(int) * numInputFiles);
+  reorder_buffer_t reorderBuffer = {NULL, 0, 0, 0};
+  size_t chunkLen = BUFLEN;
+  char *chunk = malloc(chunkLen + 1);
+  int64_t nextID = 0;
+
+  for (int i = 0; i < numInputFiles; i++)
+  {
+    inputs[i].fd = open(inputFileNames[i], O_RDONLY);
+    if (inputs[i].fd < 0)
+    {
+      perror(LOC);
+      exit(1);
+    }
+    inputs[i].eof = 0;
+    inputs[i].hasHeader = 0;
+  }
+
+  for (;;)
+  {
+    nextID = emitBufferedBlocks(&reorderBuffer, nextID, emitChunk, ctx);
+
+    // Read the chunks whose headers have been read, if they are next or fit in the buffer
+    bool progress = 0;
+    for (int i = 0; i < numInputFiles; i++)
+    {
+      if (!inputs[i].hasHeader)
+        continue;
+      if (inputs[i].header.id != nextID
+          && reorderBuffer.bufferedBytes + inputs[i].header.blockSize > REORDER_BUFFER_SIZE)
+        continue;
+      nextID = readChunk(&inputs[i], &chunk, &chunkLen, &reorderBuffer, nextID, emitChunk, moveChunk, ctx);
+      progress = 1;
+    }
+
+    // Wait for the headers of the inputs that have none
+    int numPollFds = 0;
+    for (int i = 0; i < numInputFiles; i++)
+    {
+      if (inputs[i].eof || inputs[i].hasHeader)
+        continue;
+      pollFds[numPollFds].fd = inputs[i].fd;
+      pollFds[numPollFds].events = POLLIN;
+      pollInputIdx[numPollFds] = i;
+      numPollFds++;
+    }
+    if (numPollFds > 0)
+    {
+      // Don't block if there might be more to emit
+      if (poll(pollFds, numPollFds, progress ? 0 : -1) < 0)
+      {
+        if (errno == EINTR)
+          continue;
+        err(2, "poll failed");
+      }
+      for (int i = 0; i < numPollFds; i++)
+      {
+        if (pollFds[i].revents)
+          readChunkHeader(&inputs[pollInputIdx[i]]);
+      }
+      continue;
+    }
+    if (progress)
+      continue;
+
+    // All inputs have ended or are ahead and the buffer is full,
+    // so the chunk with the smallest id is buffered anyway.
+    int minIdx = -1;
+    for (int i = 0; i < numInputFiles; i++)
+    {
+      if (inputs[i].hasHeader && (minIdx < 0 || inputs[i].header.id < inputs[minIdx].header.id))
+        minIdx = i;
+    }
+    if (minIdx < 0)
+      break;
+    PRINTDBG("r_reorder: buffering block %ld over the limit", inputs[minIdx].header.id);
+    nextID = readChunk(&inputs[minIdx], &chunk, &chunkLen, &reorderBuffer, nextID, emitChunk, moveChunk, ctx);
+  }
+
+  // If some ids are missing, emit the rest of the blocks in order anyway
+  while (reorderBuffer.numBlocks > 0)
+  {
+    int minIdx = 0;
+    for (int i = 1; i < reorderBuffer.numBlocks; i++)
+    {
+      if (reorderBuffer.blocks[i].id < reorderBuffer.blocks[minIdx].id)
+        minIdx = i;
+    }
+    nextID = emitBufferedBlocks(&reorderBuffer, reorderBuffer.blocks[minIdx].id, emitChunk, ctx);
+  }
+
+  //clean up
+  for (int i = 0; i < numInputFiles; i++)
+  {
+    close(inputs[i].fd);
+  }
+  free(inputs);
+  free(pollFds);
+  free(pollInputIdx);
+  free(reorderBuffer.blocks);
+  free(chunk);
+}
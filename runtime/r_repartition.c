@@ -0,0 +1,86 @@
+#include "r_reorder.h"
+
+/*
+Moves the blocks of a round robin parallelization from n streams to m streams,
+so that two round robin parallelized nodes with different widths can be connected
+without merging and re-splitting the stream.
+
+Blocks are read from the inputs in id order (see r_reorder.h), and each block is written,
+with its headers, to an output that is writable (like r_split does), so that r_merge
+after the next node can put them back in order.
+*/
+
+typedef struct repartition_outputs
+{
+  FILE **outputFiles;
+  struct pollfd *pollFds;
+  unsigned int numOutputFiles;
+  int outputIdx;
+  // The parts of a block (e.g., the outputs of r_wrap) all go to the same output
+  bool blockIsOpen;
+} repartition_outputs_t;
+
+void writeChunkToOutput(void *ctx, int64_t id, char *data, size_t size, bool isLast)
+{
+  repartition_outputs_t *outputs = ctx;
+  if (!outputs->blockIsOpen)
+    outputs->outputIdx = pollWritableOutput(outputs->pollFds, outputs->numOutputFiles, outputs->outputIdx);
+  FILE *outputFile = outputs->outputFiles[outputs->outputIdx];
+  writeHeader(outputFile, id, size, isLast);
+  safeWriteWithFlush(data, 1, size, outputFile);
+  outputs->blockIsOpen = !isLast;
+}
+
+void RepartitionInput(char *inputFileNames[], unsigned int numInputFiles,
+                      char *outputFileNames[], unsigned int numOutputFiles)
+{
+  repartition_outputs_t outputs;
+  outputs.outputFiles = malloc(sizeof(FILE *) * numOutputFiles);
+  outputs.pollFds = malloc(sizeof(struct pollfd) * numOutputFiles);
+  outputs.numOutputFiles = numOutputFiles;
+  outputs.outputIdx = numOutputFiles - 1;
+  outputs.blockIsOpen = 0;
+
+  for (int i = 0; i < numOutputFiles; i++)
+  {
+    outputs.outputFiles[i] = fopen(outputFileNames[i], "w");
+    if (!outputs.outputFiles[i])
+    {
+      perror(LOC);
+      exit(1);
+    }
+    outputs.pollFds[i].fd = fileno(outputs.outputFiles[i]);
+  }
+
+  ReorderBlocks(inputFileNames, numInputFiles, writeChunkToOutput, NULL, &outputs);
+
+  //clean up
+  for (int i = 0; i < numOutputFiles; i++)
+  {
+    fclose(outputs.outputFiles[i]);
+  }
+  free(outputs.outputFiles);
+  free(outputs.pollFds);
+}
+
+int main(int argc, char *argv[])
+{
+  // arg#1 -> number of inputs, args#2... -> input file names followed by output file names
+  if (argc < 4)
+  {
+    fprintf(stderr, "usage: %s num_inputs input_1 ... input_n output_1 ... output_m\n", argv[0]);
+    exit(1);
+  }
+
+  int numInputFiles = atoi(argv[1]);
+  int numOutputFiles = argc - 2 - numInputFiles;
+  if (numInputFiles < 1 || numOutputFiles < 1)
+  {
+    fprintf(stderr, "r_repartition: needs at least one input and one output!\n");
+    exit(1);
+  }
+
+  RepartitionInput(argv + 2, numInputFiles, argv + 2 + numInputFiles, numOutputFiles);
+
+  return 0;
+}
@@ -1,28 +1,475 @@
 #include "r_split.h"
+#include "region_stats.h"
 #include "stdbool.h"
+#include <time.h>
+
+/*
+Each block is sent to an output whose reader keeps up with it (see pollWritableOutput),
+so a slow mapper doesn't stall the others. Blocks are tagged with increasing ids,
+which r_merge uses to put them back in order.
+
+With -a, the batch size is tuned while splitting (see tuneBatchSize). It starts at the minimum
+batch size (-m) to spread the work quickly, and then follows the observed throughput so that
+each output gets a block about every target block time (the -a argument, which the compiler picks
+depending on the per block overhead of the mappers). Faster mappers get bigger blocks (fewer block overheads),
+and slower mappers get smaller blocks (better balance). The batch size also grows for long lines,
+and stays small enough to give a few blocks to every output if the input is a file.
+*/
+
+/*
+With -e, each output has its own queue (instead of an eager node after it). Blocks are appended to the queues,
+and written out whenever their outputs are writable, in the same poll loop that waits for the input,
+so r_split keeps reading its input even if the readers of its outputs don't.
+A queue is kept in memory up to OUTPUT_MEMORY_LIMIT bytes, and the rest of it goes to a temporary file.
+A new block goes to the output with the shortest queue, which is the one whose reader keeps up best.
+*/
+
+/*
+With -s, the input is the stdin of the region, and the number of bytes read from it is reported
+(see region_stats.h) once all of it is split, so that the compiler knows the size of a piped stdin
+the next time it compiles the region.
+*/
+
+#define DEFAULT_MIN_BATCH_SIZE (64 * 1024)
+// The throughput is measured over windows of at least this time (in seconds)
+#define TUNING_WINDOW_TIME 0.005
+// The weight of the last window in the throughput estimate
+#define THROUGHPUT_SMOOTHING 0.5
+#define MIN_BLOCKS_PER_OUTPUT 4
+#define OUTPUT_MEMORY_LIMIT (4 * CHUNKSIZE)
+
+typedef struct batch_tuner
+{
+  size_t batchSize;
+  size_t minBatchSize;
+  size_t maxBatchSize;
+  // In seconds, or 0 if the batch size is static
+  double targetBlockTime;
+  // Bytes per second, or 0 before the first window
+  double throughput;
+  size_t windowBytes;
+  double windowStart;
+} batch_tuner_t;
+
+double nowSeconds()
+{
+  struct timespec ts;
+  clock_gettime(CLOCK_MONOTONIC, &ts);
+  return ts.tv_sec + ts.tv_nsec / 1e9;
+}
 
-void SplitByBytes(FILE *inputFile, int batchSize, FILE *outputFiles[], unsigned int numOutputFiles)
+void initBatchTuner(batch_tuner_t *tuner, size_t batchSize, size_t minBatchSize, double targetBlockTime)
 {
-  int current_file_id = 0;
+  tuner->maxBatchSize = batchSize;
+  tuner->targetBlockTime = targetBlockTime;
+  if (targetBlockTime > 0 && minBatchSize < batchSize)
+    tuner->minBatchSize = minBatchSize > 0 ? minBatchSize : 1;
+  else
+  {
+    tuner->minBatchSize = batchSize;
+    tuner->targetBlockTime = 0;
+  }
+  tuner->batchSize = tuner->minBatchSize;
+  tuner->throughput = 0;
+  tuner->windowBytes = 0;
+  tuner->windowStart = nowSeconds();
+}
+
+size_t clampBatchSize(batch_tuner_t *tuner, size_t batchSize)
+{
+  if (batchSize < tuner->minBatchSize)
+    return tuner->minBatchSize;
+  if (batchSize > tuner->maxBatchSize)
+    return tuner->maxBatchSize;
+  return batchSize;
+}
+
+// Called after each block that is read
+void tuneBatchSize(batch_tuner_t *tuner, size_t len, unsigned int numOutputFiles)
+{
+  if (tuner->targetBlockTime == 0)
+    return;
+  tuner->windowBytes += len;
+  double now = nowSeconds();
+  double elapsed = now - tuner->windowStart;
+  if (elapsed < TUNING_WINDOW_TIME)
+    return;
+
+  // Writing to the outputs blocks when the mappers don't keep up,
+  // so this is the rate at which the slower of the input and the mappers goes
+  double throughput = tuner->windowBytes / elapsed;
+  if (tuner->throughput == 0)
+    tuner->throughput = throughput;
+  else
+    tuner->throughput = THROUGHPUT_SMOOTHING * throughput + (1 - THROUGHPUT_SMOOTHING) * tuner->throughput;
+  tuner->windowBytes = 0;
+  tuner->windowStart = now;
+
+  size_t batchSize = tuner->throughput * tuner->targetBlockTime / numOutputFiles;
+  tuner->batchSize = clampBatchSize(tuner, batchSize);
+  PRINTDBG("r_split: throughput %.0f B/s, batch size %zu\n", tuner->throughput, tuner->batchSize);
+}
+
+// Called when a batch has no line boundary in its second half, so that blocks are a few lines long
+void growBatchForLongLine(batch_tuner_t *tuner, size_t len)
+{
+  if (tuner->targetBlockTime == 0)
+    return;
+  if (2 * len > tuner->minBatchSize)
+    tuner->minBatchSize = 2 * len < tuner->maxBatchSize ? 2 * len : tuner->maxBatchSize;
+  tuner->batchSize = clampBatchSize(tuner, tuner->batchSize);
+}
+
+// Keeps a few blocks for every output if the size of the input is known
+void limitBatchToInputSize(batch_tuner_t *tuner, FILE *inputFile, unsigned int numOutputFiles)
+{
+  struct stat buf;
+  if (tuner->targetBlockTime == 0 || fstat(fileno(inputFile), &buf) < 0 || !S_ISREG(buf.st_mode))
+    return;
+  size_t inputLimit = buf.st_size / (numOutputFiles * MIN_BLOCKS_PER_OUTPUT);
+  if (inputLimit < tuner->maxBatchSize)
+    tuner->maxBatchSize = inputLimit > tuner->minBatchSize ? inputLimit : tuner->minBatchSize;
+}
+
+typedef struct output_queue
+{
+  char *memory;
+  size_t memoryStart;
+  size_t memoryEnd;
+  // The temporary file that the rest of the queue goes to (-1 until it is needed)
+  int spillFd;
+  off_t spillStart;
+  off_t spillEnd;
+} output_queue_t;
+
+typedef struct split_outputs
+{
+  unsigned int numOutputFiles;
+  FILE **files;
+  struct pollfd *pollFds;
+  // Only with -e
+  output_queue_t *queues;
+  struct pollfd *servicePollFds;
+  int *serviceOutputIdx;
+  char *spillBuffer;
+} split_outputs_t;
+
+typedef struct split_input
+{
+  FILE *file;
+  bool eof;
+  uint64_t bytesRead;
+} split_input_t;
+
+split_outputs_t *openSplitOutputs(char *outputFileNames[], unsigned int numOutputFiles, bool buffered)
+{
+  split_outputs_t *outputs = malloc(sizeof(split_outputs_t));
+  outputs->numOutputFiles = numOutputFiles;
+  outputs->files = malloc(sizeof(FILE *) * numOutputFiles);
+  outputs->pollFds = malloc(sizeof(struct pollfd) * numOutputFiles);
+  outputs->queues = NULL;
+  for (int i = 0; i < numOutputFiles; i++)
+  {
+    outputs->files[i] = fopen(outputFileNames[i], "w");
+    if (!outputs->files[i])
+    {
+      perror(LOC);
+      exit(1);
+    }
+    outputs->pollFds[i].fd = fileno(outputs->files[i]);
+  }
+
+  if (buffered)
+  {
+    outputs->queues = calloc(numOutputFiles, sizeof(output_queue_t));
+    // One more for the input
+    outputs->servicePollFds = malloc(sizeof(struct pollfd) * (numOutputFiles + 1));
+    outputs->serviceOutputIdx = malloc(sizeof(int) * (numOutputFiles + 1));
+    outputs->spillBuffer = malloc(BUFLEN);
+    for (int i = 0; i < numOutputFiles; i++)
+    {
+      outputs->queues[i].spillFd = -1;
+      non_block_fd(fileno(outputs->files[i]), outputFileNames[i]);
+    }
+  }
+  return outputs;
+}
+
+size_t queueLength(output_queue_t *queue)
+{
+  return (queue->memoryEnd - queue->memoryStart) + (queue->spillEnd - queue->spillStart);
+}
+
+void spillToFile(output_queue_t *queue, char *data, size_t size)
+{
+  if (queue->spillFd < 0)
+  {
+    char *tmpDir = getenv("TMPDIR");
+    char path[4096];
+    snprintf(path, sizeof(path), "%s/pash_r_split_XXXXXX", tmpDir && *tmpDir ? tmpDir : "/tmp");
+    queue->spillFd = mkstemp(path);
+    if (queue->spillFd < 0)
+      err(2, "could not create a temporary file %s", path);
+    // The file is removed as soon as it is closed (or r_split exits)
+    unlink(path);
+  }
+  size_t written = 0;
+  while (written < size)
+  {
+    ssize_t ret = pwrite(queue->spillFd, data + written, size - written, queue->spillEnd);
+    if (ret < 0)
+    {
+      if (errno == EINTR)
+        continue;
+      err(2, "write to temporary file failed");
+    }
+    written += ret;
+    queue->spillEnd += ret;
+  }
+}
+
+void enqueue(output_queue_t *queue, char *data, size_t size)
+{
+  // If some of the queue is in the temporary file, the rest of it goes there too
+  if (queue->spillStart == queue->spillEnd)
+  {
+    if (queue->memoryStart > 0 && queue->memoryEnd + size > OUTPUT_MEMORY_LIMIT)
+    {
+      memmove(queue->memory, queue->memory + queue->memoryStart, queue->memoryEnd - queue->memoryStart);
+      queue->memoryEnd -= queue->memoryStart;
+      queue->memoryStart = 0;
+    }
+    if (queue->memoryEnd + size <= OUTPUT_MEMORY_LIMIT)
+    {
+      if (!queue->memory)
+        queue->memory = malloc(OUTPUT_MEMORY_LIMIT);
+      memcpy(queue->memory + queue->memoryEnd, data, size);
+      queue->memoryEnd += size;
+      return;
+    }
+  }
+  spillToFile(queue, data, size);
+}
+
+// Returns whether the write can go on
+bool checkQueueWrite(ssize_t ret)
+{
+  if (ret >= 0)
+    return 1;
+  if (errno == EINTR)
+    return 1;
+  if (errno == EAGAIN || errno == EWOULDBLOCK)
+    return 0;
+  // Reader terminated early
+  if (errno == EPIPE)
+    exit(EXIT_SUCCESS);
+  err(2, "write failed");
+}
+
+// Writes as much of the queue as the output takes without blocking
+void drainQueue(output_queue_t *queue, int outputFd, char *spillBuffer)
+{
+  while (queue->memoryStart < queue->memoryEnd)
+  {
+    ssize_t ret = write(outputFd, queue->memory + queue->memoryStart, queue->memoryEnd - queue->memoryStart);
+    if (!checkQueueWrite(ret))
+      return;
+    if (ret > 0)
+      queue->memoryStart += ret;
+  }
+  queue->memoryStart = queue->memoryEnd = 0;
+
+  while (queue->spillStart < queue->spillEnd)
+  {
+    size_t size = queue->spillEnd - queue->spillStart < BUFLEN ? queue->spillEnd - queue->spillStart : BUFLEN;
+    ssize_t len = pread(queue->spillFd, spillBuffer, size, queue->spillStart);
+    if (len <= 0)
+      err(2, "read from temporary file failed");
+    ssize_t ret = write(outputFd, spillBuffer, len);
+    if (!checkQueueWrite(ret))
+      return;
+    if (ret > 0)
+      queue->spillStart += ret;
+  }
+  if (queue->spillEnd > 0)
+  {
+    // The queue can go back to memory
+    if (ftruncate(queue->spillFd, 0) < 0)
+      err(2, "could not truncate temporary file");
+    queue->spillStart = queue->spillEnd = 0;
+  }
+}
+
+// Writes out the queues while waiting for the input to be readable,
+// or, if inputFd is negative, until all of them are written out
+void serviceOutputs(split_outputs_t *outputs, int inputFd)
+{
+  struct pollfd *pollFds = outputs->servicePollFds;
+  for (;;)
+  {
+    int numPollFds = 0;
+    if (inputFd >= 0)
+    {
+      pollFds[numPollFds].fd = inputFd;
+      pollFds[numPollFds].events = POLLIN;
+      outputs->serviceOutputIdx[numPollFds++] = -1;
+    }
+    for (int i = 0; i < outputs->numOutputFiles; i++)
+    {
+      if (queueLength(&outputs->queues[i]) == 0)
+        continue;
+      pollFds[numPollFds].fd = fileno(outputs->files[i]);
+      pollFds[numPollFds].events = POLLOUT;
+      outputs->serviceOutputIdx[numPollFds++] = i;
+    }
+    if (numPollFds == 0)
+      return;
+
+    if (poll(pollFds, numPollFds, -1) < 0)
+    {
+      if (errno == EINTR)
+        continue;
+      err(2, "poll failed");
+    }
+    bool inputReady = 0;
+    for (int i = 0; i < numPollFds; i++)
+    {
+      if (!pollFds[i].revents)
+        continue;
+      int idx = outputs->serviceOutputIdx[i];
+      if (idx < 0)
+        inputReady = 1;
+      else
+        drainQueue(&outputs->queues[idx], pollFds[i].fd, outputs->spillBuffer);
+    }
+    if (inputReady)
+      return;
+  }
+}
+
+// Returns the output for the next block
+int nextOutput(split_outputs_t *outputs, int prevIdx)
+{
+  if (!outputs->queues)
+    return pollWritableOutput(outputs->pollFds, outputs->numOutputFiles, prevIdx);
+
+  int bestIdx = -1;
+  size_t bestLength = 0;
+  for (int i = 1; i <= outputs->numOutputFiles; i++)
+  {
+    int idx = (prevIdx + i) % outputs->numOutputFiles;
+    size_t length = queueLength(&outputs->queues[idx]);
+    if (bestIdx < 0 || length < bestLength)
+    {
+      bestIdx = idx;
+      bestLength = length;
+    }
+  }
+  return bestIdx;
+}
+
+void writeBlockHeader(split_outputs_t *outputs, int idx, int64_t id, size_t blockSize, bool isLast)
+{
+  if (!outputs->queues)
+  {
+    writeHeader(outputs->files[idx], id, blockSize, isLast);
+    return;
+  }
+  block_header header = {id, blockSize, isLast};
+  enqueue(&outputs->queues[idx], (char *)&header, sizeof(block_header));
+}
+
+// The output is flushed at the end of each write to it, so that polling it is accurate
+void writeToOutput(split_outputs_t *outputs, int idx, char *data, size_t size, bool flush)
+{
+  if (outputs->queues)
+    enqueue(&outputs->queues[idx], data, size);
+  else if (flush)
+    safeWriteWithFlush(data, 1, size, outputs->files[idx]);
+  else
+    safeWrite(data, 1, size, outputs->files[idx]);
+}
+
+// Reads up to size bytes (and less only at the end of the input)
+size_t readInput(split_input_t *input, char *buffer, size_t size, split_outputs_t *outputs)
+{
+  if (!outputs->queues)
+  {
+    size_t len = fread(buffer, 1, size, input->file);
+    input->eof = feof(input->file);
+    input->bytesRead += len;
+    return len;
+  }
+
+  int inputFd = fileno(input->file);
+  size_t tot_read = 0;
+  while (tot_read < size && !input->eof)
+  {
+    serviceOutputs(outputs, inputFd);
+    ssize_t len = read(inputFd, buffer + tot_read, size - tot_read);
+    if (len < 0)
+    {
+      if (errno == EINTR)
+        continue;
+      err(2, "read failed");
+    }
+    if (len == 0)
+      input->eof = 1;
+    tot_read += len;
+  }
+  input->bytesRead += tot_read;
+  return tot_read;
+}
+
+void closeSplitOutputs(split_outputs_t *outputs)
+{
+  if (outputs->queues)
+  {
+    serviceOutputs(outputs, -1);
+    for (int i = 0; i < outputs->numOutputFiles; i++)
+    {
+      if (outputs->queues[i].spillFd >= 0)
+        close(outputs->queues[i].spillFd);
+      free(outputs->queues[i].memory);
+    }
+    free(outputs->queues);
+    free(outputs->servicePollFds);
+    free(outputs->serviceOutputIdx);
+    free(outputs->spillBuffer);
+  }
+  // need to close all output files
+  for (int i = 0; i < outputs->numOutputFiles; i++)
+  {
+    fclose(outputs->files[i]);
+  }
+  free(outputs->files);
+  free(outputs->pollFds);
+  free(outputs);
+}
+
+void SplitByBytes(split_input_t *input, batch_tuner_t *tuner, split_outputs_t *outputs)
+{
+  unsigned int numOutputFiles = outputs->numOutputFiles;
+  int current_file_id = numOutputFiles - 1;
   int64_t id = 0;
   size_t len = 0;
-  FILE *outputFile = outputFiles[current_file_id];
 
-  char *buffer = malloc(batchSize + 1);
+  char *buffer = malloc(tuner->maxBatchSize + 1);
 
-  // Do round robin copying of the input file to the output files
+  // Copy each block of the input file to an output that is writable
   // Each block has a header of "ID blockSize\n"
-  while ((len = fread(buffer, 1, batchSize, inputFile)) > 0)
+  while ((len = readInput(input, buffer, tuner->batchSize, outputs)) > 0)
   {
+    current_file_id = nextOutput(outputs, current_file_id);
+
     //write header
-    writeHeader(outputFile, id, len, 1);
+    writeBlockHeader(outputs, current_file_id, id, len, 1);
 
-    //write blocks
-    fwrite(buffer, 1, len, outputFile);
+    //write blocks (flushed so that polling the output is accurate)
+    writeToOutput(outputs, current_file_id, buffer, len, 1);
 
-    current_file_id = (current_file_id + 1) % numOutputFiles;
-    outputFile = outputFiles[current_file_id];
     id += 1;
+    tuneBatchSize(tuner, len, numOutputFiles);
   }
 
   if (len < 0)
@@ -51,21 +498,24 @@ int find_new_line_pivot(char *buffer, int start_pos, int end_pos, bool backward)
   return -1;
 }
 
-void SplitByLines(FILE *inputFile, int batchSize, FILE *outputFiles[], unsigned int numOutputFiles, bool add_header)
+void SplitByLines(split_input_t *input, batch_tuner_t *tuner, split_outputs_t *outputs, bool add_header)
 {
+  unsigned int numOutputFiles = outputs->numOutputFiles;
   int current_file_id = 0;
   int64_t id = 0;
   size_t len = 0, headSize = 0, restSize = 0, prevRestSize = 0, blockSize = 0;
-  FILE *outputFile = outputFiles[current_file_id];
+  // The last block that was written has not ended, so it is continued on the same output
+  bool blockIsOpen = 0;
 
-  char *buffer = malloc(batchSize + 1);
-  char *incompleteLine = malloc(batchSize + 1);
+  size_t batchSize = tuner->batchSize;
+  char *buffer = malloc(tuner->maxBatchSize + 1);
+  char *incompleteLine = malloc(tuner->maxBatchSize + 1);
 
 
   // First read an initial batch of W * batchSize to make sure we split equally incase data size is small
   size_t full_payload = batchSize * numOutputFiles;
   char *init_buffer = malloc(full_payload + 1);
-  if((len = fread(init_buffer, 1, full_payload, inputFile)) > 0) {
+  if((len = readInput(input, init_buffer, full_payload, outputs)) > 0) {
     int start_pos = 0;
     bool is_last = true;
     size_t init_batch_size = batchSize;
@@ -75,7 +525,6 @@ void SplitByLines(FILE *inputFile, int batchSize, FILE *outputFiles[], unsigned
     }
 
     for (current_file_id = 0; current_file_id < numOutputFiles; current_file_id++) {
-      outputFile = outputFiles[current_file_id];
       int next_start = 0;
       if (current_file_id < numOutputFiles - 1) {
         // Process output for the first n - 1 nodes
@@ -93,7 +542,7 @@ void SplitByLines(FILE *inputFile, int batchSize, FILE *outputFiles[], unsigned
       } else {
         // Process output for last node
         blockSize = len - start_pos;
-        if (init_buffer[len - 1] == '\n' || feof(inputFile)) {
+        if (init_buffer[len - 1] == '\n' || input->eof) {
           is_last = true;
         } else {
           is_last = false;
@@ -102,9 +551,9 @@ void SplitByLines(FILE *inputFile, int batchSize, FILE *outputFiles[], unsigned
       }
 
       if (add_header)
-        writeHeader(outputFile, id, blockSize, is_last);
+        writeBlockHeader(outputs, current_file_id, id, blockSize, is_last);
 
-      safeWriteWithFlush(init_buffer + start_pos, 1, blockSize, outputFile);
+      writeToOutput(outputs, current_file_id, init_buffer + start_pos, blockSize, 1);
 
       start_pos = next_start;
 
@@ -113,28 +562,26 @@ void SplitByLines(FILE *inputFile, int batchSize, FILE *outputFiles[], unsigned
       }
     }
 
-    // This will wrap around if the last chunk was complete
-    // otherwise keep pointer on the last file
-    if (is_last) {
-      current_file_id = 0;
-    } else {
-      current_file_id = numOutputFiles - 1;
-    }
+    // The next output is polled after the last file if the last chunk was complete,
+    // otherwise the block is continued on the last file
+    current_file_id = numOutputFiles - 1;
+    blockIsOpen = !is_last;
   }
   free(init_buffer);
 
-  // Do round robin copying of the input file to the output files
+  // Copy each block of the input file to an output that is writable
   // Each block has a header of "ID blockSize\n"
-  while ((len = fread(buffer, 1, batchSize, inputFile)) > 0)
+  while ((len = readInput(input, buffer, tuner->batchSize, outputs)) > 0)
   {
-    outputFile = outputFiles[current_file_id];
+    if (!blockIsOpen)
+      current_file_id = nextOutput(outputs, current_file_id);
 
     //find pivot point for head and rest
-    for (int i = len - 1; i >= (len - 1)/2; i--) //only search to the middle
+    for (size_t i = len; i > (len - 1)/2; i--) //only search to the middle
     {
-      if (buffer[i] == '\n')
+      if (buffer[i - 1] == '\n')
       {
-        headSize = i + 1;
+        headSize = i;
         restSize = len - headSize;
         break;
       }
@@ -143,41 +590,44 @@ void SplitByLines(FILE *inputFile, int batchSize, FILE *outputFiles[], unsigned
     //no new line character
     if (headSize == 0)
     {
+      growBatchForLongLine(tuner, len);
       headSize = len;
       blockSize = prevRestSize + headSize;
       if (add_header) {
-          if (feof(inputFile))
-            writeHeader(outputFile, id, blockSize, 1);
+          if (input->eof)
+            writeBlockHeader(outputs, current_file_id, id, blockSize, 1);
           else
-            writeHeader(outputFile, id, blockSize, 0);
+            writeBlockHeader(outputs, current_file_id, id, blockSize, 0);
       }
       if (prevRestSize)
-        safeWrite(incompleteLine, 1, prevRestSize, outputFile);
-      safeWriteWithFlush(buffer, 1, headSize, outputFile);
+        writeToOutput(outputs, current_file_id, incompleteLine, prevRestSize, 0);
+      writeToOutput(outputs, current_file_id, buffer, headSize, 1);
 
       // Prepare next iteration
       prevRestSize = 0;
+      blockIsOpen = !input->eof;
     }
     else
     {
       blockSize = prevRestSize + headSize;
       //write header
       if (add_header)
-        writeHeader(outputFile, id, blockSize, 1);
+        writeBlockHeader(outputs, current_file_id, id, blockSize, 1);
       //write blocks
       if (prevRestSize)
-        safeWrite(incompleteLine, 1, prevRestSize, outputFile);
-      safeWriteWithFlush(buffer, 1, headSize, outputFile);
+        writeToOutput(outputs, current_file_id, incompleteLine, prevRestSize, 0);
+      writeToOutput(outputs, current_file_id, buffer, headSize, 1);
       //update incompleteLine to the current block
       memcpy(incompleteLine, buffer + headSize, restSize);
 
       // Prepare next iteration
-      current_file_id = (current_file_id + 1) % numOutputFiles;
       prevRestSize = restSize;
+      blockIsOpen = 0;
       id += 1;
     }
 
     headSize = restSize = 0;
+    tuneBatchSize(tuner, len, numOutputFiles);
   }
 
   if (len < 0)
@@ -188,9 +638,10 @@ void SplitByLines(FILE *inputFile, int batchSize, FILE *outputFiles[], unsigned
 
   if (prevRestSize > 0)
   {
+    current_file_id = nextOutput(outputs, current_file_id);
     if (add_header)
-      writeHeader(outputFile, id, prevRestSize, 1);
-    safeWriteWithFlush(incompleteLine, 1, prevRestSize, outputFile);
+      writeBlockHeader(outputs, current_file_id, id, prevRestSize, 1);
+    writeToOutput(outputs, current_file_id, incompleteLine, prevRestSize, 1);
   }
 
   //clean up
@@ -219,20 +670,12 @@ void SplitByLinesRaw(FILE *inputFile, int batchSize, FILE *outputFiles[], unsign
 
 
 
-void SplitInput(char *input, int batchSize, char *outputFileNames[], unsigned int numOutputFiles, bool useBytes, bool raw)
+void SplitInput(char *input, int batchSize, size_t minBatchSize, double targetBlockTime,
+                char *outputFileNames[], unsigned int numOutputFiles, bool useBytes, bool raw, bool buffered,
+                bool reportStdinSize)
 {
   PRINTDBG("%s: will split input\n", __func__);
-  //TODO: find better way?
-  FILE **outputFiles = malloc(sizeof(FILE *) * numOutputFiles);
-  for (int i = 0; i < numOutputFiles; i++)
-  {
-    outputFiles[i] = fopen(outputFileNames[i], "w");
-    if (!outputFiles[i])
-    {
-      perror(LOC);
-      exit(1);
-    }
-  }
+  split_outputs_t *outputs = openSplitOutputs(outputFileNames, numOutputFiles, buffered);
 
   FILE *inputFile = fopen(input, "r");
   if (!inputFile)
@@ -242,37 +685,40 @@ void SplitInput(char *input, int batchSize, char *outputFileNames[], unsigned in
   }
   PRINTDBG("%s: Opened input file %s\n", __func__, input);
 
+  //if batchSize isn't set we can approximate it
+  if (useBytes && batchSize == 0)
+  {
+    int inputfd = fileno(inputFile);
+    struct stat buf;
+    fstat(inputfd, &buf);
+    size_t inputSize = buf.st_size;
+    batchSize = MIN(inputSize / MINCHUNKS, CHUNKSIZE); //autotune this better?
+  }
+  batch_tuner_t tuner;
+  initBatchTuner(&tuner, batchSize, minBatchSize, targetBlockTime);
+  limitBatchToInputSize(&tuner, inputFile, numOutputFiles);
+  split_input_t splitInput = {inputFile, 0, 0};
+
   if (raw)
   {
     // SplitByLinesRaw(inputFile, batchSize, outputFiles, numOutputFiles);
-    SplitByLines(inputFile, batchSize, outputFiles, numOutputFiles, 0);
+    SplitByLines(&splitInput, &tuner, outputs, 0);
   }
   else if (useBytes)
   {
-    //if batchSize isn't set we can approximate it
-    if (batchSize == 0)
-    {
-      int inputfd = fileno(inputFile);
-      struct stat buf;
-      fstat(inputfd, &buf);
-      size_t inputSize = buf.st_size;
-      batchSize = MIN(inputSize / MINCHUNKS, CHUNKSIZE); //autotune this better?
-    }
-    SplitByBytes(inputFile, batchSize, outputFiles, numOutputFiles);
+    SplitByBytes(&splitInput, &tuner, outputs);
   }
   else
   {
-    SplitByLines(inputFile, batchSize, outputFiles, numOutputFiles, 1);
+    SplitByLines(&splitInput, &tuner, outputs, 1);
   }
 
   PRINTDBG("%s: Done splitting input %s, will clean up\n", __func__, input);
+  closeSplitOutputs(outputs);
   fclose(inputFile);
-  // need to close all output files
-  for (int i = 0; i < numOutputFiles; i++)
-  {
-    fclose(outputFiles[i]);
-  }
-  free(outputFiles);
+
+  if (reportStdinSize)
+    reportRegionStat("stdin_bytes %llu\n", (unsigned long long)splitInput.bytesRead);
 }
 
 int main(int argc, char *argv[])
@@ -281,18 +727,28 @@ int main(int argc, char *argv[])
   // arg#2 -> batch_size
   // args#3... -> output file names
   // flags: -b to use bytes (batch_size will be exact number of bytes instead of approximating to the closest line)
+  //        -a target_block_ms to tune the batch size (up to batch_size), -m to set its minimum
+  //        -e to buffer the outputs (instead of blocking on them)
+  //        -s to report the number of bytes read (when the input is the stdin of the region)
   if (argc < 4)
   {
     // TODO: document -r flag
     fprintf(stderr,
             "\n"
-            "Usage: %s [-b] [-r] input_file batch_size output_file_1 output_file_2 [output_file_3 ...]\n\n"
-            "    -b: use bytes (batch_size will be exact number of bytes instead of approximating to the closest line)\n\n",
-            argv[0]);
+            "Usage: %s [-b] [-r] [-e] [-s] [-a target_block_ms [-m min_batch_size]] input_file batch_size output_file_1 output_file_2 [output_file_3 ...]\n\n"
+            "    -b: use bytes (batch_size will be exact number of bytes instead of approximating to the closest line)\n"
+            "    -a: tune the batch size so that each output gets a block about every target_block_ms milliseconds\n"
+            "        (batch_size is the largest batch size)\n"
+            "    -m: the smallest batch size when tuning (default: %d)\n"
+            "    -e: buffer the outputs in memory (and then in temporary files) instead of blocking on them\n"
+            "    -s: report the number of bytes read as the size of the stdin of the region (see region_stats.h)\n\n",
+            argv[0], DEFAULT_MIN_BATCH_SIZE);
     exit(1);
   }
-  bool useBytes = 0, offset = 0, raw = 0;
-  size_t batchSize = 0;
+  int offset = 0;
+  bool useBytes = 0, raw = 0, buffered = 0, reportStdinSize = 0;
+  size_t batchSize = 0, minBatchSize = DEFAULT_MIN_BATCH_SIZE;
+  double targetBlockTime = 0;
   char **outputFileNames = NULL;
   char *inputFileName = NULL;
   for (int i = 1; i < argc; i++)
@@ -312,6 +768,31 @@ int main(int argc, char *argv[])
       continue;
     }
 
+    if (strcmp(argv[i], "-e") == 0)
+    {
+      buffered = 1;
+      offset += 1;
+      continue;
+    }
+
+    if (strcmp(argv[i], "-s") == 0)
+    {
+      reportStdinSize = 1;
+      offset += 1;
+      continue;
+    }
+
+    if ((strcmp(argv[i], "-a") == 0 || strcmp(argv[i], "-m") == 0) && i + 1 < argc)
+    {
+      if (argv[i][1] == 'a')
+        targetBlockTime = atof(argv[i + 1]) / 1000;
+      else
+        minBatchSize = atol(argv[i + 1]);
+      offset += 2;
+      i += 1;
+      continue;
+    }
+
     int truePos = i - offset; //tracks true position without any added flags
     if (truePos == 1)
     {
@@ -328,7 +809,7 @@ int main(int argc, char *argv[])
     }
   }
 
-  SplitInput(inputFileName, batchSize, outputFileNames, argc - offset - 3, useBytes, raw);
+  SplitInput(inputFileName, batchSize, minBatchSize, targetBlockTime, outputFileNames, argc - offset - 3, useBytes, raw, buffered, reportStdinSize);
 
   PRINTDBG("SplitInput is done\n");
   return 0;
@@ -1,3 +1,6 @@
+#ifndef _GNU_SOURCE
+#define _GNU_SOURCE
+#endif
 #include <stdio.h>
 #include <stdlib.h>
 #include <string.h>
@@ -7,6 +10,7 @@
 #include <fcntl.h>
 #include <errno.h>
 #include <err.h>
+#include <poll.h>
 
 #ifdef DEBUG
 #define PRINTDBG(fmt, ...) printf(fmt, ##__VA_ARGS__)
@@ -100,6 +104,141 @@ void block_fd(int fd, const char *name)
     err(2, "Error setting %s to blocking mode", name);
 }
 
+// Returns an output that can be written to without blocking (or whose reader has exited),
+// looking from the one after prevIdx, so that blocks go round robin to the outputs whose readers keep up
+int pollWritableOutput(struct pollfd *pollFds, unsigned int numFds, int prevIdx)
+{
+  for (int i = 0; i < numFds; i++)
+  {
+    pollFds[i].events = POLLOUT;
+  }
+  while (poll(pollFds, numFds, -1) < 0)
+  {
+    if (errno != EINTR)
+      err(2, "poll failed");
+  }
+  for (int i = 1; i <= numFds; i++)
+  {
+    int idx = (prevIdx + i) % numFds;
+    if (pollFds[idx].revents)
+      return idx;
+  }
+  return (prevIdx + 1) % numFds;
+}
+
+// Reads up to size bytes, and less only if the input ended
+size_t readFull(int fd, char *buffer, size_t size)
+{
+  size_t tot_read = 0;
+  while (tot_read < size)
+  {
+    ssize_t len = read(fd, buffer + tot_read, size - tot_read);
+    if (len < 0)
+    {
+      if (errno == EINTR)
+        continue;
+      err(2, "There is a problem with reading the block");
+    }
+    if (len == 0)
+      break;
+    tot_read += len;
+  }
+  return tot_read;
+}
+
+// Writes the whole buffer to an fd
+void writeFull(int fd, char *buffer, size_t size)
+{
+  size_t tot_written = 0;
+  while (tot_written < size)
+  {
+    ssize_t len = write(fd, buffer + tot_written, size - tot_written);
+    if (len < 0)
+    {
+      if (errno == EINTR)
+        continue;
+      // Reader terminated early
+      if (errno == EPIPE)
+        exit(EXIT_SUCCESS);
+      err(2, "write failed count %lu, wrote %lu", size, tot_written);
+    }
+    tot_written += len;
+  }
+}
+
+/*
+The payloads of the blocks are moved between pipes with splice, so that they are not copied through user space
+(the headers are still read with small reads). Splice needs one of its two fds to be a pipe,
+so blocks to and from regular files are copied through a buffer, and so is everything if PASH_NO_SPLICE is set
+(e.g., to measure the difference).
+*/
+
+bool spliceEnabled()
+{
+#ifdef __linux__
+  return getenv("PASH_NO_SPLICE") == NULL;
+#else
+  return 0;
+#endif
+}
+
+bool isPipe(int fd)
+{
+  struct stat fdStat;
+  return fstat(fd, &fdStat) == 0 && S_ISFIFO(fdStat.st_mode);
+}
+
+bool canSplice(int inputFd, int outputFd)
+{
+  return spliceEnabled() && (isPipe(inputFd) || isPipe(outputFd));
+}
+
+// Moves size bytes from inputFd to outputFd, with splice if *useSplice is set (see canSplice).
+// If splice turns out not to be supported for these fds (e.g., for an output opened for appending),
+// *useSplice is cleared and the bytes are copied instead.
+void moveBytes(int inputFd, int outputFd, size_t size, bool *useSplice)
+{
+  static char *buffer = NULL;
+  while (size > 0)
+  {
+    ssize_t len;
+#ifdef __linux__
+    if (*useSplice)
+    {
+      len = splice(inputFd, NULL, outputFd, NULL, size, SPLICE_F_MOVE);
+      if (len < 0 && errno == EINVAL)
+      {
+        *useSplice = 0;
+        continue;
+      }
+    }
+    else
+#endif
+    {
+      if (!buffer)
+        buffer = malloc(BUFLEN);
+      len = read(inputFd, buffer, MIN(BUFLEN, size));
+      if (len > 0)
+        writeFull(outputFd, buffer, len);
+    }
+    if (len < 0)
+    {
+      if (errno == EINTR)
+        continue;
+      // Reader terminated early
+      if (errno == EPIPE)
+        exit(EXIT_SUCCESS);
+      err(2, "There is a problem with moving the block");
+    }
+    if (len == 0)
+    {
+      PRINTDBG("Pipe closed before the full block data was written");
+      exit(0);
+    }
+    size -= len;
+  }
+}
+
 void readHeader(FILE *inputFile, int64_t *id, size_t *blockSize, bool *isLast)
 {
   size_t ret;
@@ -0,0 +1,77 @@
+#!/usr/bin/env bash
+
+## Checks that r_merge outputs the input of r_split when r_split tunes its batch size (-a/-m),
+##   with lines that are longer than the batch size, and with input that arrives one byte at a time.
+##
+## Usage: ./r_split_test.sh [directory of the binaries]
+
+BIN=${1:-.}
+WIDTH=4
+
+TMP=$(mktemp -d)
+trap 'rm -rf "$TMP"' EXIT
+
+## Prints a line of the given length (without its newline)
+long_line() {
+    head -c "$1" /dev/zero | tr '\0' 'a'
+}
+
+## Short lines around lines that are longer than the largest batch size, and no newline at the end
+{
+    seq 1 20000
+    long_line 300000; echo
+    seq 1 100
+    long_line 2000000; echo
+    long_line 70000; echo
+    seq 1 20000
+    long_line 1000
+} > "$TMP/long_lines.txt"
+
+## A smaller input for the single byte writes
+{
+    seq 1 5000
+    long_line 50000; echo
+    seq 1 5000
+} > "$TMP/small.txt"
+
+failed=0
+
+## Runs r_split (with the given flags and batch size) and r_merge on an input that a writer command
+##   writes to a fifo, and compares the output with the input
+check() {
+    local name=$1
+    local input=$2
+    local writer=$3
+    local batch_size=$4
+    shift 4
+    local outputs=()
+    for i in $(seq 1 $WIDTH); do
+        outputs+=("$TMP/out$i")
+    done
+    rm -f "$TMP/in" "${outputs[@]}"
+    mkfifo "$TMP/in" "${outputs[@]}"
+
+    $writer < "$input" > "$TMP/in" 2>/dev/null &
+    "$BIN/r_split" "$@" "$TMP/in" "$batch_size" "${outputs[@]}" &
+    "$BIN/r_merge" "${outputs[@]}" > "$TMP/merged"
+    wait
+
+    if cmp -s "$input" "$TMP/merged"; then
+        echo "$name: ok"
+    else
+        echo "$name: the output differs from the input!"
+        failed=1
+    fi
+}
+
+write_bytes() {
+    dd bs=1
+}
+
+check "static batch, long lines" "$TMP/long_lines.txt" cat 100000
+check "tuned batch, long lines" "$TMP/long_lines.txt" cat 100000 -a 10 -m 4096
+check "tuned batch with -e, long lines" "$TMP/long_lines.txt" cat 100000 -e -a 10 -m 4096
+check "tuned batch, single byte writes" "$TMP/small.txt" write_bytes 8192 -a 1 -m 16
+check "tuned batch with -e, single byte writes" "$TMP/small.txt" write_bytes 8192 -e -a 1 -m 16
+
+exit $failed
@@ -1,43 +1,34 @@
 #include "r_split.h"
 
-void unwrap(FILE* inputFile) {
-    size_t bufLen = BUFLEN; //buffer length, would be resized as needed
-    int64_t id;
-    size_t blockSize;
-    bool isLast;
-    char* buffer = malloc(bufLen + 1);
+// Writes the payloads of the blocks without their headers (moving them with splice if possible, see moveBytes)
+void unwrap(int inputFd) {
+    bool useSplice = canSplice(inputFd, STDOUT_FILENO);
+    block_header header;
 
-    readHeader(stdin, &id, &blockSize, &isLast);
-    while(!feof(stdin)) {     
-        //Read batch
-        size_t tot_read = 0, readSize = 0;
-        while (tot_read < blockSize) {
-            readSize = MIN(bufLen, blockSize-tot_read);
-            handle_reading(buffer, readSize, stdin);
-            
-            //Write to forked process
-            safeWrite(buffer, 1, readSize, stdout);
-            tot_read += readSize;
+    for (;;) {
+        size_t len = readFull(inputFd, (char *)&header, sizeof(block_header));
+        if (len == 0)
+            break;
+        if (len < sizeof(block_header)) {
+            PRINTDBG("Pipe closed before the full block header was written");
+            exit(0);
         }
-        fflush(stdout);
-        assert(tot_read == blockSize);
-
-        //update header (ordered at the end so !feof works) and cleanup
-        readHeader(stdin, &id, &blockSize, &isLast);
+        moveBytes(inputFd, STDOUT_FILENO, header.blockSize, &useSplice);
     }
-    free(buffer);
 }
 
 int main(int argc, char* argv[]) {
     //no arguments needed, can accept one argument for input file instead of stdin
     //input is from stdin, out to stdout
-    FILE *inputFile = stdin; //defualt is stdin
+    int inputFd = STDIN_FILENO; //defualt is stdin
     if (argc > 1) {
-        inputFile = fopen(argv[1], "r");
+        inputFd = open(argv[1], O_RDONLY);
+        if (inputFd < 0)
+            err(1, "%s", argv[1]);
     }
 
-    unwrap(inputFile);
+    unwrap(inputFd);
 
     //cleanup
-    fclose(inputFile);
+    close(inputFd);
 }
@@ -215,12 +215,473 @@ void processCmd(char *args[])
     free(writebuffer);
 }
 
+/*
+Persistent mode: for commands that process each line of their input independently,
+one instance of the command is kept for all blocks (instead of one fork per block),
+and the boundaries of the blocks are recovered from its output:
+- with -l (line map), every input line produces exactly one output line,
+  so the output of a block is as many lines as the block has.
+- with -f (line filter), the output lines are the input lines for which a stateless predicate holds,
+  so each output line belongs to the block of the next equal input line
+  (equal lines are either all in the output or not, so matching them greedily is exact).
+
+The output of a block is only known to be complete once the output of a later line arrives,
+so the command is restarted (at a line boundary) when the input ends, when too much of the input
+that was fed to it is not resolved yet, or when the input is idle and a block is only waiting
+for the command to flush its output.
+*/
+
+#define FRAMING_FORK_PER_BLOCK 0
+#define FRAMING_LINE_MAP 1
+#define FRAMING_LINE_FILTER 2
+
+// Restart the command if this much of its input has not been matched to its output (line filter)
+#define PERSISTENT_UNRESOLVED_LIMIT (16 * CHUNKSIZE)
+// Restart the command if the input is idle for this long and a block is waiting for its output
+#define PERSISTENT_IDLE_TIMEOUT_MS 50
+// Stop reading the input while this much is waiting to be fed to the command
+#define PERSISTENT_FEED_LIMIT (4 * BUFLEN)
+
+typedef struct wrapped_block
+{
+    int64_t id;
+    // The last chunk of the block has been read
+    bool inputDone;
+    // (line map) the lines of the block that have no output line yet
+    size_t pendingLines;
+    // (line map) the input of the block ends with a line without a newline (the last line of the input),
+    // which has an output line that can only be assigned once the command exits
+    bool partialLine;
+    // (line filter) the input of the block from the first line that has not been matched yet
+    char *lines;
+    size_t linesStart, linesLen, linesCap;
+    struct wrapped_block *next;
+} wrapped_block_t;
+
+typedef struct persistent_cmd
+{
+    char **args;
+    int framing;
+    int pid;
+    int inputFd;  // the stdin of the command
+    int outputFd; // the stdout of the command
+    // Input that has not been fed to the command yet
+    char *feed;
+    size_t feedStart, feedLen, feedCap;
+    char lastFedByte;
+    // Output of the command that is not a complete line yet
+    char *output;
+    size_t outputLen, outputCap;
+    // Blocks whose output is not complete yet, in order
+    wrapped_block_t *head, *tail;
+    size_t unresolvedBytes;
+    // Output of the head block that has not been written yet
+    char *blockOutput;
+    size_t blockOutputLen, blockOutputCap;
+} persistent_cmd_t;
+
+void appendToBuffer(char **buffer, size_t *len, size_t *cap, char *data, size_t size)
+{
+    if (*len + size > *cap)
+    {
+        *cap = 2 * (*len + size);
+        *buffer = realloc(*buffer, *cap + 1);
+    }
+    memcpy(*buffer + *len, data, size);
+    *len += size;
+}
+
+void startPersistentCmd(persistent_cmd_t *cmd)
+{
+    int fdIn[2];
+    int fdOut[2];
+    if (pipe(fdIn) < 0 || pipe(fdOut) < 0)
+    {
+        perror("pipe failed");
+        exit(1);
+    }
+
+    cmd->pid = fork();
+    if (cmd->pid == -1)
+        err(2, "fork failed");
+
+    if (cmd->pid == 0)
+    {
+        dup2(fdOut[WRITE_END], STDOUT_FILENO);
+        dup2(fdIn[READ_END], STDIN_FILENO);
+
+        close(fdOut[READ_END]);
+        close(fdOut[WRITE_END]);
+        close(fdIn[READ_END]);
+        close(fdIn[WRITE_END]);
+        execvp(cmd->args[0], cmd->args);
+        //shouldn't get here
+        perror("Exec failed");
+        exit(1);
+    }
+    close(fdIn[READ_END]);
+    close(fdOut[WRITE_END]);
+    cmd->inputFd = fdIn[WRITE_END];
+    cmd->outputFd = fdOut[READ_END];
+    non_block_fd(cmd->inputFd, "r-wrap-persistent-write");
+    non_block_fd(cmd->outputFd, "r-wrap-persistent-read");
+}
+
+void writeHeadBlockOutput(persistent_cmd_t *cmd, bool isLast)
+{
+    writeHeader(stdout, cmd->head->id, cmd->blockOutputLen, isLast);
+    safeWriteWithFlush(cmd->blockOutput, 1, cmd->blockOutputLen, stdout);
+    cmd->blockOutputLen = 0;
+}
+
+void emitHeadBlock(persistent_cmd_t *cmd)
+{
+    wrapped_block_t *block = cmd->head;
+    writeHeadBlockOutput(cmd, 1);
+    cmd->unresolvedBytes -= block->linesLen - block->linesStart;
+    cmd->head = block->next;
+    if (!cmd->head)
+        cmd->tail = NULL;
+    free(block->lines);
+    free(block);
+}
+
+// Emits the blocks at the head whose output is complete
+void emitResolvedBlocks(persistent_cmd_t *cmd)
+{
+    while (cmd->head && cmd->head->inputDone
+           && cmd->head->pendingLines == 0 && !cmd->head->partialLine
+           && cmd->head->linesStart == cmd->head->linesLen)
+    {
+        emitHeadBlock(cmd);
+    }
+    // The head block could have a lot of output
+    if (cmd->head && cmd->blockOutputLen > CHUNKSIZE)
+        writeHeadBlockOutput(cmd, 0);
+}
+
+void addBlockInput(persistent_cmd_t *cmd, wrapped_block_t *block, char *data, size_t size)
+{
+    appendToBuffer(&cmd->feed, &cmd->feedLen, &cmd->feedCap, data, size);
+    if (cmd->framing == FRAMING_LINE_MAP)
+    {
+        for (char *pos = data; (pos = memchr(pos, '\n', data + size - pos)); pos++)
+            block->pendingLines += 1;
+        if (size > 0)
+            block->partialLine = data[size - 1] != '\n';
+    }
+    else
+    {
+        appendToBuffer(&block->lines, &block->linesLen, &block->linesCap, data, size);
+        cmd->unresolvedBytes += size;
+    }
+}
+
+// Finds the block that an output line (without its newline) belongs to, and adds the line to its output.
+// If final, the command has exited, so the last line of the input might not end with a newline.
+bool assignOutputLine(persistent_cmd_t *cmd, char *line, size_t lineLen, size_t size, bool final)
+{
+    for (;;)
+    {
+        wrapped_block_t *block = cmd->head;
+        if (!block)
+            return 0;
+        if (cmd->framing == FRAMING_LINE_MAP)
+        {
+            if (block->pendingLines > 0)
+            {
+                block->pendingLines -= 1;
+                break;
+            }
+            if (final && block->partialLine)
+            {
+                block->partialLine = 0;
+                break;
+            }
+        }
+        else
+        {
+            char *start = block->lines + block->linesStart;
+            size_t remaining = block->linesLen - block->linesStart;
+            char *newline = memchr(start, '\n', remaining);
+            size_t inputLineLen = newline ? newline - start : remaining;
+            if (newline || (final && remaining > 0))
+            {
+                size_t consumed = newline ? inputLineLen + 1 : remaining;
+                block->linesStart += consumed;
+                cmd->unresolvedBytes -= consumed;
+                if (inputLineLen == lineLen && memcmp(start, line, lineLen) == 0)
+                    break;
+                continue;
+            }
+        }
+        // All the lines of the head block have been accounted for
+        // (except for a last line without a newline, which can only be output once the command exits)
+        if (!block->inputDone || block->partialLine || block->linesStart < block->linesLen)
+            return 0;
+        emitHeadBlock(cmd);
+    }
+    appendToBuffer(&cmd->blockOutput, &cmd->blockOutputLen, &cmd->blockOutputCap, line, size);
+    return 1;
+}
+
+// Assigns the complete lines of the output of the command to their blocks
+void processOutputLines(persistent_cmd_t *cmd, bool final)
+{
+    size_t start = 0;
+    char *newline;
+    while ((newline = memchr(cmd->output + start, '\n', cmd->outputLen - start)))
+    {
+        size_t lineLen = newline - (cmd->output + start);
+        if (!assignOutputLine(cmd, cmd->output + start, lineLen, lineLen + 1, final))
+        {
+            if (!final || !cmd->head)
+                break;
+            // The output doesn't have the expected form, so it is kept in order anyway
+            appendToBuffer(&cmd->blockOutput, &cmd->blockOutputLen, &cmd->blockOutputCap,
+                           cmd->output + start, lineLen + 1);
+        }
+        start += lineLen + 1;
+    }
+    if (final && start < cmd->outputLen && cmd->head)
+    {
+        // The last line of the output doesn't end with a newline
+        size_t lineLen = cmd->outputLen - start;
+        if (!assignOutputLine(cmd, cmd->output + start, lineLen, lineLen, final))
+            appendToBuffer(&cmd->blockOutput, &cmd->blockOutputLen, &cmd->blockOutputCap,
+                           cmd->output + start, lineLen);
+        start = cmd->outputLen;
+    }
+    cmd->outputLen -= start;
+    memmove(cmd->output, cmd->output + start, cmd->outputLen);
+}
+
+bool readCmdOutput(persistent_cmd_t *cmd, char *buffer, size_t bufLen)
+{
+    ssize_t len = read(cmd->outputFd, buffer, bufLen);
+    if (len < 0)
+    {
+        if (errno == EAGAIN || errno == EINTR)
+            return 1;
+        err(2, "Failed reading from fork, error %d", errno);
+    }
+    appendToBuffer(&cmd->output, &cmd->outputLen, &cmd->outputCap, buffer, len);
+    return len > 0;
+}
+
+// Closes the input of the command, and waits for all of its output.
+// All the blocks whose input has been read are complete after that.
+void drainPersistentCmd(persistent_cmd_t *cmd, char *buffer, size_t bufLen)
+{
+    close(cmd->inputFd);
+    block_fd(cmd->outputFd, "r-wrap-persistent-read");
+    while (readCmdOutput(cmd, buffer, bufLen))
+        processOutputLines(cmd, 0);
+    close(cmd->outputFd);
+    waitpid(cmd->pid, NULL, 0);
+    cmd->pid = -1;
+    processOutputLines(cmd, 1);
+
+    while (cmd->head && cmd->head->inputDone)
+        emitHeadBlock(cmd);
+    if (cmd->head)
+    {
+        // The rest of this block will be fed to the next instance of the command
+        cmd->head->pendingLines = 0;
+        cmd->unresolvedBytes -= cmd->head->linesLen - cmd->head->linesStart;
+        cmd->head->linesStart = cmd->head->linesLen = 0;
+        if (cmd->blockOutputLen > 0)
+            writeHeadBlockOutput(cmd, 0);
+    }
+}
+
+void processCmdPersistent(char *args[], int framing)
+{
+    persistent_cmd_t cmd = {0};
+    cmd.args = args;
+    cmd.framing = framing;
+    cmd.pid = -1;
+    cmd.lastFedByte = '\n';
+    size_t bufLen = BUFLEN, inputLen = 0;
+    char *buffer = malloc(bufLen + 1);
+    char *input = malloc(bufLen + sizeof(block_header) + 1);
+    // The chunk of the input that is being read
+    wrapped_block_t *current = NULL;
+    block_header header;
+    bool inChunk = 0, inputEof = 0;
+    size_t chunkRemaining = 0;
+
+    for (;;)
+    {
+        bool feedPending = cmd.feedStart < cmd.feedLen;
+        if (inputEof && !feedPending)
+        {
+            if (cmd.pid > 0)
+                drainPersistentCmd(&cmd, buffer, bufLen);
+            break;
+        }
+        // Restart the command if too much of its input is not resolved
+        if (cmd.pid > 0 && !feedPending && cmd.lastFedByte == '\n'
+            && cmd.unresolvedBytes > PERSISTENT_UNRESOLVED_LIMIT)
+        {
+            PRINTDBG("r_wrap: restarting the command with %lu unresolved bytes\n", cmd.unresolvedBytes);
+            drainPersistentCmd(&cmd, buffer, bufLen);
+        }
+        if (cmd.pid < 0 && feedPending)
+            startPersistentCmd(&cmd);
+
+        struct pollfd pollFds[3];
+        int numPollFds = 0, inputIdx = -1, cmdInputIdx = -1, cmdOutputIdx = -1;
+        if (!inputEof && cmd.feedLen - cmd.feedStart < PERSISTENT_FEED_LIMIT)
+        {
+            inputIdx = numPollFds++;
+            pollFds[inputIdx].fd = STDIN_FILENO;
+            pollFds[inputIdx].events = POLLIN;
+        }
+        if (cmd.pid > 0)
+        {
+            if (feedPending)
+            {
+                cmdInputIdx = numPollFds++;
+                pollFds[cmdInputIdx].fd = cmd.inputFd;
+                pollFds[cmdInputIdx].events = POLLOUT;
+            }
+            cmdOutputIdx = numPollFds++;
+            pollFds[cmdOutputIdx].fd = cmd.outputFd;
+            pollFds[cmdOutputIdx].events = POLLIN;
+        }
+        // A block whose input has all been fed might only be waiting for the command to flush its output
+        bool mightBeStuck = cmd.pid > 0 && !feedPending && cmd.lastFedByte == '\n'
+                            && cmd.head && cmd.head->inputDone;
+        int ret = poll(pollFds, numPollFds, mightBeStuck ? PERSISTENT_IDLE_TIMEOUT_MS : -1);
+        if (ret < 0)
+        {
+            if (errno == EINTR)
+                continue;
+            err(2, "poll failed");
+        }
+        if (ret == 0)
+        {
+            PRINTDBG("r_wrap: restarting the idle command to flush its output\n");
+            drainPersistentCmd(&cmd, buffer, bufLen);
+            continue;
+        }
+
+        if (cmdOutputIdx >= 0 && pollFds[cmdOutputIdx].revents)
+        {
+            if (!readCmdOutput(&cmd, buffer, bufLen))
+            {
+                // The command exited before its input ended
+                drainPersistentCmd(&cmd, buffer, bufLen);
+                continue;
+            }
+            processOutputLines(&cmd, 0);
+        }
+
+        if (cmdInputIdx >= 0 && pollFds[cmdInputIdx].revents)
+        {
+            ssize_t len = write(cmd.inputFd, cmd.feed + cmd.feedStart, cmd.feedLen - cmd.feedStart);
+            if (len < 0 && errno != EAGAIN && errno != EINTR)
+                err(2, "Error writing to fork, error %d", errno);
+            if (len > 0)
+            {
+                cmd.feedStart += len;
+                cmd.lastFedByte = cmd.feed[cmd.feedStart - 1];
+                if (cmd.feedStart == cmd.feedLen)
+                    cmd.feedStart = cmd.feedLen = 0;
+            }
+        }
+
+        if (inputIdx >= 0 && pollFds[inputIdx].revents)
+        {
+            if (cmd.feedStart > 0)
+            {
+                cmd.feedLen -= cmd.feedStart;
+                memmove(cmd.feed, cmd.feed + cmd.feedStart, cmd.feedLen);
+                cmd.feedStart = 0;
+            }
+            ssize_t len = read(STDIN_FILENO, input + inputLen, bufLen);
+            if (len < 0 && errno != EAGAIN && errno != EINTR)
+                err(2, "There is a problem with reading the block");
+            if (len == 0)
+            {
+                // The blocks that were cut short are complete too
+                inputEof = 1;
+                for (wrapped_block_t *block = cmd.head; block; block = block->next)
+                    block->inputDone = 1;
+            }
+            if (len > 0)
+                inputLen += len;
+
+            // Parse the chunks of the blocks of the input
+            size_t pos = 0;
+            while (pos < inputLen)
+            {
+                if (!inChunk)
+                {
+                    if (inputLen - pos < sizeof(block_header))
+                        break;
+                    memcpy(&header, input + pos, sizeof(block_header));
+                    pos += sizeof(block_header);
+                    inChunk = 1;
+                    chunkRemaining = header.blockSize;
+                    if (!current)
+                    {
+                        current = calloc(1, sizeof(wrapped_block_t));
+                        current->id = header.id;
+                        if (cmd.tail)
+                            cmd.tail->next = current;
+                        else
+                            cmd.head = current;
+                        cmd.tail = current;
+                    }
+                }
+                size_t size = MIN(chunkRemaining, inputLen - pos);
+                addBlockInput(&cmd, current, input + pos, size);
+                pos += size;
+                chunkRemaining -= size;
+                if (chunkRemaining == 0)
+                {
+                    inChunk = 0;
+                    if (header.isLast)
+                    {
+                        current->inputDone = 1;
+                        current = NULL;
+                    }
+                }
+            }
+            inputLen -= pos;
+            memmove(input, input + pos, inputLen);
+        }
+
+        emitResolvedBlocks(&cmd);
+    }
+
+    emitResolvedBlocks(&cmd);
+    free(buffer);
+    free(input);
+    free(cmd.feed);
+    free(cmd.output);
+    free(cmd.blockOutput);
+}
+
 int main(int argc, char *argv[])
 {
-    //arg1: command
-    //args 2.. : arguments for command
+    //arg1: (optional) -l or -f to keep one instance of the command (see processCmdPersistent)
+    //arg2: command
+    //args 3.. : arguments for command
     //input is from stdin, out to stdout
     char **args = NULL;
+    int framing = FRAMING_FORK_PER_BLOCK;
+    if (argc > 1 && strcmp(argv[1], "-l") == 0)
+        framing = FRAMING_LINE_MAP;
+    else if (argc > 1 && strcmp(argv[1], "-f") == 0)
+        framing = FRAMING_LINE_FILTER;
+    if (framing != FRAMING_FORK_PER_BLOCK)
+    {
+        argv++;
+        argc--;
+    }
     if (argc < 2)
     {
         /* default behavior is to echo all the filenames */
@@ -236,5 +697,8 @@ int main(int argc, char *argv[])
         strcpy(args[i - 1], argv[i]);
     }
     args[argc - 1] = '\0';
-    processCmd(args);
+    if (framing == FRAMING_FORK_PER_BLOCK)
+        processCmd(args);
+    else
+        processCmdPersistent(args, framing);
 }
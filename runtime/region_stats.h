@@ -0,0 +1,40 @@
+#ifndef REGION_STATS_H
+#define REGION_STATS_H
+
+#include <stdio.h>
+#include <stdlib.h>
+#include <stdarg.h>
+#include <unistd.h>
+#include <fcntl.h>
+
+/*
+The runtime primitives report what they observed while running a region (e.g., how many bytes
+the splitter read from the stdin of the region) by appending a line to the file in PASH_REGION_STATS,
+which the runtime sets for every compiled region. The compilation server reads that file the next time
+it compiles the region (see compiler/region_stats.py).
+*/
+
+static inline void reportRegionStat(const char *format, ...)
+{
+  char *statsFileName = getenv("PASH_REGION_STATS");
+  if (statsFileName == NULL || *statsFileName == '\0')
+    return;
+
+  char line[256];
+  va_list args;
+  va_start(args, format);
+  int len = vsnprintf(line, sizeof(line), format, args);
+  va_end(args);
+  if (len < 0 || len >= sizeof(line))
+    return;
+
+  // A single write with O_APPEND, so that the lines of primitives that exit together are not interleaved
+  int statsFd = open(statsFileName, O_WRONLY | O_CREAT | O_APPEND, 0600);
+  if (statsFd < 0)
+    return;
+  if (write(statsFd, line, len) < 0)
+    perror("could not report a region statistic");
+  close(statsFd);
+}
+
+#endif
@@ -0,0 +1,230 @@
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+#include <unistd.h>
+#include <fcntl.h>
+#include <errno.h>
+#include <err.h>
+#include <pthread.h>
+#include <signal.h>
+#include <sys/stat.h>
+#include "region_stats.h"
+
+#ifdef DEBUG
+#define PRINTDBG(fmt, ...) fprintf(stderr, fmt, ##__VA_ARGS__)
+#else
+#define PRINTDBG(fmt, ...)
+#endif
+
+#define COPY_BUFFER_SIZE (1024 * 1024)
+#define SCAN_BUFFER_SIZE (64 * 1024)
+
+/*
+Splits a regular file into consecutive chunks (one for each output) without copying it
+or counting its lines first. The boundaries of the chunks are computed from the size of the file
+and moved forward to the next newline, and each chunk is copied to its output by its own thread
+(with pread), so all outputs are produced concurrently.
+
+If the input is not a regular file (e.g., a fifo), it is first copied to a temporary file,
+since the boundaries of the chunks depend on its size. Either way, the outputs don't block each other,
+so the splitter doesn't need eager nodes after it.
+
+With -s, the input is the stdin of the region, and its size is reported (see region_stats.h),
+so that the compiler knows the size of a piped stdin the next time it compiles the region.
+*/
+
+typedef struct range
+{
+  int inputFd;
+  off_t start;
+  off_t end;
+  char *outputFileName;
+} range_t;
+
+// Returns the offset after the first newline at or after offset - 1
+// (so that a chunk that starts right after a newline is not moved).
+off_t alignToLine(int inputFd, off_t offset, off_t fileSize)
+{
+  if (offset == 0)
+    return 0;
+
+  char *buffer = malloc(SCAN_BUFFER_SIZE);
+  off_t pos = offset - 1;
+  while (pos < fileSize)
+  {
+    ssize_t len = pread(inputFd, buffer, SCAN_BUFFER_SIZE, pos);
+    if (len < 0)
+      err(2, "pread failed while looking for a line boundary");
+    if (len == 0)
+      break;
+    char *newline = memchr(buffer, '\n', len);
+    if (newline)
+    {
+      off_t lineEnd = pos + (newline - buffer) + 1;
+      free(buffer);
+      return lineEnd;
+    }
+    pos += len;
+  }
+  free(buffer);
+  return fileSize;
+}
+
+void *copyRange(void *arg)
+{
+  range_t *range = arg;
+  // Opening a fifo blocks until its reader opens it, which is why every output has its own thread
+  int outputFd = open(range->outputFileName, O_WRONLY);
+  if (outputFd < 0)
+    err(1, "%s", range->outputFileName);
+
+  char *buffer = malloc(COPY_BUFFER_SIZE);
+  off_t pos = range->start;
+  while (pos < range->end)
+  {
+    size_t readSize = range->end - pos < COPY_BUFFER_SIZE ? range->end - pos : COPY_BUFFER_SIZE;
+    ssize_t len = pread(range->inputFd, buffer, readSize, pos);
+    if (len < 0)
+      err(2, "pread failed");
+    if (len == 0)
+      break;
+    ssize_t written = 0;
+    while (written < len)
+    {
+      ssize_t ret = write(outputFd, buffer + written, len - written);
+      if (ret < 0)
+      {
+        // The reader of this chunk exited early, the other chunks are not affected
+        if (errno == EPIPE)
+          goto done;
+        err(2, "write failed");
+      }
+      written += ret;
+    }
+    pos += len;
+  }
+done:
+  PRINTDBG("seek_split: copied [%ld, %ld) to %s\n", (long)range->start, (long)pos, range->outputFileName);
+  free(buffer);
+  close(outputFd);
+  return NULL;
+}
+
+void SplitFile(int inputFd, off_t fileSize, char *outputFileNames[], unsigned int numOutputFiles)
+{
+  range_t *ranges = malloc(sizeof(range_t) * numOutputFiles);
+  pthread_t *threads = malloc(sizeof(pthread_t) * numOutputFiles);
+
+  off_t start = 0;
+  for (int i = 0; i < numOutputFiles; i++)
+  {
+    off_t end = (i == numOutputFiles - 1) ? fileSize
+                                           : alignToLine(inputFd, fileSize / numOutputFiles * (i + 1), fileSize);
+    // A line that is longer than a chunk might take over the next chunks
+    if (end < start)
+      end = start;
+    ranges[i].inputFd = inputFd;
+    ranges[i].start = start;
+    ranges[i].end = end;
+    ranges[i].outputFileName = outputFileNames[i];
+    start = end;
+  }
+
+  for (int i = 0; i < numOutputFiles; i++)
+  {
+    int ret = pthread_create(&threads[i], NULL, copyRange, &ranges[i]);
+    if (ret != 0)
+      errx(2, "pthread_create failed: %s", strerror(ret));
+  }
+  for (int i = 0; i < numOutputFiles; i++)
+  {
+    pthread_join(threads[i], NULL);
+  }
+
+  free(threads);
+  free(ranges);
+}
+
+// Copies the input to a temporary file (that is removed as soon as it is closed),
+// and returns the temporary file and its size
+int spoolToTemporaryFile(int inputFd, off_t *size)
+{
+  char *tmpDir = getenv("TMPDIR");
+  char path[4096];
+  snprintf(path, sizeof(path), "%s/pash_seek_split_XXXXXX", tmpDir && *tmpDir ? tmpDir : "/tmp");
+  int tempFd = mkstemp(path);
+  if (tempFd < 0)
+    err(2, "could not create a temporary file %s", path);
+  unlink(path);
+
+  char *buffer = malloc(COPY_BUFFER_SIZE);
+  *size = 0;
+  for (;;)
+  {
+    ssize_t len = read(inputFd, buffer, COPY_BUFFER_SIZE);
+    if (len < 0)
+    {
+      if (errno == EINTR)
+        continue;
+      err(2, "read failed");
+    }
+    if (len == 0)
+      break;
+    ssize_t written = 0;
+    while (written < len)
+    {
+      ssize_t ret = write(tempFd, buffer + written, len - written);
+      if (ret < 0)
+        err(2, "write to temporary file failed");
+      written += ret;
+    }
+    *size += len;
+  }
+  free(buffer);
+  PRINTDBG("seek_split: copied %ld bytes of the input to a temporary file\n", (long)*size);
+  return tempFd;
+}
+
+int main(int argc, char *argv[])
+{
+  // -s (optional) -> report the size of the input (when it is the stdin of the region)
+  // arg#1 -> input file name
+  // args#2... -> output file names
+  char *programName = argv[0];
+  int reportStdinSize = argc > 1 && strcmp(argv[1], "-s") == 0;
+  if (reportStdinSize)
+  {
+    argv++;
+    argc--;
+  }
+  if (argc < 3)
+  {
+    fprintf(stderr, "usage: %s [-s] input output_1 ... output_n\n", programName);
+    exit(1);
+  }
+
+  int inputFd = open(argv[1], O_RDONLY);
+  if (inputFd < 0)
+    err(1, "%s", argv[1]);
+  struct stat inputStat;
+  if (fstat(inputFd, &inputStat) < 0)
+    err(1, "%s", argv[1]);
+  off_t inputSize = inputStat.st_size;
+  if (!S_ISREG(inputStat.st_mode))
+  {
+    int tempFd = spoolToTemporaryFile(inputFd, &inputSize);
+    close(inputFd);
+    inputFd = tempFd;
+  }
+
+  // A broken output is handled by its thread
+  signal(SIGPIPE, SIG_IGN);
+
+  SplitFile(inputFd, inputSize, argv + 2, argc - 2);
+  close(inputFd);
+
+  if (reportStdinSize)
+    reportRegionStat("stdin_bytes %lld\n", (long long)inputSize);
+
+  return 0;
+}
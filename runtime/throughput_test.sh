@@ -0,0 +1,69 @@
+#!/usr/bin/env bash
+
+## Measures the throughput of r_merge, r_unwrap, and eager between pipes,
+##   with and without splice (PASH_NO_SPLICE only affects r_merge and r_unwrap).
+##
+## Usage: ./throughput_test.sh [input] [directory of the binaries]
+
+IN=${1:-../scripts/input/1G.txt}
+BIN=${2:-.}
+WIDTH=4
+BATCH_SIZE=1000000
+
+TMP=$(mktemp -d)
+trap 'rm -rf "$TMP"' EXIT
+
+## The inputs of r_merge and r_unwrap are blocks (with their headers), as r_split outputs them
+outputs=()
+for i in $(seq 1 $WIDTH); do
+    outputs+=("$TMP/block$i")
+done
+./r_split "$IN" $BATCH_SIZE "${outputs[@]}"
+./r_split "$IN" $BATCH_SIZE "$TMP/blocks"
+
+size=$(stat -c %s "$IN")
+TIMEFORMAT=%3R
+
+## Prints the throughput of a command that outputs the input (given its name and a command)
+measure() {
+    local name=$1
+    shift
+    local seconds
+    seconds=$( { time "$@" > "$TMP/out" ; } 2>&1 )
+    if ! cmp -s "$IN" "$TMP/out"; then
+        echo "$name: the output differs from the input!"
+        return
+    fi
+    echo "$name: ${seconds}s ($(awk "BEGIN { printf \"%d\", $size / $seconds / 1048576 }") MiB/s)"
+}
+
+run_r_merge() {
+    local inputs=()
+    for i in $(seq 1 $WIDTH); do
+        mkfifo "$TMP/merge$i"
+        cat "$TMP/block$i" > "$TMP/merge$i" &
+        inputs+=("$TMP/merge$i")
+    done
+    "$BIN/r_merge" "${inputs[@]}" | cat
+    wait
+    rm -f "${inputs[@]}"
+}
+
+run_r_unwrap() {
+    cat "$TMP/blocks" | "$BIN/r_unwrap" | cat
+}
+
+run_eager() {
+    mkfifo "$TMP/s1" "$TMP/s2"
+    cat "$IN" > "$TMP/s1" &
+    "$BIN/eager" "$TMP/s1" "$TMP/s2" "$TMP/intermediate" &
+    cat "$TMP/s2"
+    wait
+    rm -f "$TMP/s1" "$TMP/s2" "$TMP/intermediate"
+}
+
+measure "r_merge" run_r_merge
+PASH_NO_SPLICE=1 measure "r_merge (no splice)" run_r_merge
+measure "r_unwrap" run_r_unwrap
+PASH_NO_SPLICE=1 measure "r_unwrap (no splice)" run_r_unwrap
+measure "eager" run_eager
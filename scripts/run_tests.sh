@@ -14,4 +14,6 @@ cd "$PASH_TOP/evaluation/tests/interface_tests"
 
 echo "Running compiler tests..."
 cd "$PASH_TOP/evaluation/tests/"
+./test_declare_parsing.sh
+./test_line_framing.sh
 ./test_evaluation_scripts.sh